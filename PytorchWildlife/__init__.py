@@ -5,6 +5,11 @@ try:
 except importlib_metadata.PackageNotFoundError:
     __version__ = "development"
 
-from .data import *
-from .models import *
-from .utils import *
\ No newline at end of file
+# The data, models and utils names are available at the package level, but their submodules and
+# dependencies (ultralytics, yolov5, supervision, cv2...) are only imported on first use
+from ._lazy import attach
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "data": None,
+    "models": None,
+    "utils": None,
+})
\ No newline at end of file
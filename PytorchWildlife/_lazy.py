@@ -0,0 +1,51 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Lazy loading of the package submodules, so that heavy dependencies are only imported when used. """
+
+import sys
+import importlib
+
+# Name tables passed to attach, by package name, so that tests can check them against the __all__ of each submodule
+TABLES = {}
+
+
+def attach(package_name, submodules):
+    """
+    Make the names exported by the submodules of a package available as package attributes that import
+    their submodule on first access (PEP 562), instead of star-importing every submodule up front.
+    As with star imports, a name exported by several submodules resolves to the last one.
+
+    Args:
+        package_name (str):
+            __name__ of the package.
+        submodules (dict):
+            Mapping of submodule names to the list of names they export, in star-import order. None instead
+            of a list takes the __all__ of the submodule, for subpackages that are lazy themselves.
+
+    Returns:
+        tuple: __getattr__, __dir__ and __all__ of the package.
+    """
+    TABLES[package_name] = submodules
+    exports = {}
+    for submodule, names in submodules.items():
+        if names is None:
+            names = importlib.import_module(f".{submodule}", package_name).__all__
+        for name in names:
+            exports[name] = submodule
+    __all__ = list(exports)
+
+    def __getattr__(name):
+        if name in submodules:
+            return importlib.import_module(f".{name}", package_name)
+        if name not in exports:
+            raise AttributeError(f"module '{package_name}' has no attribute '{name}'")
+        value = getattr(importlib.import_module(f".{exports[name]}", package_name), name)
+        # Caching the resolved attribute, so later accesses do not go through __getattr__
+        setattr(sys.modules[package_name], name, value)
+        return value
+
+    def __dir__():
+        return sorted(set(sys.modules[package_name].__dict__) | set(__all__) | set(submodules))
+
+    return __getattr__, __dir__, __all__
@@ -1,2 +1,10 @@
-from .datasets import *
-from .transforms import *
\ No newline at end of file
+from .._lazy import attach
+
+# Submodules are imported on first access to one of their names
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "datasets": ["DetectionImageFolder", "AspectRatioBatchSampler"],
+    "transforms": ["MegaDetector_v5_Transform", "Classification_Inference_Transform",
+                   "TiledTransform", "tile_windows"],
+    "loaders": ["build_inference_loader", "DevicePrefetcher"],
+    "results": ["DetectionBatch", "DetectionView"],
+})
\ No newline at end of file
@@ -2,16 +2,21 @@
 # Licensed under the MIT License.
 
 import os
+import math
 from glob import glob
+from collections import OrderedDict
 from PIL import Image
 import numpy as np
 import supervision as sv
 import torch
-from torch.utils.data import Dataset
+from torch.utils.data import Dataset, Sampler
+
+from .results import DetectionBatch
 
 # Making the DetectionImageFolder class available for import from this module
 __all__ = [
     "DetectionImageFolder",
+    "AspectRatioBatchSampler",
     ]
 
 # Define the allowed image extensions  
@@ -32,18 +37,26 @@ class DetectionImageFolder(Dataset):
     the image's path, and the original size of the image.
     """
 
-    def __init__(self, image_dir, transform=None):
+    def __init__(self, image_dir, transform=None, exclude=None, draft_size=None):
         """
         Initializes the dataset.
 
         Parameters:
             image_dir (str): Path to the directory containing the images.
             transform (callable, optional): Optional transform to be applied on the image.
+            exclude (iterable, optional): Image paths to skip, e.g. images already recorded in a checkpoint journal.
+            draft_size (int, optional): If given, JPEG images are decoded at a reduced scale (1/2, 1/4 or 1/8)
+                using libjpeg DCT scaling, picking the smallest scale whose longest side is still at least draft_size.
+                The returned original size is always the full-resolution size. Defaults to None.
         """
         super(DetectionImageFolder, self).__init__()
         self.image_dir = image_dir
         self.transform = transform
+        self.draft_size = draft_size
         self.images = [os.path.join(dp, f) for dp, dn, filenames in os.walk(image_dir) for f in filenames if is_image_file(f)] # dp: directory path, dn: directory name, f: filename
+        if exclude:
+            exclude = set(exclude)
+            self.images = [img for img in self.images if img not in exclude]
 
     def __getitem__(self, idx):
         """
@@ -59,14 +72,46 @@ class DetectionImageFolder(Dataset):
         img_path = self.images[idx]
 
         # Load and convert image to RGB
-        img = Image.open(img_path).convert("RGB")
-        img_size_ori = img.size[::-1]
+        img, img_size_ori = self._open(img_path)
+        img = img.convert("RGB")
         
         # Apply transformation if specified
         if self.transform:
             img = self.transform(img)
 
         return img, img_path, torch.tensor(img_size_ori)
+
+    def _open(self, img_path):
+        """
+        Opens an image lazily and configures reduced-resolution decoding if draft_size is set.
+
+        Parameters:
+            img_path (str): Path to the image.
+
+        Returns:
+            tuple: The opened PIL image and its original (height, width).
+        """
+        img = Image.open(img_path)
+        img_size_ori = img.size[::-1]
+        if self.draft_size:
+            scale = self.draft_size / max(img.size)
+            img.draft("RGB", (math.ceil(img.size[0] * scale), math.ceil(img.size[1] * scale)))
+        return img, img_size_ori
+
+    def image_sizes(self):
+        """
+        Reads the (height, width) of every image as it will be decoded, from the file headers only.
+        This is the original size unless draft_size reduces the decoding scale.
+
+        Returns:
+            list: Decoded image sizes, in dataset order.
+        """
+        sizes = []
+        for img_path in self.images:
+            img, _ = self._open(img_path)
+            sizes.append(img.size[::-1])
+            img.close()
+        return sizes
     
     def __len__(self):
         """
@@ -77,6 +122,38 @@ class DetectionImageFolder(Dataset):
         """
         return len(self.images)
 
+class AspectRatioBatchSampler(Sampler):
+    """
+    A batch sampler that groups images with the same bucket key into the same batches.
+    Used for rectangular inference, where images are letterboxed to the smallest stride-aligned
+    rectangle and only images with the same letterboxed shape can be collated together.
+    """
+
+    def __init__(self, img_sizes, batch_size, key=None):
+        """
+        Initializes the sampler.
+
+        Parameters:
+            img_sizes (list): (height, width) of each image, as returned by DetectionImageFolder.image_sizes.
+            batch_size (int): Maximum number of images per batch.
+            key (callable, optional): Function mapping an image size to its bucket, e.g. the letterboxed shape.
+                Defaults to the original size itself.
+        """
+        super(AspectRatioBatchSampler, self).__init__()
+        self.batch_size = batch_size
+        key = key or tuple
+        self.buckets = OrderedDict()
+        for idx, size in enumerate(img_sizes):
+            self.buckets.setdefault(key(size), []).append(idx)
+
+    def __iter__(self):
+        for indices in self.buckets.values():
+            for i in range(0, len(indices), self.batch_size):
+                yield indices[i:i + self.batch_size]
+
+    def __len__(self):
+        return sum((len(indices) + self.batch_size - 1) // self.batch_size for indices in self.buckets.values())
+
 # TODO: Under development for efficiency improvement
 class DetectionCrops(Dataset):
 
@@ -92,6 +169,12 @@ class DetectionCrops(Dataset):
         self.load_detection_results()
 
     def load_detection_results(self):
+        if isinstance(self.detection_results, DetectionBatch):
+            # Selecting the animal detections of all images at once from the columnar arrays
+            animal = self.detection_results.class_id == self.animal_cls_id
+            self.img_ids = [self.detection_results.img_ids[i] for i in self.detection_results.image_index[animal]]
+            self.xyxys = list(self.detection_results.xyxy[animal])
+            return
         for det in self.detection_results:
             for xyxy, det_id in zip(det["detections"].xyxy, det["detections"].class_id):
                 # Only run recognition on animal detections
@@ -99,6 +182,16 @@ class DetectionCrops(Dataset):
                     self.img_ids.append(det["img_id"])
                     self.xyxys.append(xyxy)
 
+    def crop_sources(self):
+        """
+        Get the source image path and box of every crop, without loading the images.
+
+        Returns:
+            list: (image path, xyxy) tuples, in dataset order.
+        """
+        return [(os.path.join(self.path_head, img_id) if self.path_head else img_id, xyxy)
+                for img_id, xyxy in zip(self.img_ids, self.xyxys)]
+
     def __getitem__(self, idx):
         """
         Retrieves an image from the dataset.
@@ -0,0 +1,152 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Data loading utilities for batched inference. """
+
+import queue
+import threading
+
+import torch
+from torch.utils.data import DataLoader
+
+# Making the loader helpers available for import from this module
+__all__ = [
+    "build_inference_loader",
+    "DevicePrefetcher",
+    ]
+
+
+def build_inference_loader(dataset, batch_size=16, num_workers=0, prefetch_factor=None,
+                           persistent_workers=False, pin_memory=True, batch_sampler=None):
+    """
+    Builds a DataLoader for inference with optional parallel decoding workers.
+
+    Args:
+        dataset (torch.utils.data.Dataset): Dataset to load images from.
+        batch_size (int, optional): Batch size for inference. Defaults to 16.
+        num_workers (int, optional): Number of worker processes used to decode and transform images.
+            Defaults to 0 (decoding on the main thread).
+        prefetch_factor (int, optional): Number of batches loaded in advance by each worker. Only used
+            when num_workers > 0. Defaults to None (PyTorch default).
+        persistent_workers (bool, optional): Keep worker processes alive when the loader is iterated
+            more than once. Only used when num_workers > 0. Defaults to False.
+        pin_memory (bool, optional): Whether to use pinned host memory for the batches. Defaults to True.
+        batch_sampler (torch.utils.data.Sampler, optional): Sampler yielding lists of indices. When given,
+            batch_size is ignored. Defaults to None.
+
+    Returns:
+        torch.utils.data.DataLoader: The inference loader.
+    """
+    kwargs = {}
+    if num_workers > 0:
+        kwargs["persistent_workers"] = persistent_workers
+        if prefetch_factor is not None:
+            kwargs["prefetch_factor"] = prefetch_factor
+
+    if batch_sampler is not None:
+        return DataLoader(dataset, batch_sampler=batch_sampler, pin_memory=pin_memory,
+                          num_workers=num_workers, **kwargs)
+
+    return DataLoader(dataset, batch_size=batch_size, shuffle=False, pin_memory=pin_memory,
+                      num_workers=num_workers, drop_last=False, **kwargs)
+
+
+class DevicePrefetcher:
+    """
+    Wraps a DataLoader and copies the next batches to the target device on a background thread,
+    so that host-to-device transfers overlap with model inference.
+    Only the batch elements at device_indices (by default the images) are moved to the device; other
+    elements (e.g. image paths and original sizes) are kept as they are.
+    """
+
+    def __init__(self, loader, device="cpu", depth=2, device_indices=(0,)):
+        """
+        Initializes the prefetcher.
+
+        Args:
+            loader (iterable): Iterable of batches, usually a DataLoader.
+            device (str or torch.device, optional): Device the batches are copied to. Defaults to "cpu".
+            depth (int, optional): Maximum number of batches kept ready in advance. Defaults to 2.
+            device_indices (tuple, optional): Positions of the batch elements copied to the device, when
+                batches are tuples or lists. Defaults to (0,), the images.
+        """
+        self.loader = loader
+        self.device = torch.device(device)
+        self.depth = depth
+        self.device_indices = tuple(device_indices)
+
+    def __len__(self):
+        """
+        Returns the number of batches of the wrapped loader.
+        """
+        return len(self.loader)
+
+    def _to_device(self, batch):
+        if isinstance(batch, torch.Tensor):
+            return batch.to(self.device, non_blocking=True)
+        if isinstance(batch, (list, tuple)):
+            return type(batch)(self._to_device(b) if i in self.device_indices else b for i, b in enumerate(batch))
+        return batch
+
+    @staticmethod
+    def _device_tensors(batch):
+        if isinstance(batch, torch.Tensor):
+            return [batch] if batch.is_cuda else []
+        if isinstance(batch, (list, tuple)):
+            return [t for b in batch for t in DevicePrefetcher._device_tensors(b)]
+        return []
+
+    @staticmethod
+    def _put(out_queue, item, stop_event):
+        while not stop_event.is_set():
+            try:
+                out_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _worker(self, out_queue, stop_event):
+        stream = torch.cuda.Stream(device=self.device) if self.device.type == "cuda" else None
+        try:
+            for batch in self.loader:
+                event = None
+                if stream is not None:
+                    # The copies are queued on a side stream, the consumer stream waits on this event
+                    with torch.cuda.stream(stream):
+                        batch = self._to_device(batch)
+                        event = torch.cuda.Event()
+                        event.record(stream)
+                else:
+                    batch = self._to_device(batch)
+                if not self._put(out_queue, (batch, event), stop_event):
+                    return
+        except Exception as e:
+            self._put(out_queue, e, stop_event)
+            return
+        self._put(out_queue, StopIteration(), stop_event)
+
+    def __iter__(self):
+        out_queue = queue.Queue(maxsize=self.depth)
+        stop_event = threading.Event()
+        thread = threading.Thread(target=self._worker, args=(out_queue, stop_event), daemon=True)
+        thread.start()
+        try:
+            while True:
+                item = out_queue.get()
+                if isinstance(item, StopIteration):
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                batch, event = item
+                if event is not None:
+                    current_stream = torch.cuda.current_stream(self.device)
+                    current_stream.wait_event(event)
+                    # Marking the copies as used by the consumer stream, so that their memory is not
+                    # reused by the allocator while kernels queued on it still read them
+                    for tensor in self._device_tensors(batch):
+                        tensor.record_stream(current_stream)
+                yield batch
+        finally:
+            stop_event.set()
+            thread.join()
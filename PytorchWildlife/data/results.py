@@ -0,0 +1,283 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Columnar container for the detection results of many images. """
+
+from collections.abc import Mapping
+
+import numpy as np
+import supervision as sv
+
+# Making the result containers available for import from this module
+__all__ = [
+    "DetectionBatch",
+    "DetectionView",
+    ]
+
+
+class DetectionBatch:
+    """
+    Detection results of many images stored as contiguous arrays: the boxes, confidences and class IDs
+    of all images are concatenated, and offsets[i]:offsets[i + 1] delimits the detections of image i.
+
+    Iterating over a batch, or indexing it with an integer, gives a DetectionView per image, a read-only
+    mapping with the same keys as the result dicts of the detectors ("img_id", "detections", "labels",
+    "normalized_coords"). The supervision Detections, label strings and normalized coordinates of a view
+    are only built when they are accessed.
+    """
+
+    def __init__(self, img_ids, xyxy, confidence, class_id, offsets, img_sizes=None, class_names=None):
+        """
+        Initializes the batch.
+
+        Parameters:
+            img_ids (list): Image IDs, one per image.
+            xyxy (numpy.ndarray): Boxes of all images in xyxy pixel format, shape [M, 4].
+            confidence (numpy.ndarray): Confidence of each detection, shape [M].
+            class_id (numpy.ndarray): Class ID of each detection, shape [M].
+            offsets (numpy.ndarray): Start of the detections of each image, shape [N + 1], with offsets[-1] == M.
+            img_sizes (numpy.ndarray, optional): Original (height, width) of each image, shape [N, 2].
+                Needed for normalized coordinates. Defaults to None.
+            class_names (dict, optional): Mapping of class IDs to names, used for labels. Defaults to None.
+        """
+        self.img_ids = list(img_ids)
+        self.xyxy = np.ascontiguousarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        self.confidence = np.ascontiguousarray(confidence, dtype=np.float32).reshape(-1)
+        self.class_id = np.ascontiguousarray(class_id, dtype=int).reshape(-1)
+        self.offsets = np.ascontiguousarray(offsets, dtype=np.int64).reshape(-1)
+        self.img_sizes = None if img_sizes is None else np.asarray(img_sizes, dtype=np.int64).reshape(-1, 2)
+        self.class_names = class_names
+        self._image_index = None
+
+        assert len(self.offsets) == len(self.img_ids) + 1 and self.offsets[-1] == len(self.xyxy), \
+            "offsets should have one entry per image plus one, ending with the number of detections"
+        assert len(self.confidence) == len(self.xyxy) and len(self.class_id) == len(self.xyxy), \
+            "xyxy, confidence and class_id should have one entry per detection"
+
+    @classmethod
+    def from_predictions(cls, img_ids, predictions, img_sizes=None, class_names=None):
+        """
+        Builds a batch from per-image prediction arrays.
+
+        Parameters:
+            img_ids (list): Image IDs, one per image.
+            predictions (list): Predictions of each image in xyxy, confidence, class_id format, shape [n_i, 6].
+            img_sizes (list, optional): Original (height, width) of each image. Defaults to None.
+            class_names (dict, optional): Mapping of class IDs to names. Defaults to None.
+
+        Returns:
+            DetectionBatch: The batch.
+        """
+        counts = [len(preds) for preds in predictions]
+        offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        preds = np.concatenate([np.asarray(p, dtype=np.float32).reshape(-1, 6) for p in predictions]) \
+            if predictions else np.zeros((0, 6), dtype=np.float32)
+        return cls(img_ids, preds[:, :4], preds[:, 4], preds[:, 5].astype(int), offsets,
+                   img_sizes=img_sizes, class_names=class_names)
+
+    @classmethod
+    def from_results(cls, results, img_sizes=None, class_names=None):
+        """
+        Builds a batch from a list of per-image result dicts.
+
+        Parameters:
+            results (list): Detection results containing image ID and detections.
+            img_sizes (list, optional): Original (height, width) of each image. Defaults to None.
+            class_names (dict, optional): Mapping of class IDs to names. Defaults to None.
+
+        Returns:
+            DetectionBatch: The batch.
+        """
+        img_ids, predictions = [], []
+        for res in results:
+            det = res["detections"]
+            img_ids.append(res["img_id"])
+            predictions.append(np.column_stack([np.asarray(det.xyxy).reshape(-1, 4), det.confidence, det.class_id]))
+        return cls.from_predictions(img_ids, predictions, img_sizes=img_sizes, class_names=class_names)
+
+    @classmethod
+    def concatenate(cls, batches):
+        """
+        Concatenates several batches, e.g. the batches of several shards of a job.
+
+        Parameters:
+            batches (list): Batches to concatenate.
+
+        Returns:
+            DetectionBatch: The concatenated batch.
+        """
+        batches = list(batches)
+        if not batches:
+            return cls([], np.zeros((0, 4)), np.zeros(0), np.zeros(0), np.zeros(1))
+        offsets = [batches[0].offsets]
+        for batch in batches[1:]:
+            offsets.append(batch.offsets[1:] + offsets[-1][-1])
+        img_sizes = None
+        if all(batch.img_sizes is not None for batch in batches):
+            img_sizes = np.concatenate([batch.img_sizes for batch in batches])
+        return cls(
+            [img_id for batch in batches for img_id in batch.img_ids],
+            np.concatenate([batch.xyxy for batch in batches]),
+            np.concatenate([batch.confidence for batch in batches]),
+            np.concatenate([batch.class_id for batch in batches]),
+            np.concatenate(offsets),
+            img_sizes=img_sizes,
+            class_names=batches[0].class_names,
+        )
+
+    def __len__(self):
+        """
+        Returns the number of images in the batch.
+        """
+        return len(self.img_ids)
+
+    @property
+    def num_detections(self):
+        """
+        Total number of detections over all images.
+        """
+        return len(self.xyxy)
+
+    @property
+    def counts(self):
+        """
+        Number of detections of each image.
+        """
+        return np.diff(self.offsets)
+
+    @property
+    def image_index(self):
+        """
+        Index of the image of each detection, shape [M].
+        """
+        if self._image_index is None:
+            self._image_index = np.repeat(np.arange(len(self.img_ids)), self.counts)
+        return self._image_index
+
+    def _slice(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Image index {idx} out of range for a batch of {len(self)} images")
+        return slice(self.offsets[idx], self.offsets[idx + 1])
+
+    def __getitem__(self, idx):
+        """
+        Gets the view of one image, or a sub-batch for a slice of images.
+        """
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(len(self))
+            assert step == 1, "Only contiguous slices of a DetectionBatch are supported"
+            stop = max(start, stop)
+            det = slice(self.offsets[start], self.offsets[stop])
+            return DetectionBatch(
+                self.img_ids[start:stop], self.xyxy[det], self.confidence[det], self.class_id[det],
+                self.offsets[start:stop + 1] - self.offsets[start],
+                img_sizes=None if self.img_sizes is None else self.img_sizes[start:stop],
+                class_names=self.class_names,
+            )
+        self._slice(idx)
+        return DetectionView(self, idx if idx >= 0 else idx + len(self))
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield DetectionView(self, idx)
+
+    def detections(self, idx):
+        """
+        Gets the detections of one image. The arrays are views into the batch arrays.
+
+        Parameters:
+            idx (int): Image index.
+
+        Returns:
+            supervision.Detections: Detections of the image.
+        """
+        det = self._slice(idx)
+        return sv.Detections(xyxy=self.xyxy[det], confidence=self.confidence[det], class_id=self.class_id[det])
+
+    def labels(self, idx=None):
+        """
+        Gets the "<class name> <confidence>" labels of one image, or of all detections.
+
+        Parameters:
+            idx (int, optional): Image index. Defaults to None (all detections).
+
+        Returns:
+            list: Label strings.
+        """
+        det = slice(None) if idx is None else self._slice(idx)
+        names = self.class_names or {}
+        return [
+            f"{names.get(class_id, class_id)} {confidence:0.2f}"
+            for confidence, class_id in zip(self.confidence[det], self.class_id[det].tolist())
+        ]
+
+    def normalized_coords(self, idx=None):
+        """
+        Gets the boxes normalized by the original image sizes, in xyxy format, of one image or of all detections.
+
+        Parameters:
+            idx (int, optional): Image index. Defaults to None (all detections).
+
+        Returns:
+            numpy.ndarray: Normalized boxes, shape [n, 4].
+        """
+        assert self.img_sizes is not None, "Normalized coordinates need the original image sizes"
+        if idx is None:
+            det, hw = slice(None), self.img_sizes[self.image_index]
+        else:
+            det, hw = self._slice(idx), self.img_sizes[idx][None]
+        scale = np.concatenate([hw[:, ::-1], hw[:, ::-1]], axis=1).astype(float)
+        return self.xyxy[det] / scale
+
+    def to_results(self):
+        """
+        Converts the batch to the list of result dicts returned by batch_image_detection.
+
+        Returns:
+            list: Detection results, one dict per image.
+        """
+        return [dict(view) for view in self]
+
+
+class DetectionView(Mapping):
+    """
+    Read-only, lazily evaluated result dict of one image of a DetectionBatch.
+    """
+
+    def __init__(self, batch, idx):
+        self._batch = batch
+        self._idx = idx
+        self._cache = {}
+
+    def _keys(self):
+        keys = ["img_id", "detections", "labels"]
+        if self._batch.img_sizes is not None:
+            keys.append("normalized_coords")
+        return keys
+
+    def __getitem__(self, key):
+        if key not in self._cache:
+            if key == "img_id":
+                value = self._batch.img_ids[self._idx]
+            elif key == "detections":
+                value = self._batch.detections(self._idx)
+            elif key == "labels":
+                value = self._batch.labels(self._idx)
+            elif key == "normalized_coords" and self._batch.img_sizes is not None:
+                value = self._batch.normalized_coords(self._idx).tolist()
+            else:
+                raise KeyError(key)
+            self._cache[key] = value
+        return self._cache[key]
+
+    def __iter__(self):
+        return iter(self._keys())
+
+    def __len__(self):
+        return len(self._keys())
+
+    def __repr__(self):
+        return f"DetectionView(img_id={self['img_id']!r}, detections={len(self['detections'])})"
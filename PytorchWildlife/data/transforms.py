@@ -11,10 +11,39 @@ from PIL import Image
 # Making the provided classes available for import from this module
 __all__ = [
     "MegaDetector_v5_Transform",
-    "Classification_Inference_Transform"
+    "Classification_Inference_Transform",
+    "TiledTransform",
+    "tile_windows"
 ]
 
 
+def letterbox_shape(shape, new_shape=(640, 640), auto=False, scaleup=True, stride=32):
+    """
+    Compute the output shape of letterbox for an image of the given shape, without loading the image.
+
+    Parameters:
+    shape (tuple): Original (height, width) of the image.
+    new_shape (tuple or int, optional): The target size of the image, in the form (height, width). Defaults to (640, 640).
+    auto (bool, optional): Pad to the smallest stride-aligned rectangle instead of the full new_shape. Defaults to False.
+    scaleup (bool, optional): Allow the function to scale up the image. Defaults to True.
+    stride (int, optional): The stride used in the model. Defaults to 32.
+
+    Returns:
+    tuple: The (height, width) of the letterboxed image.
+    """
+    if isinstance(new_shape, int):
+        new_shape = (new_shape, new_shape)
+
+    r = min(new_shape[0] / shape[0], new_shape[1] / shape[1])
+    if not scaleup:
+        r = min(r, 1.0)
+
+    new_unpad = (int(round(shape[0] * r)), int(round(shape[1] * r)))
+    if not auto:
+        return tuple(new_shape)
+    return tuple(n + (s - n) % stride for n, s in zip(new_unpad, new_shape))
+
+
 def letterbox(im, new_shape=(640, 640), color=(114, 114, 114), auto=False, scaleFill=False, scaleup=True, stride=32):
     """
     Resize and pad an image to a desired shape while keeping the aspect ratio unchanged. 
@@ -24,6 +53,7 @@ def letterbox(im, new_shape=(640, 640), color=(114, 114, 114), auto=False, scale
 
     Parameters:
     im (PIL.Image.Image or torch.Tensor): The input image. It can be a PIL image or a PyTorch tensor.
+        uint8 tensors are resized and padded without conversion to float and returned as uint8.
     new_shape (tuple, optional): The target size of the image, in the form (height, width). Defaults to (640, 640).
     color (tuple, optional): The color used for padding. Defaults to (114, 114, 114).
     auto (bool, optional): Adjust padding to ensure the padded image is a multiple of stride. Defaults to True.
@@ -32,10 +62,7 @@ def letterbox(im, new_shape=(640, 640), color=(114, 114, 114), auto=False, scale
     stride (int, optional): The stride used in the model. The padding is adjusted to be a multiple of this stride. Defaults to 32.
 
     Returns:
-    tuple: A tuple containing:
-        - The transformed image as a torch.Tensor.
-        - The scale ratios as a tuple (width_ratio, height_ratio).
-        - The padding applied as a tuple (width_padding, height_padding).
+    torch.Tensor: The transformed image, float in [0, 1] or uint8 in [0, 255] depending on the input.
     """
 
     # Convert PIL Image to Torch Tensor
@@ -76,7 +103,10 @@ def letterbox(im, new_shape=(640, 640), color=(114, 114, 114), auto=False, scale
 
     # Pad image
     padding = (int(round(dw - 0.1)), int(round(dw + 0.1)), int(round(dh + 0.1)), int(round(dh - 0.1)))
-    im = F.pad(im*255.0, padding, value=114)/255.0
+    if im.dtype == torch.uint8:
+        im = F.pad(im, padding, value=color[0])
+    else:
+        im = F.pad(im, padding, value=color[0] / 255.0)
 
     return im
 
@@ -88,16 +118,23 @@ class MegaDetector_v5_Transform:
 
     """
 
-    def __init__(self, target_size=1280, stride=32):
+    def __init__(self, target_size=1280, stride=32, keep_uint8=False, rect=False):
         """
         Initializes the transform.
 
         Args:
             target_size (int): Desired size for the image's longest side after resizing.
             stride (int): Stride value for resizing.
+            keep_uint8 (bool): Keep the image as uint8 through resizing and padding. The detector then
+                normalizes the batch to float on the device, which cuts host memory and transfer volume by 4x.
+            rect (bool): Pad to the smallest stride-aligned rectangle instead of a full target_size square.
+                Images of different aspect ratios then have different shapes and must be batched with
+                PytorchWildlife.data.AspectRatioBatchSampler.
         """
         self.target_size = target_size
         self.stride = stride
+        self.keep_uint8 = keep_uint8
+        self.rect = rect
 
     def __call__(self, np_img):
         """
@@ -109,18 +146,98 @@ class MegaDetector_v5_Transform:
         Returns:
             torch.Tensor: Transformed image.
         """
+        if self.keep_uint8:
+            # Convert to a uint8 CHW tensor without normalization
+            np_img = np.ascontiguousarray(np.asarray(np_img, dtype=np.uint8).transpose((2, 0, 1)))
+            np_img = torch.from_numpy(np_img)
+
         # Convert the image to a PyTorch tensor and normalize it
-        if isinstance(np_img, np.ndarray):
+        elif isinstance(np_img, np.ndarray):
             np_img = np_img.transpose((2, 0, 1))
             np_img = np.ascontiguousarray(np_img)
             np_img = torch.from_numpy(np_img).float()
             np_img /= 255.0
 
         # Resize and pad the image using a customized letterbox function. 
-        img = letterbox(np_img, new_shape=self.target_size, stride=self.stride, auto=False)
+        img = letterbox(np_img, new_shape=self.target_size, stride=self.stride, auto=self.rect)
 
         return img
 
+def tile_windows(img_size, tile_size, overlap=0.2):
+    """
+    Compute the windows of overlapping square tiles covering an image. The last tile of each row and
+    column is aligned with the image border, so every tile has the full tile size unless the image is
+    smaller than a tile.
+
+    Parameters:
+    img_size (tuple): Original (height, width) of the image.
+    tile_size (int): Side of the square tiles.
+    overlap (float, optional): Fraction of the tile size shared by neighboring tiles. Defaults to 0.2.
+
+    Returns:
+    list: (x0, y0, x1, y1) windows in image pixels, row by row.
+    """
+    assert tile_size > 0, "tile_size should be positive"
+    assert 0 <= overlap < 1, "overlap should be in [0, 1)"
+    stride = max(1, int(tile_size * (1 - overlap)))
+
+    def starts(length):
+        if length <= tile_size:
+            return [0]
+        return list(range(0, length - tile_size, stride)) + [length - tile_size]
+
+    height, width = int(img_size[0]), int(img_size[1])
+    return [(x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+            for y0 in starts(height) for x0 in starts(width)]
+
+
+class TiledTransform:
+    """
+    A transformation class splitting an image into overlapping tiles, for the detection of small objects
+    in large images. Each tile goes through the base transform, and the tiles are returned stacked so that
+    a DataLoader worker prepares all tiles of an image at once.
+    """
+
+    def __init__(self, transform, tile_size, overlap=0.2, full_image=True):
+        """
+        Initializes the transform.
+
+        Args:
+            transform (callable): Transform applied to each tile, e.g. MegaDetector_v5_Transform.
+            tile_size (int): Side of the square tiles, in original image pixels.
+            overlap (float): Fraction of the tile size shared by neighboring tiles.
+            full_image (bool): Append the whole image as a last tile when the image is split, so that
+                objects larger than a tile are still detected.
+        """
+        self.transform = transform
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.full_image = full_image
+
+    def windows(self, img_size):
+        """
+        Windows of the tiles of an image of the given (height, width), in the order of the returned tiles.
+        The full image window comes last when it is included.
+        """
+        windows = tile_windows(img_size, self.tile_size, self.overlap)
+        if self.full_image and len(windows) > 1:
+            windows.append((0, 0, int(img_size[1]), int(img_size[0])))
+        return windows
+
+    def __call__(self, img):
+        """
+        Applies the transformation on the provided image.
+
+        Args:
+            img (np.ndarray): Input image as a numpy array or PIL Image.
+
+        Returns:
+            torch.Tensor: Transformed tiles in [T, C, H, W] format.
+        """
+        img = np.asarray(img)
+        return torch.stack([self.transform(img[y0:y1, x0:x1]) for x0, y0, x1, y1 in self.windows(img.shape[:2])])
+
+
 class Classification_Inference_Transform:
     """
     A transformation class to preprocess images for classification inference.
@@ -1,2 +1,11 @@
-from .classification import *
-from .detection import *
\ No newline at end of file
+from .._lazy import attach
+
+# Submodules are imported on first access to one of their names
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "classification": None,
+    "detection": None,
+    "weight_cache": ["get_weights", "weights_cache_dir", "verify_weights"],
+    "registry": ["ModelRegistry", "model_memory_footprint"],
+    "batching": ["MicroBatchEngine"],
+    "sharding": ["ShardedRunner"],
+})
\ No newline at end of file
@@ -0,0 +1,273 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Dynamic micro-batching of single-image requests from many threads or asyncio tasks. """
+
+# Importing basic libraries
+import time
+import queue
+import asyncio
+import threading
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+__all__ = [
+    "MicroBatchEngine"
+]
+
+
+class _Request:
+    """
+    Single-image request waiting in the engine queue.
+    """
+    __slots__ = ("img", "img_id", "future", "submitted")
+
+    def __init__(self, img, img_id):
+        self.img = img
+        self.img_id = img_id
+        self.future = Future()
+        self.submitted = time.perf_counter()
+
+
+class MicroBatchEngine:
+    """
+    In-process inference engine coalescing single-image requests into batches. Requests submitted from
+    any thread or asyncio task are queued; a worker thread takes up to max_batch_size of them, waiting at
+    most max_wait_ms after the first one for the batch to fill, runs them through the batched path of the
+    model (multi_image_detection or multi_image_classification) and resolves the future of each request.
+
+    Example:
+        with MicroBatchEngine(detector, max_batch_size=16, max_wait_ms=5, det_conf_thres=0.2) as engine:
+            result = engine.predict(img)                # from a thread
+            result = await engine.predict_async(img)    # from an asyncio task
+    """
+
+    def __init__(self, model, max_batch_size=16, max_wait_ms=5.0, batch_fn=None, max_queue_size=0,
+                 stats_window=10000, **kwargs):
+        """
+        Initialize and start the engine.
+
+        Args:
+            model (torch.nn.Module):
+                Detector or classifier.
+            max_batch_size (int, optional):
+                Maximum number of requests per batch. Defaults to 16.
+            max_wait_ms (float, optional):
+                Maximum time to wait for a batch to fill after its first request, in milliseconds.
+                Defaults to 5.0.
+            batch_fn (callable, optional):
+                Function called with (imgs, img_ids, **kwargs) and returning one result per image. Defaults to
+                the multi_image_detection or multi_image_classification method of the model.
+            max_queue_size (int, optional):
+                Maximum number of queued requests, submit blocks when it is reached. Defaults to 0 (no limit).
+            stats_window (int, optional):
+                Number of recent requests and batches the latency statistics are computed over. Defaults to 10000.
+            **kwargs:
+                Arguments passed to batch_fn for every batch, e.g. det_conf_thres or id_strip.
+        """
+        assert max_batch_size > 0, "max_batch_size should be positive"
+        assert max_wait_ms >= 0, "max_wait_ms should not be negative"
+        if batch_fn is None:
+            batch_fn = getattr(model, "multi_image_detection", None) or getattr(model, "multi_image_classification", None)
+        assert batch_fn is not None, "The model has no batched path, pass batch_fn."
+        self.model = model
+        self.batch_fn = batch_fn
+        self.kwargs = kwargs
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._stopped = threading.Event()
+        # Held across the stopped check and the enqueue of submit, so that no request is queued after close
+        self._submit_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._latencies = deque(maxlen=stats_window)
+        self._queue_waits = deque(maxlen=stats_window)
+        self._batch_sizes = deque(maxlen=stats_window)
+        self.reset_stats()
+
+        self._worker = threading.Thread(target=self._run, name="MicroBatchEngine", daemon=True)
+        self._worker.start()
+
+    def submit(self, img, img_id=None):
+        """
+        Queue a single-image request.
+
+        Args:
+            img (str or numpy.ndarray):
+                Image path or ndarray.
+            img_id (str, optional):
+                Image path or identifier. Defaults to None.
+
+        Returns:
+            concurrent.futures.Future: Future resolved with the result of the image.
+        """
+        with self._submit_lock:
+            if self._stopped.is_set():
+                raise RuntimeError("The engine is closed.")
+            request = _Request(img, img_id)
+            with self._stats_lock:
+                if self._first_submit is None:
+                    self._first_submit = request.submitted
+            self._queue.put(request)
+        return request.future
+
+    def predict(self, img, img_id=None, timeout=None):
+        """
+        Run a single-image request and wait for its result.
+
+        Args:
+            img (str or numpy.ndarray):
+                Image path or ndarray.
+            img_id (str, optional):
+                Image path or identifier. Defaults to None.
+            timeout (float, optional):
+                Maximum time to wait, in seconds. Defaults to None.
+
+        Returns:
+            dict: Result of the image.
+        """
+        return self.submit(img, img_id=img_id).result(timeout=timeout)
+
+    async def predict_async(self, img, img_id=None):
+        """
+        Run a single-image request from an asyncio task, without blocking the event loop.
+
+        Args:
+            img (str or numpy.ndarray):
+                Image path or ndarray.
+            img_id (str, optional):
+                Image path or identifier. Defaults to None.
+
+        Returns:
+            dict: Result of the image.
+        """
+        return await asyncio.wrap_future(self.submit(img, img_id=img_id))
+
+    def _next_batch(self):
+        """
+        Wait for a first request, then collect more until the batch is full or max_wait has passed.
+        """
+        try:
+            batch = [self._queue.get(timeout=0.1)]
+        except queue.Empty:
+            return []
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run_batch(self, batch):
+        """
+        Run a batch of requests. If the batch fails, its requests are retried one by one so that a single
+        bad image only fails its own request.
+
+        Returns:
+            list: (request, result, exception) tuples.
+        """
+        try:
+            results = self.batch_fn([r.img for r in batch], [r.img_id for r in batch], **self.kwargs)
+            assert len(results) == len(batch), "batch_fn should return one result per image"
+        except Exception as e:
+            if len(batch) == 1:
+                return [(batch[0], None, e)]
+            return [outcome for request in batch for outcome in self._run_batch([request])]
+        return [(request, result, None) for request, result in zip(batch, results)]
+
+    def _run(self):
+        while not (self._stopped.is_set() and self._queue.empty()):
+            batch = [request for request in self._next_batch() if request.future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+            start = time.perf_counter()
+            outcomes = self._run_batch(batch)
+            done = time.perf_counter()
+
+            # Recording the statistics before resolving the futures, so they include every returned request
+            with self._stats_lock:
+                self._batch_sizes.append(len(batch))
+                self._batches += 1
+                self._busy += done - start
+                for request, _, error in outcomes:
+                    if error is not None:
+                        self._errors += 1
+                        continue
+                    self._completed += 1
+                    self._last_done = done
+                    self._latencies.append(done - request.submitted)
+                    self._queue_waits.append(start - request.submitted)
+
+            for request, result, error in outcomes:
+                if error is not None:
+                    request.future.set_exception(error)
+                else:
+                    request.future.set_result(result)
+
+    def stats(self):
+        """
+        Latency and throughput statistics since the engine started or reset_stats was called. Latencies
+        and batch sizes are computed over the last stats_window requests and batches.
+
+        Returns:
+            dict: Number of completed and failed requests, batches, mean batch size, throughput (requests
+            per second between the first submission and the last completion), device utilization (fraction
+            of that time spent running batches), and p50/p95/p99/max latency and mean queue wait in milliseconds.
+        """
+        with self._stats_lock:
+            latencies = np.array(self._latencies) * 1000
+            elapsed = 0
+            if self._completed and self._first_submit is not None:
+                elapsed = self._last_done - self._first_submit
+            stats = {
+                "completed": self._completed,
+                "errors": self._errors,
+                "batches": self._batches,
+                "mean_batch_size": float(np.mean(self._batch_sizes)) if self._batch_sizes else 0.0,
+                "throughput": self._completed / elapsed if elapsed > 0 else 0.0,
+                "utilization": self._busy / elapsed if elapsed > 0 else 0.0,
+                "queue_size": self._queue.qsize(),
+            }
+            for q in (50, 95, 99):
+                stats[f"latency_p{q}_ms"] = float(np.percentile(latencies, q)) if len(latencies) else 0.0
+            stats["latency_max_ms"] = float(latencies.max()) if len(latencies) else 0.0
+            stats["queue_wait_mean_ms"] = float(np.mean(self._queue_waits) * 1000) if self._queue_waits else 0.0
+        return stats
+
+    def reset_stats(self):
+        """
+        Reset the statistics.
+        """
+        with self._stats_lock:
+            self._latencies.clear()
+            self._queue_waits.clear()
+            self._batch_sizes.clear()
+            self._completed = 0
+            self._errors = 0
+            self._batches = 0
+            self._busy = 0.0
+            self._first_submit = None
+            self._last_done = None
+
+    def close(self, wait=True):
+        """
+        Stop accepting requests. Queued requests are still processed.
+
+        Args:
+            wait (bool, optional): Wait for the queued requests to finish. Defaults to True.
+        """
+        with self._submit_lock:
+            self._stopped.set()
+        if wait:
+            self._worker.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -1,6 +1,11 @@
-from .base_classifier import *
-from .opossum import *
-from .amazon import *
-from .serengeti import *
-from .custom_weights import *
-from .amazon_v2 import *
\ No newline at end of file
+from ...._lazy import attach
+
+# Submodules are imported on first access to one of their names
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "base_classifier": ["PlainResNetInference"],
+    "opossum": ["AI4GOpossum"],
+    "amazon": ["AI4GAmazonRainforest"],
+    "serengeti": ["AI4GSnapshotSerengeti"],
+    "custom_weights": ["CustomWeights"],
+    "amazon_v2": ["AI4GAmazonRainforest_v2"],
+})
\ No newline at end of file
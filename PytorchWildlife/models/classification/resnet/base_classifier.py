@@ -1,6 +1,9 @@
 # Copyright (c) Microsoft Corporation. All rights reserved.
 # Licensed under the MIT License.
 
+import os
+import copy
+import json
 import numpy as np
 from PIL import Image
 from tqdm import tqdm
@@ -8,10 +11,13 @@ from collections import OrderedDict
 
 import torch
 import torch.nn as nn
+from torch.utils.data import DataLoader, Subset
 from torchvision.models.resnet import BasicBlock, Bottleneck, ResNet
-from torch.hub import load_state_dict_from_url
 
 from ....data import transforms as pw_trans
+from ....data import datasets as pw_data
+from ... import weight_cache as pw_weights
+from ....utils import result_cache as pw_result_cache
 
 # Making the PlainResNetInference class available for import from this module
 __all__ = ["PlainResNetInference"]
@@ -97,18 +103,49 @@ class PlainResNetClassifier(nn.Module):
         print("unused_keys:", sorted(list(unused_keys)))
 
 
+class QuantizedResNet(nn.Module):
+    """
+    Feature extractor and classifier of a quantized PlainResNetClassifier, traced as a single module.
+    """
+    def __init__(self, feature, classifier):
+        super(QuantizedResNet, self).__init__()
+        self.feature = feature
+        self.classifier = classifier
+
+    def forward(self, x):
+        return self.classifier(self.feature(x))
+
+
 class PlainResNetInference(nn.Module):
     """
     Inference module for the PlainResNet Classifier.
     """
+
+    # Image size used by the default transform
+    IMAGE_SIZE = 224
+
+    # Supported inference precisions and their autocast data types
+    PRECISIONS = {
+        "fp32": None,
+        "bf16": torch.bfloat16,
+        "fp16": torch.float16
+    }
+
+    # Supported post-training INT8 quantization modes
+    QUANTIZATION_MODES = ("dynamic", "static")
+
     def __init__(self, num_cls=36, num_layers=50, weights=None, device="cpu", url=None, transform=None):
         super(PlainResNetInference, self).__init__()
         self.device = device
+        self.precision = "fp32"
+        self.channels_last = False
+        self.quantization = None
+        self.quantized_net = None
         self.net = PlainResNetClassifier(num_cls=num_cls, num_layers=num_layers)
         if weights:
             clf_weights = torch.load(weights, map_location=torch.device(self.device))
         elif url:
-            clf_weights = load_state_dict_from_url(url, map_location=torch.device(self.device))
+            clf_weights = torch.load(pw_weights.get_weights(url), map_location=torch.device(self.device))
         else:
             raise Exception("Need weights for inference.")
         self.load_state_dict(clf_weights["state_dict"], strict=True)
@@ -134,10 +171,140 @@ class PlainResNetInference(nn.Module):
         """
         pass
 
+    def configure_inference(self, precision="fp32", channels_last=False, compile=False, warmup=True):
+        """
+        Configure reduced-precision and compiled inference. Result dicts keep the same format;
+        use PytorchWildlife.utils.compare_classification_results to check parity against fp32 outputs.
+
+        Args:
+            precision (str): Inference precision, one of "fp32", "bf16" or "fp16". Reduced precisions run
+                the network under torch.autocast (bf16 is supported on CPU). Defaults to "fp32".
+            channels_last (bool): Use the channels_last memory format for the network and its inputs. Defaults to False.
+            compile (bool): Compile the network with torch.compile. Defaults to False.
+            warmup (bool): Run a dummy forward pass so that compilation happens before the first real batch. Defaults to True.
+
+        Returns:
+            PlainResNetInference: The classifier itself.
+        """
+        assert precision in self.PRECISIONS, \
+            f"precision should be one of {list(self.PRECISIONS)}, got '{precision}'"
+        self.precision = precision
+        self.channels_last = channels_last
+        if channels_last:
+            self.net.to(memory_format=torch.channels_last)
+        if compile:
+            self.net.feature.compile()
+            self.net.classifier.compile()
+        if warmup:
+            with torch.no_grad():
+                self.forward(torch.zeros((1, 3, self.IMAGE_SIZE, self.IMAGE_SIZE), device=self.device))
+        return self
+
+    @staticmethod
+    def _quantized_engine():
+        """
+        Pick the best available quantized CPU engine.
+        """
+        for engine in ("x86", "fbgemm", "qnnpack"):
+            if engine in torch.backends.quantized.supported_engines:
+                return engine
+        raise Exception("No quantized engine available in this PyTorch build.")
+
+    def quantize(self, mode="dynamic", calibration_dir=None, num_calibration=256, batch_size=32, cache_path=None):
+        """
+        Switch to INT8 post-training quantized inference on CPU. Results keep the same format;
+        use PytorchWildlife.utils.compare_classification_results to check agreement with fp32 outputs.
+
+        Args:
+            mode (str): Quantization mode. "dynamic" quantizes the weights of the final linear layer and needs no
+                calibration, but gives essentially no speedup as the convolutions stay in fp32. Only "static"
+                speeds up inference: it also quantizes the convolutions and their activations, which is where ResNet
+                spends its time, and calibrates activation ranges on calibration_dir. Defaults to "dynamic".
+            calibration_dir (str): Folder of representative crops (e.g. saved with save_crop_images) used to calibrate
+                static quantization. Defaults to None.
+            num_calibration (int): Maximum number of crops used for calibration. Defaults to 256.
+            batch_size (int): Batch size used for calibration. Defaults to 32.
+            cache_path (str): Path of the quantized model cache. If it exists and was built with the same mode from the same
+                fp32 weights, it is loaded instead of quantizing again; otherwise the quantized model is saved there. Defaults to None.
+
+        Returns:
+            PlainResNetInference: The classifier itself.
+        """
+        assert mode in self.QUANTIZATION_MODES, \
+            f"mode should be one of {list(self.QUANTIZATION_MODES)}, got '{mode}'"
+        assert torch.device(self.device).type == "cpu", "INT8 quantized inference is only supported on CPU."
+        assert mode == "dynamic" or calibration_dir or (cache_path and os.path.exists(cache_path)), \
+            "Static quantization needs a calibration_dir of representative crops."
+
+        engine = self._quantized_engine()
+        torch.backends.quantized.engine = engine
+        # The fp32 weights are part of the key: classifiers with the same number of classes must not share a cache
+        metadata = {"mode": mode, "num_cls": self.net.num_cls, "num_layers": self.net.num_layers, "engine": engine,
+                    "weights": pw_result_cache.model_fingerprint(self.net)}
+
+        # Reusing a cached quantized model built with the same settings
+        if cache_path and os.path.exists(cache_path):
+            extra_files = {"metadata.json": ""}
+            cached = torch.jit.load(cache_path, map_location="cpu", _extra_files=extra_files)
+            if json.loads(extra_files["metadata.json"] or "{}") == metadata:
+                self.quantized_net = cached
+                self.quantization = mode
+                return self
+            print(f"Quantized model cache {cache_path} was built with different settings, quantizing again.")
+
+        example_input = torch.zeros((1, 3, self.IMAGE_SIZE, self.IMAGE_SIZE))
+        feature = self.net.feature.float().cpu().eval()
+        classifier = torch.ao.quantization.quantize_dynamic(
+            nn.Sequential(self.net.classifier.float().cpu().eval()), {nn.Linear}, dtype=torch.qint8, inplace=False
+        )
+
+        if mode == "static":
+            from torch.ao.quantization import get_default_qconfig_mapping
+            from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+            prepared = prepare_fx(copy.deepcopy(feature), get_default_qconfig_mapping(engine), (example_input,))
+            dataset = pw_data.DetectionImageFolder(calibration_dir, transform=self.transform)
+            assert len(dataset) > 0, f"No images found in {calibration_dir}"
+            loader = torch.utils.data.DataLoader(dataset, batch_size=batch_size, shuffle=False)
+            seen = 0
+            with torch.no_grad(), tqdm(total=min(len(dataset), num_calibration), desc="Calibrating") as pbar:
+                for imgs, _, _ in loader:
+                    imgs = imgs[:num_calibration - seen]
+                    prepared(imgs)
+                    seen += len(imgs)
+                    pbar.update(len(imgs))
+                    if seen >= num_calibration:
+                        break
+            feature = convert_fx(prepared)
+
+        with torch.no_grad():
+            quantized_net = torch.jit.freeze(torch.jit.trace(QuantizedResNet(feature, classifier).eval(), example_input))
+        if cache_path:
+            dirname = os.path.dirname(cache_path)
+            if dirname:
+                os.makedirs(dirname, exist_ok=True)
+            torch.jit.save(quantized_net, cache_path, _extra_files={"metadata.json": json.dumps(metadata)})
+
+        self.quantized_net = quantized_net
+        self.quantization = mode
+        return self
+
+    def _autocast(self):
+        """
+        Autocast context for the configured inference precision, disabled for fp32.
+        """
+        dtype = self.PRECISIONS[self.precision]
+        return torch.autocast(device_type=torch.device(self.device).type, dtype=dtype, enabled=dtype is not None)
+
     def forward(self, img):
-        feats = self.net.feature(img)
-        logits = self.net.classifier(feats)
-        return logits
+        if self.quantized_net is not None:
+            return self.quantized_net(img.float()).float()
+        if self.channels_last:
+            img = img.contiguous(memory_format=torch.channels_last)
+        with self._autocast():
+            feats = self.net.feature(img)
+            logits = self.net.classifier(feats)
+        return logits.float()
 
     def single_image_classification(self, img, img_id=None, id_strip=None):
         if type(img) == str:
@@ -148,22 +315,91 @@ class PlainResNetInference(nn.Module):
         logits = self.forward(img.unsqueeze(0).to(self.device))
         return self.results_generation(logits.cpu(), [img_id], id_strip=id_strip)[0]
 
-    def batch_image_classification(self, dataloader, id_strip=None):
+    @torch.no_grad()
+    def multi_image_classification(self, imgs, img_ids=None, id_strip=None):
+        """
+        Classify a list of in-memory images or image paths in one batched forward pass, e.g. requests
+        coalesced by MicroBatchEngine.
+
+        Args:
+            imgs (list): Image paths or ndarrays.
+            img_ids (list, optional): Image identifiers, one per image. Defaults to None.
+            id_strip (str, optional): Characters to strip from img_id. Defaults to None.
+
+        Returns:
+            list: Classification results, one dict per image.
+        """
+        img_ids = img_ids if img_ids is not None else [None] * len(imgs)
+        batch = torch.stack([
+            self.transform(Image.open(img) if isinstance(img, str) else Image.fromarray(img)) for img in imgs
+        ])
+        logits = self.forward(batch.to(self.device))
+        return self.results_generation(logits.cpu(), img_ids, id_strip=id_strip)
+
+    def batch_image_classification(self, dataloader, id_strip=None, cache=None):
         """
         Process a batch of images for classification.
+
+        Args:
+            dataloader (DataLoader): DataLoader of image crops, e.g. over PytorchWildlife.data.DetectionCrops.
+            id_strip (str, optional): Characters to strip from img_id. Defaults to None.
+            cache (PytorchWildlife.utils.ResultCache, optional): Result cache. Crops whose source image content,
+                box and settings were already classified are answered from it without loading, and the logits of
+                the others are stored in it. Requires a loader over DetectionCrops. Defaults to None.
+
+        Returns:
+            list: Classification results, one dict per crop.
         """
+        plan = None
+        if cache is not None:
+            dataloader, plan, total_paths = self._cache_plan(dataloader, cache)
+
         total_logits = []
-        total_paths = []
+        batch_paths = []
 
         with tqdm(total=len(dataloader)) as pbar: 
             for batch in dataloader:
                 imgs, paths = batch
                 imgs = imgs.to(self.device)
                 total_logits.append(self.forward(imgs))
-                total_paths.append(paths)
+                batch_paths.append(paths)
                 pbar.update(1)
 
-        total_logits = torch.cat(total_logits, dim=0).cpu()
-        total_paths = np.concatenate(total_paths, axis=0)
+        if plan is None:
+            total_logits = torch.cat(total_logits, dim=0).cpu()
+            total_paths = np.concatenate(batch_paths, axis=0)
+            return self.results_generation(total_logits, total_paths, id_strip=id_strip)
 
+        # Putting the logits of the misses and of the cached crops back in dataset order
+        rows = {}
+        for index, logits in zip(plan.misses, torch.cat(total_logits, dim=0).detach().cpu() if total_logits else []):
+            plan.store(index, logits.numpy())
+            rows[index] = logits
+        for index, logits, _ in plan.remaining():
+            rows[index] = torch.from_numpy(logits)
+        total_logits = torch.stack([rows[i] for i in range(len(total_paths))]) if total_paths \
+            else torch.empty(0, self.net.num_cls)
         return self.results_generation(total_logits, total_paths, id_strip=id_strip)
+
+    def _cache_plan(self, dataloader, cache):
+        """
+        Look up the crops of a loader in a result cache.
+
+        Returns:
+            tuple: Loader over the cache misses, plan of the run and source image path of every crop.
+        """
+        dataset = dataloader.dataset
+        assert hasattr(dataset, "crop_sources"), "The result cache needs a loader over DetectionCrops."
+        sources = dataset.crop_sources()
+        file_hashes = {}
+        keys = []
+        for path, xyxy in sources:
+            if path not in file_hashes:
+                file_hashes[path] = cache.file_hash(path)
+            keys.append(file_hashes[path] + ":" + ",".join(f"{float(v):.2f}" for v in xyxy))
+        namespace = cache.namespace(self, task="classification", transform=dataset.transform)
+        plan = cache.plan(namespace, list(range(len(sources))), keys)
+        loader = DataLoader(Subset(dataset, plan.misses), batch_size=dataloader.batch_size,
+                            num_workers=dataloader.num_workers, collate_fn=dataloader.collate_fn,
+                            pin_memory=dataloader.pin_memory)
+        return loader, plan, [path for path, _ in sources]
@@ -49,16 +49,14 @@ class CustomWeights(PlainResNetInference):
         probs = torch.softmax(logits, dim=1)
         preds = probs.argmax(dim=1)
         confs = probs.max(dim=1)[0]
-        confidences = probs[0].tolist()
-        result = [[self.CLASS_NAMES[i], confidence] for i, confidence in enumerate(confidences)]
 
         results = []
-        for pred, img_id, conf in zip(preds, img_ids, confs):
+        for pred, img_id, conf, img_probs in zip(preds, img_ids, confs, probs):
             r = {"img_id": str(img_id).strip(id_strip)}
             r["prediction"] = self.CLASS_NAMES[pred.item()]
             r["class_id"] = pred.item()
             r["confidence"] = conf.item()
-            r["all_confidences"] = result
+            r["all_confidences"] = [[self.CLASS_NAMES[i], confidence] for i, confidence in enumerate(img_probs.tolist())]
             results.append(r)
         
         return results
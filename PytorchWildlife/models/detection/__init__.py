@@ -1,2 +1,12 @@
-from .ultralytics_based import *
-from .herdnet import *
\ No newline at end of file
+from ..._lazy import attach
+
+# Submodules are imported on first access to one of their names
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "base_detector": ["BaseDetector"],
+    "ultralytics_based": None,
+    "herdnet": None,
+    "runtime": [
+        "EXPORT_FORMATS", "export_model", "ExportedModel", "PREPARED_SUFFIX", "save_prepared", "load_prepared",
+        "load_checkpoint",
+    ],
+})
\ No newline at end of file
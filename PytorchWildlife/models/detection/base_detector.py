@@ -5,8 +5,39 @@
 """ Base detector class. """
 
 # Importing basic libraries
+from collections import deque
+
+import numpy as np
+from tqdm import tqdm
+from PIL import Image
+import torch
 from torch import nn
 
+from ...data import loaders as pw_loaders
+from ...data import results as pw_results
+from ...data import transforms as pw_trans
+from ...data import datasets as pw_data
+from . import runtime as pw_runtime
+from . import nms as pw_nms
+
+__all__ = [
+    "BaseDetector"
+]
+
+
+class _FirstOutput(nn.Module):
+    """
+    Keeps only the first output of a model, e.g. the inference predictions of YOLO models, for export.
+    """
+    def __init__(self, model):
+        super(_FirstOutput, self).__init__()
+        self.model = model
+
+    def forward(self, x):
+        outputs = self.model(x)
+        return outputs[0] if isinstance(outputs, (list, tuple)) else outputs
+
+
 class BaseDetector(nn.Module):
     """
     Base detector class. This class provides utility methods for
@@ -19,7 +50,20 @@ class BaseDetector(nn.Module):
     CLASS_NAMES = None
     TRANSFORM = None
 
-    def __init__(self, weights=None, device="cpu", url=None):
+    # Whether images without detections are left out of the results of the batch methods
+    SKIP_EMPTY = False
+
+    # Supported inference precisions and their autocast data types
+    PRECISIONS = {
+        "fp32": None,
+        "bf16": torch.bfloat16,
+        "fp16": torch.float16
+    }
+
+    # Supported inference backends: the original torch model or an exported artifact
+    BACKENDS = ("torch", "onnx", "torchscript")
+
+    def __init__(self, weights=None, device="cpu", url=None, backend="torch"):
         """
         Initialize the base detector.
         
@@ -30,9 +74,18 @@ class BaseDetector(nn.Module):
                 Device for model inference. Defaults to "cpu".
             url (str, optional): 
                 URL to fetch the model weights. Defaults to None.
+            backend (str, optional):
+                Inference backend, one of "torch", "onnx" or "torchscript". With "onnx" and "torchscript",
+                weights is the path of an artifact written by export. With "torch", weights can also be
+                an artifact written by prepare. Defaults to "torch".
         """
         super(BaseDetector, self).__init__()
+        assert backend in self.BACKENDS, \
+            f"backend should be one of {list(self.BACKENDS)}, got '{backend}'"
         self.device = device
+        self.backend = backend
+        self.precision = "fp32"
+        self.channels_last = False
 
 
     def _load_model(self, weights=None, device="cpu", url=None):
@@ -51,6 +104,192 @@ class BaseDetector(nn.Module):
         """
         pass
 
+    def _load_exported(self, weights=None, device="cpu"):
+        """
+        Load an exported ONNX or TorchScript artifact as the model and apply the metadata stored in it.
+        
+        Args:
+            weights (str): 
+                Path of the exported artifact.
+            device (str, optional): 
+                Device for model inference. Defaults to "cpu".
+
+        Returns:
+            dict: Metadata stored in the artifact.
+        """
+        assert weights, f"The {self.backend} backend needs the path of an exported model as weights."
+        self.model = pw_runtime.ExportedModel(weights, backend=self.backend, device=device)
+        return self._apply_metadata(self.model.metadata)
+
+    def _load_prepared(self, weights, device="cpu"):
+        """
+        Load a prepared artifact written by prepare as the model and apply the metadata stored in it.
+        
+        Args:
+            weights (str): 
+                Path of the prepared artifact.
+            device (str, optional): 
+                Device for model inference. Defaults to "cpu".
+
+        Returns:
+            dict: Metadata stored in the artifact.
+        """
+        self.model, metadata = pw_runtime.load_prepared(weights, device=device)
+        return self._apply_metadata(metadata)
+
+    def _apply_metadata(self, metadata):
+        """
+        Apply the class names, image size and stride stored in an exported or prepared artifact.
+        """
+        if metadata.get("class_names"):
+            self.CLASS_NAMES = {int(k): v for k, v in metadata["class_names"].items()}
+        if metadata.get("image_size"):
+            self.IMAGE_SIZE = metadata["image_size"]
+        if metadata.get("stride"):
+            self.STRIDE = metadata["stride"]
+        return metadata
+
+    def _export_module(self):
+        """
+        Module traced by export. By default, the first output of the model.
+        """
+        return _FirstOutput(self.model)
+
+    def _export_metadata(self):
+        """
+        Metadata stored in exported artifacts and applied back when they are loaded.
+        """
+        return {
+            "class_names": self.CLASS_NAMES,
+            "image_size": self.IMAGE_SIZE,
+            "stride": self.STRIDE
+        }
+
+    def export(self, path, format="onnx", img_size=None, batch_size=1, dynamic_batch=True, opset=17):
+        """
+        Export the model to an ONNX or TorchScript artifact that can be loaded back with
+        backend="onnx" or backend="torchscript" and weights=path. Pre- and post-processing stay in
+        Python, so results_generation outputs are the same as with the torch backend.
+        
+        Args:
+            path (str): 
+                Path of the artifact to write.
+            format (str, optional): 
+                Export format, either "onnx" or "torchscript". Defaults to "onnx".
+            img_size (int, optional):
+                Size of the square input images the artifact is traced for. Defaults to IMAGE_SIZE.
+            batch_size (int, optional):
+                Batch size of the example input. Defaults to 1.
+            dynamic_batch (bool, optional):
+                Export the batch dimension as dynamic for ONNX. Defaults to True.
+            opset (int, optional):
+                ONNX opset version. Defaults to 17.
+
+        Returns:
+            str: Path of the written artifact.
+        """
+        assert self.backend == "torch", "Only models loaded with the torch backend can be exported."
+        img_size = img_size or self.IMAGE_SIZE
+        param = next(self.model.parameters(), None)
+        device = param.device if param is not None else self.device
+        example_input = torch.zeros((batch_size, 3, img_size, img_size), device=device)
+        metadata = self._export_metadata()
+        metadata["image_size"] = img_size
+        return pw_runtime.export_model(self._export_module(), path, example_input, format=format,
+                                       metadata=metadata, output_names=self._export_output_names(),
+                                       dynamic_batch=dynamic_batch, opset=opset)
+
+    def prepare(self, path):
+        """
+        Save the model in its inference-ready form (float, fused, eval mode) to a memory-mappable
+        artifact. Passing the artifact as weights skips the checkpoint conversion and layer fusion,
+        and its tensors are only read from disk when used, which cuts the start-up time of workers.
+        Run this once, e.g. when building a container image, before configure_inference.
+        
+        Args:
+            path (str): 
+                Path of the artifact to write, ending with ".prepared.pt".
+
+        Returns:
+            str: Path of the written artifact.
+        """
+        assert self.backend == "torch", "Only models loaded with the torch backend can be prepared."
+        assert self.precision == "fp32" and not self.channels_last and \
+            getattr(self.model, "_compiled_call_impl", None) is None, \
+            "Prepare the model before calling configure_inference."
+        return pw_runtime.save_prepared(self.model, path, metadata=self._export_metadata())
+
+    def _export_output_names(self):
+        """
+        Names of the outputs of the exported module.
+        """
+        return ["output"]
+
+    def configure_inference(self, precision="fp32", channels_last=False, compile=False, warmup=True):
+        """
+        Configure reduced-precision and compiled inference. Result dicts keep the same format;
+        use PytorchWildlife.utils.compare_detection_results to check parity against fp32 outputs.
+        
+        Args:
+            precision (str, optional): 
+                Inference precision, one of "fp32", "bf16" or "fp16". Reduced precisions run the model
+                under torch.autocast (bf16 is supported on CPU). Defaults to "fp32".
+            channels_last (bool, optional): 
+                Use the channels_last memory format for the model and its inputs. Defaults to False.
+            compile (bool, optional): 
+                Compile the model with torch.compile. Defaults to False.
+            warmup (bool, optional): 
+                Run a dummy forward pass so that compilation and kernel selection happen before
+                the first real batch. Defaults to True.
+
+        Returns:
+            BaseDetector: The detector itself.
+        """
+        assert precision in self.PRECISIONS, \
+            f"precision should be one of {list(self.PRECISIONS)}, got '{precision}'"
+        assert self.backend == "torch" or (precision == "fp32" and not channels_last and not compile), \
+            "Reduced precision, channels_last and compile are only available with the torch backend."
+        self.precision = precision
+        self.channels_last = channels_last
+        if channels_last:
+            self.model.to(memory_format=torch.channels_last)
+        if compile:
+            self.model.compile()
+        if warmup:
+            self.warmup()
+        return self
+
+    def _autocast(self, device=None):
+        """
+        Autocast context for the configured inference precision.
+        
+        Args:
+            device (str or torch.device, optional):
+                Device the model runs on. Defaults to the detector device.
+
+        Returns:
+            torch.autocast: Autocast context manager, disabled for fp32.
+        """
+        device_type = torch.device(device if device is not None else self.device).type
+        dtype = self.PRECISIONS[self.precision]
+        return torch.autocast(device_type=device_type, dtype=dtype, enabled=dtype is not None)
+
+    @torch.no_grad()
+    def warmup(self, img_size=None):
+        """
+        Run a dummy forward pass through the model.
+        
+        Args:
+            img_size (int, optional):
+                Size of the dummy square image. Defaults to IMAGE_SIZE.
+        """
+        img_size = img_size or self.IMAGE_SIZE
+        param = next(self.model.parameters(), None)
+        device = param.device if param is not None else self.device
+        dummy = self._to_model_input(torch.zeros((1, 3, img_size, img_size)), device)
+        with self._autocast(device):
+            self.model(dummy)
+
     def results_generation(self, preds, img_id, id_strip=None):
         """
         Generate results for detection based on model predictions.
@@ -68,7 +307,7 @@ class BaseDetector(nn.Module):
         """
         pass
 
-    def single_image_detection(self, img, img_size=None, img_path=None, conf_thres=0.2, id_strip=None):
+    def single_image_detection(self, img, img_size=None, img_path=None, det_conf_thres=0.2, id_strip=None):
         """
         Perform detection on a single image.
         
@@ -79,7 +318,7 @@ class BaseDetector(nn.Module):
                 Original image size.
             img_path (str): 
                 Image path or identifier.
-            conf_thres (float, optional): 
+            det_conf_thres (float, optional): 
                 Confidence threshold for predictions. Defaults to 0.2.
             id_strip (str, optional): 
                 Characters to strip from img_id. Defaults to None.
@@ -89,6 +328,348 @@ class BaseDetector(nn.Module):
         """
         pass
 
+    def multi_image_detection(self, imgs, img_paths=None, det_conf_thres=0.2, id_strip=None):
+        """
+        Perform detection on a list of in-memory images or image paths, e.g. requests coalesced by
+        MicroBatchEngine. Detectors with a batched forward pass override this to run the images together;
+        by default single_image_detection is run on each image.
+        
+        Args:
+            imgs (list): 
+                Image paths or ndarrays.
+            img_paths (list, optional): 
+                Image paths or identifiers, one per image. Defaults to the paths in imgs.
+            det_conf_thres (float, optional): 
+                Confidence threshold for predictions. Defaults to 0.2.
+            id_strip (str, optional): 
+                Characters to strip from img_id. Defaults to None.
+
+        Returns:
+            list: Detection results, one dict per image.
+        """
+        img_paths = img_paths if img_paths is not None else [None] * len(imgs)
+        return [
+            self.single_image_detection(img, img_path=img_path, det_conf_thres=det_conf_thres, id_strip=id_strip)
+            for img, img_path in zip(imgs, img_paths)
+        ]
+
+    def _transform_images(self, imgs, img_paths=None):
+        """
+        Load and transform the images of multi_image_detection.
+        
+        Returns:
+            tuple: Transformed image tensors, original image shapes and image identifiers.
+        """
+        img_paths = list(img_paths) if img_paths is not None else [None] * len(imgs)
+        tensors, img_sizes = [], []
+        for i, img in enumerate(imgs):
+            if isinstance(img, str):
+                img_paths[i] = img_paths[i] or img
+                img = np.array(Image.open(img).convert("RGB"))
+            img_sizes.append(img.shape)
+            tensors.append(self.transform(img))
+        return tensors, img_sizes, img_paths
+
+    @staticmethod
+    def _stack_by_shape(tensors):
+        """
+        Group image tensors of the same shape into batches.
+        
+        Returns:
+            generator: (indices of the images, stacked batch) tuples.
+        """
+        groups = {}
+        for i, tensor in enumerate(tensors):
+            groups.setdefault(tuple(tensor.shape), []).append(i)
+        for indices in groups.values():
+            yield indices, torch.stack([tensors[i] for i in indices])
+
+    def _cache_plan(self, dataset, cache, **settings):
+        """
+        Look up the images of a dataset in a result cache, leaving only the misses in the dataset.
+        
+        Args:
+            dataset (PytorchWildlife.data.DetectionImageFolder): 
+                Dataset of the run.
+            cache (PytorchWildlife.utils.ResultCache): 
+                Result cache.
+            **settings:
+                Settings of the run changing its results, part of the cache namespace.
+
+        Returns:
+            PytorchWildlife.utils.result_cache.CachePlan: Plan of the run.
+        """
+        namespace = cache.namespace(self, task="detection", backend=self.backend, image_size=self.IMAGE_SIZE,
+                                    stride=self.STRIDE, **settings)
+        paths = list(dataset.images)
+        plan = cache.plan(namespace, paths, [cache.file_hash(path) for path in paths])
+        dataset.images = plan.misses
+        return plan
+
+    @staticmethod
+    def _cached_before(plan, path, preds, size):
+        """
+        Store the predictions of a cache miss, yielding first the cached images that precede it.
+        
+        Returns:
+            generator: (image path, predictions, original (height, width)) tuples of the cached images.
+        """
+        for cached_path, cached_preds, meta in plan.before(path):
+            yield cached_path, cached_preds, np.array(meta["size"])
+        plan.store(path, preds, {"size": [int(size[0]), int(size[1])]})
+
+    @staticmethod
+    def _cached_remaining(plan):
+        """
+        Yield the cached images left after the last cache miss.
+        
+        Returns:
+            generator: (image path, predictions, original (height, width)) tuples of the cached images.
+        """
+        for cached_path, cached_preds, meta in plan.remaining():
+            yield cached_path, cached_preds, np.array(meta["size"])
+
+    @torch.no_grad()
+    def tiled_image_detection(self, data_path, tile_size=None, overlap=0.2, batch_size=16, det_conf_thres=0.2,
+                              iou_thres=0.5, full_image=True, num_workers=0, id_strip=None, as_batch=False):
+        """
+        Perform detection on overlapping tiles of the images of a folder, for small objects in large images
+        (e.g. aerial or high-resolution camera trap images). Tiles of several images share the same batches,
+        detections are mapped back to image coordinates and duplicates across tiles are merged.
+        
+        Args:
+            data_path (str): 
+                Path containing all images for inference.
+            tile_size (int, optional):
+                Side of the square tiles, in original image pixels. Defaults to IMAGE_SIZE.
+            overlap (float, optional):
+                Fraction of the tile size shared by neighboring tiles. Should exceed the relative size of the
+                objects so that each one lies fully inside a tile. Defaults to 0.2.
+            batch_size (int, optional):
+                Number of tiles per batch. Defaults to 16.
+            det_conf_thres (float, optional): 
+                Confidence threshold for predictions. Defaults to 0.2.
+            iou_thres (float, optional):
+                Intersection over the smaller box above which detections from overlapping tiles are merged.
+                Defaults to 0.5.
+            full_image (bool, optional):
+                Also run the whole image, so that objects larger than a tile are detected. Defaults to True.
+            num_workers (int, optional):
+                Number of worker processes for image decoding and tiling. Defaults to 0.
+            id_strip (str, optional): 
+                Characters to strip from img_id. Defaults to None.
+            as_batch (bool, optional):
+                Return a columnar DetectionBatch instead of a list of dicts. Defaults to False.
+
+        Returns:
+            list or DetectionBatch: Detection results for all images.
+        """
+        assert hasattr(self, "_batch_predictions"), f"{type(self).__name__} does not support tiled inference."
+        predictions = self._iter_tiled_predictions(data_path, tile_size=tile_size, overlap=overlap,
+                                                   batch_size=batch_size, det_conf_thres=det_conf_thres,
+                                                   iou_thres=iou_thres, full_image=full_image,
+                                                   num_workers=num_workers)
+        if as_batch:
+            return self._generate_batch(predictions, id_strip=id_strip, skip_empty=self.SKIP_EMPTY)
+        return list(self._generate_results(predictions, id_strip=id_strip, skip_empty=self.SKIP_EMPTY))
+
+    def _iter_tiled_predictions(self, data_path, tile_size=None, overlap=0.2, batch_size=16, det_conf_thres=0.2,
+                                iou_thres=0.5, full_image=True, num_workers=0):
+        """
+        Run the model over overlapping tiles of the images of a folder, yielding the merged predictions of
+        each image in folder order. Tiles of consecutive images are packed into the same batches, so every
+        batch is full whatever the number of tiles per image. Requires a _batch_predictions method.
+        See tiled_image_detection for the arguments.
+
+        Returns:
+            generator: (image path, predictions in xyxy, confidence, class_id format, original (height, width)) tuples.
+        """
+        tiler = pw_trans.TiledTransform(
+            pw_trans.MegaDetector_v5_Transform(target_size=self.IMAGE_SIZE, stride=self.STRIDE, keep_uint8=True),
+            tile_size or self.IMAGE_SIZE, overlap=overlap, full_image=full_image
+        )
+        dataset = pw_data.DetectionImageFolder(data_path, transform=tiler)
+        # One sample per image: the loader workers tile the images, batches are packed here
+        loader = self._build_loader(dataset, batch_size=None, num_workers=num_workers)
+
+        pending = deque() # images whose tiles are not all predicted yet, in folder order
+        tiles, owners = [], [] # tiles waiting for a batch, and their (image entry, tile index)
+
+        def run_tiles(count):
+            windows = [owner[0]["windows"][owner[1]] for owner in owners[:count]]
+            sizes = [(y1 - y0, x1 - x0) for x0, y0, x1, y1 in windows]
+            preds = self._batch_predictions(torch.stack(tiles[:count]), sizes, det_conf_thres=det_conf_thres)
+            for (entry, index), (x0, y0, _, _), pred in zip(owners[:count], windows, preds):
+                # Mapping the boxes from tile back to image coordinates
+                pred[:, :4] += np.array([x0, y0, x0, y0], dtype=pred.dtype)
+                entry["preds"][index] = pred
+                entry["left"] -= 1
+            del tiles[:count], owners[:count]
+
+        def finished():
+            while pending and pending[0]["left"] == 0:
+                entry = pending.popleft()
+                preds = entry["preds"][0]
+                if len(entry["preds"]) > 1:
+                    tile_ids = np.concatenate([np.full(len(p), i) for i, p in enumerate(entry["preds"])])
+                    preds = pw_nms.merge_tile_detections(np.concatenate(entry["preds"]), iou_thres=iou_thres,
+                                                         tile_ids=tile_ids)
+                yield entry["path"], preds, entry["size"]
+
+        with tqdm(total=len(dataset)) as pbar:
+            for imgs, path, size in loader:
+                windows = tiler.windows(size.tolist())
+                entry = {"path": path, "size": size.numpy(), "windows": windows,
+                         "preds": [None] * len(windows), "left": len(windows)}
+                pending.append(entry)
+                tiles.extend(imgs)
+                owners.extend((entry, index) for index in range(len(windows)))
+                while len(tiles) >= batch_size:
+                    run_tiles(batch_size)
+                for result in finished():
+                    pbar.update(1)
+                    yield result
+            if tiles:
+                run_tiles(len(tiles))
+            for result in finished():
+                pbar.update(1)
+                yield result
+
+    def _build_loader(self, dataset, batch_size=16, num_workers=0, prefetch_factor=None,
+                      persistent_workers=False, device_prefetch=False, batch_sampler=None):
+        """
+        Build the batch iterator used by batch_image_detection.
+        
+        Args:
+            dataset (torch.utils.data.Dataset): 
+                Dataset to load images from.
+            batch_size (int, optional):
+                Batch size for inference. Defaults to 16.
+            num_workers (int, optional):
+                Number of worker processes for image decoding and transformation. Defaults to 0.
+            prefetch_factor (int, optional):
+                Number of batches loaded in advance by each worker. Defaults to None.
+            persistent_workers (bool, optional):
+                Keep the worker processes alive between loader iterations. Defaults to False.
+            device_prefetch (bool, optional):
+                Copy the next batches to the model device on a background thread. Defaults to False.
+            batch_sampler (torch.utils.data.Sampler, optional):
+                Sampler yielding lists of indices, e.g. for aspect-ratio bucketing. Defaults to None.
+
+        Returns:
+            iterable: Iterable of (images, paths, sizes) batches.
+        """
+        loader = pw_loaders.build_inference_loader(dataset, batch_size=batch_size, num_workers=num_workers,
+                                                   prefetch_factor=prefetch_factor,
+                                                   persistent_workers=persistent_workers,
+                                                   batch_sampler=batch_sampler)
+        if device_prefetch:
+            loader = pw_loaders.DevicePrefetcher(loader, device=self.device)
+        return loader
+
+    def _to_model_input(self, imgs, device=None):
+        """
+        Move a batch of images to the model device and normalize uint8 batches to float in [0, 1].
+        
+        Args:
+            imgs (torch.Tensor): 
+                Batch of images, either float in [0, 1] or uint8 in [0, 255].
+            device (str or torch.device, optional):
+                Target device. Defaults to the detector device.
+
+        Returns:
+            torch.Tensor: Float batch on the target device.
+        """
+        imgs = imgs.to(device if device is not None else self.device, non_blocking=True)
+        if imgs.dtype == torch.uint8:
+            imgs = imgs.float().div_(255.0)
+        if self.channels_last:
+            imgs = imgs.contiguous(memory_format=torch.channels_last)
+        return imgs
+
+    @staticmethod
+    def _normalized_coords(xyxy, size):
+        """
+        Normalize boxes by the original image size, for timelapse compatibility.
+        
+        Args:
+            xyxy (numpy.ndarray): 
+                Boxes in xyxy pixel format.
+            size (numpy.ndarray or tuple): 
+                Original (height, width) of the image.
+
+        Returns:
+            list: Normalized boxes in xyxy format.
+        """
+        height, width = float(size[0]), float(size[1])
+        return (np.asarray(xyxy).reshape(-1, 4) / np.array([width, height, width, height])).tolist()
+
+    def _generate_results(self, predictions, id_strip=None, journal=None, skip_empty=False):
+        """
+        Turn per-image prediction arrays into result dicts.
+        
+        Args:
+            predictions (iterable): 
+                (image path, predictions in xyxy, confidence, class_id format, original (height, width)) tuples.
+            id_strip (str, optional): 
+                Characters to strip from img_id. Defaults to None.
+            journal (PytorchWildlife.utils.DetectionJournal, optional):
+                Checkpoint journal every finished image is recorded in. Defaults to None.
+            skip_empty (bool, optional):
+                Leave images without detections out of the results. Defaults to False.
+
+        Returns:
+            generator: Detection results, one dict per image.
+        """
+        for path, preds, size in predictions:
+            if skip_empty and len(preds) == 0:
+                if journal:
+                    journal.mark_done(path)
+                continue
+            res = self.results_generation(preds, path, id_strip)
+            res["normalized_coords"] = self._normalized_coords(preds[:, :4], size)
+            if journal:
+                journal.append(res, path)
+            yield res
+        if journal:
+            journal.flush()
+
+    def _generate_batch(self, predictions, id_strip=None, journal=None, skip_empty=False):
+        """
+        Collect per-image prediction arrays into a columnar DetectionBatch, without building
+        per-image Detections, labels or normalized coordinates.
+        
+        Args:
+            predictions (iterable): 
+                (image path, predictions in xyxy, confidence, class_id format, original (height, width)) tuples.
+            id_strip (str, optional): 
+                Characters to strip from img_id. Defaults to None.
+            journal (PytorchWildlife.utils.DetectionJournal, optional):
+                Checkpoint journal every finished image is recorded in. Defaults to None.
+            skip_empty (bool, optional):
+                Leave images without detections out of the batch. Defaults to False.
+
+        Returns:
+            DetectionBatch: Detection results of all images.
+        """
+        img_ids, batch_preds, sizes = [], [], []
+        for path, preds, size in predictions:
+            if skip_empty and len(preds) == 0:
+                if journal:
+                    journal.mark_done(path)
+                continue
+            img_ids.append(str(path).strip(id_strip))
+            batch_preds.append(preds)
+            sizes.append(tuple(int(x) for x in size[:2]))
+            if journal:
+                res = self.results_generation(preds, path, id_strip)
+                res["normalized_coords"] = self._normalized_coords(preds[:, :4], size)
+                journal.append(res, path)
+        if journal:
+            journal.flush()
+        return pw_results.DetectionBatch.from_predictions(img_ids, batch_preds, img_sizes=sizes,
+                                                          class_names=self.CLASS_NAMES)
+
     def batch_image_detection(self, dataloader, conf_thres=0.2, id_strip=None):
         """
         Perform detection on a batch of images.
@@ -105,3 +686,20 @@ class BaseDetector(nn.Module):
             list: List of detection results for all images.
         """
         pass
+
+    def iter_image_detection(self, dataloader, conf_thres=0.2, id_strip=None):
+        """
+        Perform detection on a batch of images, yielding the results as each batch finishes.
+        
+        Args:
+            dataloader (DataLoader): 
+                DataLoader containing image batches.
+            conf_thres (float, optional): 
+                Confidence threshold for predictions. Defaults to 0.2.
+            id_strip (str, optional): 
+                Characters to strip from img_id. Defaults to None.
+
+        Returns:
+            generator: Detection results, one dict per image.
+        """
+        pass
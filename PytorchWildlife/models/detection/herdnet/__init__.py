@@ -1 +1,6 @@
-from .herdnet import *
\ No newline at end of file
+from ...._lazy import attach
+
+# Submodules are imported on first access to one of their names
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "herdnet": ["HerdNet"],
+})
\ No newline at end of file
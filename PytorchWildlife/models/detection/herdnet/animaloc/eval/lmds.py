@@ -14,9 +14,6 @@ __license__ = "MIT License"
 __version__ = "0.2.1"
 
 import torch
-import numpy
-
-import torch.nn.functional as F
 
 from typing import Tuple, List
 
@@ -65,21 +62,18 @@ class LMDS:
         '''
         batch_size, classes = est_map.shape[:2]
 
-        b_counts, b_labels, b_scores, b_locs = [], [], [], []
-        for b in range(batch_size):
-            counts, labels, scores, locs = [], [], [], []
-
-            for c in range(classes):
-                count, loc, score = self._lmds(est_map[b][c])
-                counts.append(count)
-                labels = [*labels, *[c+1]*count]
-                scores = [*scores, *score]
-                locs = [*locs, *loc]
+        peaks = self._peaks(est_map)
+        b_idx, c_idx, h_idx, w_idx = peaks.nonzero(as_tuple=True)
+        counts = peaks.sum(dim=(2,3))
+        scores = est_map[b_idx, c_idx, h_idx, w_idx]
+        locs = torch.stack([h_idx, w_idx], dim=1)
 
-            b_counts.append(counts)
-            b_labels.append(labels)
-            b_scores.append(scores)
-            b_locs.append(locs)
+        # split per batch, in (class, row, column) order
+        sizes = counts.sum(dim=1).tolist()
+        b_counts = counts.tolist()
+        b_labels = [l.tolist() for l in torch.split(c_idx + 1, sizes)]
+        b_scores = [s.tolist() for s in torch.split(scores.float(), sizes)]
+        b_locs = [l.tolist() for l in torch.split(locs.float(), sizes)]
 
         return b_counts, b_locs, b_labels, b_scores
     
@@ -92,6 +86,18 @@ class LMDS:
         est_map = keep * est_map
 
         return est_map
+
+    def _peaks(self, est_map: torch.Tensor) -> torch.Tensor:
+        ''' Boolean map of the selected local maxima, for all maps at once.
+        Shape: est_map = [B,C,H,W] '''
+
+        est_map_max = est_map.flatten(2).max(dim=2).values[:, :, None, None]
+
+        # local maxima
+        est_map = self._local_max(est_map)
+
+        # adaptive threshold for counting and negative samples
+        return (est_map >= self.adapt_ts * est_map_max) & (est_map > 0) & (est_map_max >= self.neg_ts)
     
     def _get_locs_and_scores(
         self, 
@@ -100,43 +106,21 @@ class LMDS:
         ) -> Tuple[torch.Tensor, torch.Tensor]:
         ''' Shapes: locs_map = [H,W] and scores_map = [H,W] '''
 
-        locs_map = locs_map.data.cpu().numpy()
-        scores_map = scores_map.data.cpu().numpy()
-        locs = []
-        scores = []
-        for i, j in numpy.argwhere(locs_map ==  1):
-            locs.append((i,j))
-            scores.append(scores_map[i][j])
+        h_idx, w_idx = (locs_map == 1).nonzero(as_tuple=True)
+        locs = torch.stack([h_idx, w_idx], dim=1)
+        scores = scores_map[h_idx, w_idx]
         
-        return torch.Tensor(locs), torch.Tensor(scores)
+        return locs.float().cpu(), scores.float().cpu()
     
     def _lmds(self, est_map: torch.Tensor) -> Tuple[int, list, list]:
         ''' Shape: est_map = [H,W] '''
 
-        est_map_max = torch.max(est_map).item()
-
-        # local maxima
-        est_map = self._local_max(est_map.unsqueeze(0).unsqueeze(0))
-
-        # adaptive threshold for counting
-        est_map[est_map < self.adapt_ts * est_map_max] = 0
-        scores_map = torch.clone(est_map)
-        est_map[est_map > 0] = 1
-
-        # negative sample
-        if est_map_max < self.neg_ts:
-            est_map = est_map * 0
-
-        # count
-        count = int(torch.sum(est_map).item())
+        peaks = self._peaks(est_map[None, None])[0, 0]
 
         # locations and scores
-        locs, scores = self._get_locs_and_scores(
-            est_map.squeeze(0).squeeze(0), 
-            scores_map.squeeze(0).squeeze(0)
-            )
+        locs, scores = self._get_locs_and_scores(peaks.float(), est_map)
 
-        return count, locs.tolist(), scores.tolist()
+        return len(locs), locs.tolist(), scores.tolist()
 
 class HerdNetLMDS(LMDS):
 
@@ -175,45 +159,54 @@ class HerdNetLMDS(LMDS):
                 counts, locations, labels, class scores and detection scores per batch
         '''
 
-        heatmap, clsmap = outputs
-        
-        # upsample class map
-        if self.up:
-            scale_factor = 16
-            clsmap = F.interpolate(clsmap, scale_factor=scale_factor, mode='nearest')
-
-        # softmax
-        cls_scores = torch.softmax(clsmap, dim=1)[:,1:,:,:]
-
-        # cat to heatmap
-        outmaps = torch.cat([heatmap, cls_scores], dim=1)
+        counts, _, locs, labels, scores, dscores = self.detect(outputs)
 
-        # LMDS
-        batch_size, channels = outmaps.shape[:2]
+        # split per batch
+        sizes = counts.sum(dim=1).tolist()
+        b_locs = [l.tolist() for l in torch.split(locs.float(), sizes)]
+        b_labels = [l.tolist() for l in torch.split(labels, sizes)]
+        b_scores = [s.tolist() for s in torch.split(scores, sizes)]
+        b_dscores = [s.tolist() for s in torch.split(dscores, sizes)]
 
-        b_counts, b_labels, b_scores, b_locs, b_dscores = [], [], [], [], []
-        for b in range(batch_size):
+        return counts.tolist(), b_locs, b_labels, b_scores, b_dscores
 
-            _, locs, _ = self._lmds(heatmap[b][0])
+    def detect(self, outputs: List[torch.Tensor]) -> Tuple[torch.Tensor, ...]:
+        ''' Batched LMDS computed with tensor operations on the device of the outputs,
+        without Python loops over images, classes or detections.
 
-            cls_idx = torch.argmax(clsmap[b,1:,:,:], dim=0)
-            classes = torch.add(cls_idx, 1)
+        Args:
+            outmaps (torch.Tensor): outputs of HerdNet, i.e. 2 tensors:
+                - heatmap: [B,1,H,W], 
+                - class map: [B,C,H/16,W/16],
+        
+        Returns:
+            Tuple[torch.Tensor,...]
+                counts per batch and class [B,C-1], then batch indices [N], 
+                locations [N,2] as (row, column), labels [N], class scores [N] 
+                and detection scores [N] of the N detections, sorted by batch 
+                index then in row-major order
+        '''
 
-            h_idx = torch.Tensor([l[0] for l in locs]).long()
-            w_idx = torch.Tensor([l[1] for l in locs]).long()
-            labels = classes[h_idx, w_idx].long().tolist()
+        heatmap, clsmap = outputs
+        batch_size, channels = clsmap.shape[:2]
 
-            chan_idx = cls_idx[h_idx, w_idx].long().tolist()
-            scores = cls_scores[b, chan_idx, h_idx, w_idx].float().tolist()
+        b_idx, _, h_idx, w_idx = self._peaks(heatmap).nonzero(as_tuple=True)
+        locs = torch.stack([h_idx, w_idx], dim=1)
+        dscores = heatmap[b_idx, 0, h_idx, w_idx].float()
 
-            dscores = heatmap[b, 0, h_idx, w_idx].float().tolist()
+        # class map values at the detections, the upsampling being nearest
+        if self.up:
+            scale_factor = 16
+            h_idx, w_idx = h_idx // scale_factor, w_idx // scale_factor
+        logits = clsmap[b_idx, :, h_idx, w_idx]
 
-            counts = [labels.count(i) for i in range(1, channels)]
+        # softmax and most likely non-background class
+        cls_scores = torch.softmax(logits.float(), dim=1)[:,1:]
+        chan_idx = torch.argmax(logits[:,1:], dim=1)
+        labels = chan_idx + 1
+        scores = cls_scores.gather(1, chan_idx[:, None])[:, 0]
 
-            b_labels.append(labels)
-            b_scores.append(scores)
-            b_locs.append(locs)
-            b_counts.append(counts)
-            b_dscores.append(dscores)
+        counts = torch.bincount(b_idx * (channels - 1) + chan_idx, minlength=batch_size * (channels - 1))
+        counts = counts.view(batch_size, channels - 1)
 
-        return b_counts, b_locs, b_labels, b_scores, b_dscores
\ No newline at end of file
+        return counts, b_idx, locs, labels, scores, dscores
@@ -14,17 +14,38 @@ __license__ = "MIT License"
 __version__ = "0.2.1"
 
 
+import os
 import torch
 import torchvision
 
 import torch.nn.functional as F
 import numpy as np
 
-from typing import List, Tuple
-from torch.utils.data import TensorDataset, DataLoader, SequentialSampler
+from typing import List, Tuple, Union
+from collections import OrderedDict
 
 from ..data import ImageToPatches
 
+__all__ = ['Stitcher', 'HerdNetStitcher']
+
+# Largest patch batch size picked by batch_size='auto'
+MAX_AUTO_BATCH_SIZE = 64
+
+def _available_memory() -> int:
+    ''' Host memory available for new allocations, in bytes, or 0 if unknown '''
+
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE')
+    except (AttributeError, ValueError, OSError):
+        return 0
+
 class Stitcher(ImageToPatches):
     ''' Class to stitch detections of patches into original image
     coordinates system 
@@ -42,11 +63,12 @@ class Stitcher(ImageToPatches):
         model: torch.nn.Module, 
         size: Tuple[int,int], 
         overlap: int = 100,
-        batch_size: int = 1,
+        batch_size: Union[int, str] = 1,
         down_ratio: int = 1,
         up: bool = False,
         reduction: str = 'sum',
         device_name: str = 'cuda',
+        cache_size: int = 8,
         ) -> None:
         '''
         Args:
@@ -55,8 +77,9 @@ class Stitcher(ImageToPatches):
             size (tuple): patches size (height, width), in pixels
             overlap (int, optional): overlap between patches, in pixels. 
                 Defaults to 100. 
-            batch_size (int, optional): batch size used for inference over patches. 
-                Defaults to 1.
+            batch_size (int or str, optional): batch size used for inference over patches.
+                Set to 'auto' to pick the largest batch that fits in the free device memory,
+                measured on the first call. Defaults to 1.
             down_ratio (int, optional): downsample ratio. Set to 1 to get output of the same 
                 size as input (i.e. no downsample). Defaults to 1.
             up (bool, optional): set to True to upsample the patched map. Defaults to False.
@@ -64,11 +87,16 @@ class Stitcher(ImageToPatches):
                 Possible values are 'sum', 'mean', 'max'. Defaults to 'sum'.
             device_name (str, optional): the device name on which tensors will be allocated 
                 ('cpu' or 'cuda'). Defaults to 'cuda'.
+            cache_size (int, optional): number of image shapes whose fold geometry and
+                normalization map are kept for reuse. Defaults to 8.
         '''
 
         assert isinstance(model, torch.nn.Module), \
             'model argument must be an instance of nn.Module()'
         
+        assert batch_size == 'auto' or (isinstance(batch_size, int) and batch_size > 0), \
+            f'batch_size argument must be a positive int or \'auto\', got \'{batch_size}\''
+
         assert reduction in ['sum', 'mean', 'max'], \
             'reduction argument possible values are \'sum\', \'mean\' and \'max\' ' \
                 f'got \'{reduction}\''
@@ -81,6 +109,8 @@ class Stitcher(ImageToPatches):
         self.up = up
         self.reduction = reduction
         self.device = torch.device(device_name)
+        self.cache_size = cache_size
+        self._geometries = OrderedDict()
 
         self.model.to(self.device)
 
@@ -98,134 +128,246 @@ class Stitcher(ImageToPatches):
                 the detections into the coordinate system of the original image
         '''
 
-        super(Stitcher, self).__init__(image, self.size, self.overlap)
+        return self.stitch_images([image])[0]
+
+    def stitch_images(
+        self, 
+        images: List[torch.Tensor]
+        ) -> List[torch.Tensor]:
+        ''' Apply the stitching algorithm to several images, possibly of different
+        sizes. Their patches are pooled into shared inference batches, and the maps
+        of each image are patched back as soon as all its patches are processed
+
+        Args:
+            images (list): images of shape [C,H,W]
         
-        self.image = image.to(torch.device('cpu')) 
+        Returns:
+            List[torch.Tensor]
+                the detections of each image into its original coordinate system
+        '''
 
         # step 1 - get patches and limits
-        patches = self.make_patches()
+        patches, geometries, sizes = [], [], []
+        for image in images:
+            _, h, w = image.shape
+            sizes.append((h, w))
 
-        # step 2 - inference to get maps
-        det_maps = self._inference(patches)
+            # images smaller than a patch are zero-padded, so that all patches share the same size
+            pad_h, pad_w = max(self.size[0] - h, 0), max(self.size[1] - w, 0)
+            if pad_h or pad_w:
+                image = F.pad(image, (0, pad_w, 0, pad_h))
 
-        # step 3 - patch the maps into initial coordinates system
-        patched_map = self._patch_maps(det_maps)
-        patched_map = self._reduce(patched_map)
+            super(Stitcher, self).__init__(image, self.size, self.overlap)
+            self.image = image.to(torch.device('cpu'))
+            patches.append(self.make_patches())
+            geometries.append(self._get_geometry())
 
-        # (step 4 - upsample)
-        if self.up:
-            patched_map = F.interpolate(patched_map, scale_factor=self.down_ratio, 
-                mode='bilinear', align_corners=True)
+        # step 2 - inference to get maps
+        patched_maps = []
+        counts = [p.shape[0] for p in patches]
+        for det_maps in self._inference(torch.cat(patches), counts):
+            index = len(patched_maps)
 
-        return patched_map
+            # step 3 - patch the maps into initial coordinates system
+            patched_map = self._patch_maps(det_maps, geometries[index])
+            patched_map = self._reduce(patched_map, geometries[index])
+            h, w = sizes[index]
+            patched_map = patched_map[:,:, 0:h // self.down_ratio, 0:w // self.down_ratio]
 
-    
-    @torch.no_grad()
-    def _inference(self, patches: torch.Tensor) -> List[torch.Tensor]:
-        
-        self.model.eval()
+            # (step 4 - upsample)
+            if self.up:
+                patched_map = F.interpolate(patched_map, scale_factor=self.down_ratio, 
+                    mode='bilinear', align_corners=True)
 
-        dataset = TensorDataset(patches)
-        dataloader = DataLoader(
-            dataset,   
-            batch_size=self.batch_size,
-            sampler=SequentialSampler(dataset)
-            )
+            patched_maps.append(patched_map)
 
-        maps = []
-        for patch in dataloader:
-            patch = patch[0].to(self.device)
-            outputs, _ = self.model(patch)
-            maps = [*maps, *outputs.unsqueeze(0)]
+        return patched_maps
 
-        return maps
+    @torch.no_grad()
+    def _inference(self, patches: torch.Tensor, counts: List[int]) -> torch.Tensor:
+        ''' Run the model over the patches in batches, which can span several images,
+        writing the output maps of each image into a tensor allocated once for all its
+        patches. The maps of an image are yielded as soon as they are all computed, so
+        that only one image at a time is held on the device
 
-    def _patch_maps(self, maps: List[torch.Tensor]) -> torch.Tensor:
+        Args:
+            patches (torch.Tensor): patches of all images, of shape [N,C,H,W]
+            counts (list): number of patches of each image, summing to N
 
-        _, h, w = self.image.shape
-        dh, dw = h // self.down_ratio, w // self.down_ratio
-        kernel_size = np.array(self.size) // self.down_ratio
-        stride = kernel_size - self.overlap // self.down_ratio
-        output_size = (
-            self._ncol * kernel_size[0] - ((self._ncol-1) * self.overlap // self.down_ratio), 
-            self._nrow * kernel_size[1] - ((self._nrow-1) * self.overlap // self.down_ratio)
-            )
+        Yields:
+            torch.Tensor
+                output maps of each image, of shape [n,C',H',W']
+        '''
+        
+        self.model.eval()
 
-        maps = torch.cat(maps, dim=0)
+        batch_size = self._get_batch_size(patches.shape[1:])
+
+        maps, filled, index = None, 0, 0
+        for i in range(0, patches.shape[0], batch_size):
+            outputs = self._forward(patches[i:i+batch_size].to(self.device))
+            while outputs.shape[0] > 0:
+                if maps is None:
+                    maps = torch.empty((counts[index], *outputs.shape[1:]),
+                        dtype=outputs.dtype, device=outputs.device)
+                n = min(outputs.shape[0], maps.shape[0] - filled)
+                maps[filled:filled+n] = outputs[:n]
+                outputs, filled = outputs[n:], filled + n
+                if filled == maps.shape[0]:
+                    yield maps
+                    maps, filled, index = None, 0, index + 1
+
+    def _forward(self, patches: torch.Tensor) -> torch.Tensor:
+        ''' Output maps of a batch of patches '''
+
+        outputs, _ = self.model(patches)
+        return outputs
+
+    def _get_batch_size(self, patch_shape: Tuple[int,int,int]) -> int:
+        ''' Resolve batch_size='auto' on first use, from the memory footprint of a one-patch
+        forward pass: on CUDA, the batch is sized to 80% of the free device memory. On CPU,
+        it is sized to half of the available host memory and capped to the number of torch
+        threads, as extra patches only speed up the forward pass by keeping idle threads busy '''
+
+        if self.batch_size != 'auto':
+            return self.batch_size
+
+        if self.device.type != 'cuda':
+            per_patch = max(self._activation_memory(patch_shape), 1)
+            fits = 0.5 * _available_memory() // per_patch
+            self.batch_size = int(max(min(fits, torch.get_num_threads(), MAX_AUTO_BATCH_SIZE), 1))
+            return self.batch_size
+
+        torch.cuda.synchronize(self.device)
+        torch.cuda.reset_peak_memory_stats(self.device)
+        base = torch.cuda.memory_allocated(self.device)
+        self._forward(torch.zeros((1, *patch_shape), device=self.device))
+        per_patch = max(torch.cuda.max_memory_allocated(self.device) - base, 1)
+        free, _ = torch.cuda.mem_get_info(self.device)
+        self.batch_size = int(min(max(0.8 * free // per_patch, 1), MAX_AUTO_BATCH_SIZE))
+        return self.batch_size
+
+    def _activation_memory(self, patch_shape: Tuple[int,int,int]) -> int:
+        ''' Total size in bytes of the new outputs of the leaf modules in a one-patch forward
+        pass, an upper bound of its peak memory as intermediate outputs are freed along the way '''
+
+        total = 0
+        def hook(module, inputs, outputs):
+            nonlocal total
+            outputs = outputs if isinstance(outputs, (tuple, list)) else (outputs,)
+            # in-place modules return their input and allocate nothing
+            inplace = {i.data_ptr() for i in inputs if isinstance(i, torch.Tensor)}
+            total += sum(o.numel() * o.element_size() for o in outputs
+                if isinstance(o, torch.Tensor) and o.data_ptr() not in inplace)
+
+        leaves = [m for m in self.model.modules() if next(m.children(), None) is None]
+        handles = [m.register_forward_hook(hook) for m in leaves]
+        try:
+            self._forward(torch.zeros((1, *patch_shape), device=self.device))
+        finally:
+            for handle in handles:
+                handle.remove()
+        return total
+
+    def _get_geometry(self) -> dict:
+        ''' Fold geometry of the current image: output size, kernel size, stride and crop
+        of the patched map, windows of the patches in it and, for the 'mean' reduction, the
+        number of patches covering each pixel. It only depends on the image shape and on the
+        stitcher settings, so it is memoized in a small LRU for images of the same size '''
+
+        key = (tuple(self.image.shape), tuple(self.size), self.overlap, self.down_ratio)
+        geometry = self._geometries.get(key)
+        if geometry is not None:
+            self._geometries.move_to_end(key)
+        else:
+            _, h, w = self.image.shape
+            kernel_size = tuple(int(k) for k in np.array(self.size) // self.down_ratio)
+            stride = tuple(k - self.overlap // self.down_ratio for k in kernel_size)
+            output_size = (
+                self._ncol * kernel_size[0] - ((self._ncol-1) * self.overlap // self.down_ratio), 
+                self._nrow * kernel_size[1] - ((self._nrow-1) * self.overlap // self.down_ratio)
+                )
+
+            fn = lambda x: [[i, i+kernel_size[x]] for i in range(0, output_size[x], stride[x])][:-1]
+            windows = [[*h_win, *w_win] for h_win in fn(0) for w_win in fn(1)]
+
+            geometry = {
+                'crop': (h // self.down_ratio, w // self.down_ratio),
+                'output_size': output_size,
+                'kernel_size': kernel_size,
+                'stride': stride,
+                'windows': windows,
+                }
+            self._geometries[key] = geometry
+            while len(self._geometries) > self.cache_size:
+                self._geometries.popitem(last=False)
+
+        if self.reduction == 'mean' and 'norm_map' not in geometry:
+            # folding patches of ones counts the patches covering each pixel
+            n_patches = len(geometry['windows'])
+            ones = torch.ones((1, geometry['kernel_size'][0] * geometry['kernel_size'][1], n_patches),
+                device=self.device)
+            norm_map = F.fold(ones, output_size=geometry['output_size'],
+                kernel_size=geometry['kernel_size'], stride=geometry['stride'])
+            geometry['norm_map'] = norm_map[:,:, 0:geometry['crop'][0], 0:geometry['crop'][1]]
+
+        return geometry
+
+    def _patch_maps(self, maps: List[torch.Tensor], geometry: dict = None) -> torch.Tensor:
+
+        geometry = geometry or self._get_geometry()
+        dh, dw = geometry['crop']
+
+        if isinstance(maps, (list, tuple)):
+            maps = torch.cat(maps, dim=0)
 
         if self.reduction == 'max':
-            out_map = self._max_fold(maps, output_size=output_size,
-                kernel_size=tuple(kernel_size), stride=tuple(stride))
+            out_map = self._max_fold(maps, output_size=geometry['output_size'],
+                kernel_size=geometry['kernel_size'], stride=geometry['stride'],
+                windows=geometry['windows'])
         else:
             n_patches = maps.shape[0]
             maps = maps.permute(1,2,3,0).contiguous().view(1, -1, n_patches)
-            out_map = F.fold(maps, output_size=output_size, 
-                kernel_size=tuple(kernel_size), stride=tuple(stride))
+            out_map = F.fold(maps, output_size=geometry['output_size'], 
+                kernel_size=geometry['kernel_size'], stride=geometry['stride'])
 
         out_map = out_map[:,:, 0:dh, 0:dw]
 
         return out_map
     
-    def _reduce(self, map: torch.Tensor) -> torch.Tensor:
-
-        dh = self.image.shape[1] // self.down_ratio
-        dw = self.image.shape[2] // self.down_ratio
-        ones = torch.ones(self.image.shape[0],dh,dw)
+    def _reduce(self, map: torch.Tensor, geometry: dict = None) -> torch.Tensor:
 
         if self.reduction == 'mean':
-            ones_patches = ImageToPatches(ones, 
-                np.array(self.size)//self.down_ratio, 
-                self.overlap//self.down_ratio
-                ).make_patches()
+            geometry = geometry or self._get_geometry()
+            return torch.div(map.to(self.device), geometry['norm_map'])
 
-            ones_patches = [p.unsqueeze(0).unsqueeze(0) for p in ones_patches[:,1,:,:]]
-            norm_map = self._patch_maps(ones_patches)
-        
-        else:
-            norm_map = ones[1,:,:]
-        
-        return torch.div(map.to(self.device), norm_map.to(self.device))
+        return map.to(self.device)
     
     def _max_fold(self, maps: torch.Tensor, output_size: tuple, 
-        kernel_size: tuple, stride: tuple
+        kernel_size: tuple, stride: tuple, windows: list = None
         ) -> torch.Tensor:
+        ''' Fold the patches with a max over overlapping areas, updating each patch
+        window of the output in place. Pixels covered by no patch are 0, and the output
+        is at least 0 as the fold starts from zeros '''
         
-        output = torch.zeros((1, maps.shape[1], *output_size))
+        output = torch.zeros((1, maps.shape[1], *output_size), 
+            dtype=torch.promote_types(maps.dtype, torch.float32), device=maps.device)
 
-        fn = lambda x: [[i, i+kernel_size[x]] for i in range(0, output_size[x], stride[x])][:-1]
-        locs = [[*h, *w] for h in fn(0) for w in fn(1)]
+        locs = windows or self._get_geometry()['windows']
 
         for loc, m in zip(locs, maps):
-            patch = torch.zeros(output.shape)
-            patch[:,:, loc[0]:loc[1], loc[2]:loc[3]] = m
-            output = torch.max(output, patch)
+            window = output[0, :, loc[0]:loc[1], loc[2]:loc[3]]
+            torch.maximum(window, m, out=window)
 
         return output
 
 class HerdNetStitcher(Stitcher):
 
-    @torch.no_grad()
-    def _inference(self, patches: torch.Tensor) -> List[torch.Tensor]:
-        
-        self.model.eval()
+    def _forward(self, patches: torch.Tensor) -> torch.Tensor:
+        ''' Heatmap and class map, upsampled to the heatmap size, of a batch of patches '''
 
-        dataset = TensorDataset(patches)
-        dataloader = DataLoader(
-            dataset,   
-            batch_size=self.batch_size,
-            sampler=SequentialSampler(dataset)
-            )
-
-        maps = []
-        for patch in dataloader:
-            patch = patch[0].to(self.device)
-            #outputs = self.model(patch)[0]
-            outputs = self.model(patch) # LossWrapper is not used
-            heatmap = outputs[0]
-            scale_factor = 16
-            clsmap = F.interpolate(outputs[1], scale_factor=scale_factor, mode='nearest')
-            # cat
-            outmaps = torch.cat([heatmap, clsmap], dim=1)
-            maps = [*maps, *outmaps.unsqueeze(0)]
-
-        return maps
+        outputs = self.model(patches) # LossWrapper is not used
+        heatmap = outputs[0]
+        scale_factor = 16
+        clsmap = F.interpolate(outputs[1], scale_factor=scale_factor, mode='nearest')
+        return torch.cat([heatmap, clsmap], dim=1)
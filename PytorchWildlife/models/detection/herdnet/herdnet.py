@@ -1,19 +1,21 @@
 from ..base_detector import BaseDetector
+from .. import runtime as pw_runtime
+from ... import weight_cache as pw_weights
 from ..herdnet.animaloc.eval import HerdNetStitcher, HerdNetLMDS
 from ....data import datasets as pw_data
 from .model import HerdNet as HerdNetArch
 
 import torch
-from torch.hub import load_state_dict_from_url
-from torch.utils.data import DataLoader
 import torchvision.transforms as transforms  
 
 import numpy as np
 from PIL import Image
 from tqdm import tqdm
 import supervision as sv
-import os
-import wget
+
+__all__ = [
+    'HerdNet'
+]
 
 class HerdNet(BaseDetector):
     """
@@ -21,7 +23,8 @@ class HerdNet(BaseDetector):
     loading the model, generating results, and performing single and batch image detections.
     """
     
-    def __init__(self, weights=None, device="cpu", dataset='general' ,url="https://zenodo.org/records/13899852/files/20220413_HerdNet_General_dataset_2022.pth?download=1", transform=None):
+    def __init__(self, weights=None, device="cpu", dataset='general' ,url="https://zenodo.org/records/13899852/files/20220413_HerdNet_General_dataset_2022.pth?download=1", transform=None,
+                 backend="torch", patch_batch_size="auto"):
         """
         Initialize the HerdNet detector.
         
@@ -36,8 +39,15 @@ class HerdNet(BaseDetector):
                 URL to fetch the model weights. Defaults to None.
             transform (torchvision.transforms.Compose, optional):
                 Image transformation for inference. Defaults to None.
+            backend (str, optional):
+                Inference backend, one of "torch", "onnx" or "torchscript". With an exported backend, weights
+                is the path of the exported model, which also stores the class names and normalization. Defaults to "torch".
+            patch_batch_size (int or str, optional):
+                Number of 512x512 patches run through the network together. "auto" picks the largest batch
+                fitting in the free GPU memory on the first image. On CPU, the batch fits in the available memory
+                and is capped to the number of torch threads. Defaults to "auto".
         """
-        super(HerdNet, self).__init__(weights=weights, device=device, url=url)
+        super(HerdNet, self).__init__(weights=weights, device=device, url=url, backend=backend)
         # Assert that the dataset is either 'general' or 'ennedi'
         dataset = dataset.lower()
         assert dataset in ['general', 'ennedi'], "Dataset should be either 'general' or 'ennedi'"
@@ -49,6 +59,7 @@ class HerdNet(BaseDetector):
             model = self.model,
             size = (512,512),
             overlap = 160,
+            batch_size = patch_batch_size,
             down_ratio = 2,
             up = True, 
             reduction = 'mean',
@@ -80,17 +91,21 @@ class HerdNet(BaseDetector):
         Raises:
             Exception: If weights are not provided.
         """
+        if self.backend != "torch" or (weights and weights.endswith(pw_runtime.PREPARED_SUFFIX)):
+            if self.backend != "torch":
+                metadata = self._load_exported(weights, device)
+            else:
+                metadata = self._load_prepared(weights, device)
+            self.num_classes = len(self.CLASS_NAMES) + 1
+            self.img_mean = metadata["mean"]
+            self.img_std = metadata["std"]
+            print(f"Model loaded from {weights}")
+            return
+
         if weights:
-            checkpoint = torch.load(weights, map_location=torch.device(device))
+            checkpoint = pw_runtime.load_checkpoint(weights)
         elif url:
-            filename = url.split('/')[-1][:-11] # Splitting the URL to get the filename and removing the '?download=1' part
-            if not os.path.exists(os.path.join(torch.hub.get_dir(), "checkpoints", filename)):
-                os.makedirs(os.path.join(torch.hub.get_dir(), "checkpoints"), exist_ok=True)
-                weights = wget.download(url, out=os.path.join(torch.hub.get_dir(), "checkpoints"))
-            else:
-                weights = os.path.join(torch.hub.get_dir(), "checkpoints", filename)
-            checkpoint = torch.load(weights, map_location=torch.device(device))
-            #checkpoint = load_state_dict_from_url(url, map_location=torch.device(self.device)) # NOTE: This function is not used in the current implementation
+            checkpoint = pw_runtime.load_checkpoint(pw_weights.get_weights(url))
         else:
             raise Exception("Need weights for inference.")
         
@@ -164,14 +179,49 @@ class HerdNet(BaseDetector):
         if self.transforms:  
             img_tensor = self.transforms(img)
 
-        preds = self.stitcher(img_tensor)  
-        heatmap, clsmap = preds[:,:1,:,:], preds[:,1:,:,:]  
-        counts, locs, labels, scores, dscores = self.lmds((heatmap, clsmap))
-        preds_array = self.process_lmds_results(counts, locs, labels, scores, dscores, det_conf_thres, clf_conf_thres)
+        with self._autocast():
+            preds = self.stitcher(img_tensor).float()
+        preds_array = self._detect_maps([preds], det_conf_thres, clf_conf_thres)[0]
         return self.results_generation(preds_array, img_path, id_strip=id_strip)  
 
+    def multi_image_detection(self, imgs, img_paths=None, det_conf_thres=0.2, clf_conf_thres=0.2, id_strip=None):
+        """
+        Perform detection on a list of in-memory images or image paths, of possibly different sizes.
+        The patches of all images are run through the network in shared batches.
+
+        Args:
+            imgs (list): 
+                Image paths or ndarrays.
+            img_paths (list, optional): 
+                Image paths or identifiers, one per image. Defaults to the paths in imgs.
+            det_conf_thres (float, optional):
+                Confidence threshold for detections. Defaults to 0.2.
+            clf_conf_thres (float, optional):
+                Confidence threshold for classification. Defaults to 0.2.
+            id_strip (str, optional): 
+                Characters to strip from img_id. Defaults to None.
+
+        Returns:
+            list: Detection results, one dict per image.
+        """
+        img_paths = list(img_paths) if img_paths is not None else [None] * len(imgs)
+        tensors = []
+        for i, img in enumerate(imgs):
+            if isinstance(img, str):
+                img_paths[i] = img_paths[i] or img
+                img = np.array(Image.open(img).convert("RGB"))
+            tensors.append(self.transforms(img))
+
+        with self._autocast():
+            maps = [preds.float() for preds in self.stitcher.stitch_images(tensors)]
+        preds_arrays = self._detect_maps(maps, det_conf_thres, clf_conf_thres)
+        return [self.results_generation(preds_array, img_path, id_strip=id_strip)
+                for preds_array, img_path in zip(preds_arrays, img_paths)]
+
 
-    def batch_image_detection(self, data_path, det_conf_thres=0.2, clf_conf_thres=0.2, batch_size=1, id_strip=None):
+    def batch_image_detection(self, data_path, det_conf_thres=0.2, clf_conf_thres=0.2, batch_size=1, id_strip=None,
+                              num_workers=0, prefetch_factor=None, persistent_workers=False, journal=None,
+                              as_batch=False):
         """
         Perform detection on a batch of images.
         
@@ -183,106 +233,230 @@ class HerdNet(BaseDetector):
             clf_conf_thres (float, optional):
                 Confidence threshold for classification. Defaults to 0.2.
             batch_size (int, optional):
-                Batch size for inference. Defaults to 1.
+                Number of images whose patches are pooled into shared inference batches. Defaults to 1.
+            id_strip (str, optional): 
+                Characters to strip from img_id. Defaults to None.
+            num_workers (int, optional):
+                Number of worker processes for image decoding and transformation. Defaults to 0.
+            prefetch_factor (int, optional):
+                Number of batches loaded in advance by each worker. Only used when num_workers > 0. Defaults to None.
+            persistent_workers (bool, optional):
+                Keep the worker processes alive between loader iterations. Only used when num_workers > 0. Defaults to False.
+            journal (PytorchWildlife.utils.DetectionJournal, optional):
+                Checkpoint journal. Images already recorded in it are skipped and every finished image
+                is appended to it, so an interrupted run can be resumed. Defaults to None.
+            as_batch (bool, optional):
+                Return a columnar DetectionBatch instead of a list of dicts. Labels and per-image views are
+                then only built when accessed. Defaults to False.
+
+        Returns:
+            list or DetectionBatch: Detection results for all images.
+        """
+        predictions = self._iter_predictions(data_path, det_conf_thres=det_conf_thres, clf_conf_thres=clf_conf_thres,
+                                             batch_size=batch_size, num_workers=num_workers,
+                                             prefetch_factor=prefetch_factor, persistent_workers=persistent_workers,
+                                             journal=journal)
+        if as_batch:
+            return self._generate_batch(predictions, id_strip=id_strip, journal=journal)
+        return list(self._generate_results(predictions, id_strip=id_strip, journal=journal))
+
+    def iter_image_detection(self, data_path, det_conf_thres=0.2, clf_conf_thres=0.2, batch_size=1, id_strip=None,
+                             num_workers=0, prefetch_factor=None, persistent_workers=False, journal=None):
+        """
+        Perform detection on a batch of images, yielding the results as each batch finishes.
+        Memory use depends on the batch size rather than on the number of images.
+        
+        Args:
+            data_path (str): 
+                Path containing all images for inference.
+            det_conf_thres (float, optional):
+                Confidence threshold for detections. Defaults to 0.2.
+            clf_conf_thres (float, optional):
+                Confidence threshold for classification. Defaults to 0.2.
+            batch_size (int, optional):
+                Number of images whose patches are pooled into shared inference batches. Defaults to 1.
             id_strip (str, optional): 
                 Characters to strip from img_id. Defaults to None.
+            num_workers (int, optional):
+                Number of worker processes for image decoding and transformation. Defaults to 0.
+            prefetch_factor (int, optional):
+                Number of batches loaded in advance by each worker. Only used when num_workers > 0. Defaults to None.
+            persistent_workers (bool, optional):
+                Keep the worker processes alive between loader iterations. Only used when num_workers > 0. Defaults to False.
+            journal (PytorchWildlife.utils.DetectionJournal, optional):
+                Checkpoint journal. Images already recorded in it are skipped and every finished image
+                is appended to it, so an interrupted run can be resumed. Defaults to None.
+
+        Returns:
+            generator: Detection results, one dict per image.
+        """
+        return self._generate_results(
+            self._iter_predictions(data_path, det_conf_thres=det_conf_thres, clf_conf_thres=clf_conf_thres,
+                                   batch_size=batch_size, num_workers=num_workers, prefetch_factor=prefetch_factor,
+                                   persistent_workers=persistent_workers, journal=journal),
+            id_strip=id_strip, journal=journal
+        )
+
+    def _iter_predictions(self, data_path, det_conf_thres=0.2, clf_conf_thres=0.2, batch_size=1, num_workers=0,
+                          prefetch_factor=None, persistent_workers=False, journal=None):
+        """
+        Run the stitcher and LMDS over a folder of images, yielding the raw predictions of each image.
+        See iter_image_detection for the arguments.
 
         Returns:
-            list: List of detection results for all images.
+            generator: (image path, predictions in xyxy, confidence, class_id format, original (height, width)) tuples.
         """
         dataset = pw_data.DetectionImageFolder(
             data_path,
-            transform=self.transforms
+            transform=self.transforms,
+            exclude=journal.completed() if journal else None,
         )
-        # Creating a Dataloader for batching and parallel processing of the images
-        loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, 
-                            pin_memory=True, num_workers=0, drop_last=False) # TODO: discuss. why is num_workers 0?
-        
-        results = []
-
-        with tqdm(total=len(loader)) as pbar:
-            for batch_index, (imgs, paths, sizes) in enumerate(loader):
-                imgs = imgs.to(self.device)
-                predictions = self.stitcher(imgs[0]).detach().cpu()
-                heatmap, clsmap = predictions[:,:1,:,:], predictions[:,1:,:,:]
-                counts, locs, labels, scores, dscores = self.lmds((heatmap, clsmap))
-                preds_array = self.process_lmds_results(counts, locs, labels, scores, dscores, det_conf_thres, clf_conf_thres) 
-                results_dict = self.results_generation(preds_array, paths[0], id_strip=id_strip)
-                pbar.update(1)
-                sizes = sizes.numpy()
-                normalized_coords = [[x1 / sizes[0][0], y1 / sizes[0][1], x2 / sizes[0][0], y2 / sizes[0][1]] for x1, y1, x2, y2 in preds_array[:, :4]] # TODO: Check if this is correct due to xy swapping 
-                results_dict['normalized_coords'] = normalized_coords
-                results.append(results_dict)
-        return results
+        # One sample per image, as images of different sizes cannot be collated: batches are built here.
+        # Images stay on the host, where the stitcher cuts them into patches
+        loader = self._build_loader(dataset, batch_size=None, num_workers=num_workers,
+                                    prefetch_factor=prefetch_factor, persistent_workers=persistent_workers)
+
+        def run_batch(imgs):
+            with self._autocast():
+                maps = [preds.float().detach() for preds in self.stitcher.stitch_images([img for img, _, _ in imgs])]
+            preds_arrays = self._detect_maps(maps, det_conf_thres, clf_conf_thres)
+            for (_, path, size), preds_array in zip(imgs, preds_arrays):
+                yield path, preds_array, size.cpu().numpy()
+
+        with tqdm(total=len(dataset)) as pbar:
+            imgs = []
+            for img, path, size in loader:
+                imgs.append((img, path, size))
+                if len(imgs) == batch_size:
+                    yield from run_batch(imgs)
+                    pbar.update(len(imgs))
+                    imgs = []
+            if imgs:
+                yield from run_batch(imgs)
+                pbar.update(len(imgs))
+
+    def _detect_maps(self, maps, det_conf_thres=0.2, clf_conf_thres=0.2):
+        """
+        Run LMDS over the stitched maps of several images at once. Maps of different sizes are zero-padded
+        to the largest one, which adds no detection as the heatmap is non-negative.
+
+        Args:
+            maps (list): 
+                Stitched maps of shape [1, 1 + C, H, W], heatmap first, one per image.
+            det_conf_thres (float, optional):
+                Confidence threshold for detections. Defaults to 0.2.
+            clf_conf_thres (float, optional):
+                Confidence threshold for classification. Defaults to 0.2.
+
+        Returns:
+            list: Predictions in xyxy, confidence, class_id format, one numpy.ndarray per image.
+        """
+        if len({tuple(m.shape) for m in maps}) == 1:
+            preds = torch.cat(maps)
+        else:
+            height = max(m.shape[2] for m in maps)
+            width = max(m.shape[3] for m in maps)
+            preds = maps[0].new_zeros((len(maps), maps[0].shape[1], height, width))
+            for b, m in enumerate(maps):
+                preds[b, :, :m.shape[2], :m.shape[3]] = m[0]
+        heatmap, clsmap = preds[:,:1,:,:], preds[:,1:,:,:]
+        counts, _, locs, labels, scores, dscores = self.lmds.detect((heatmap, clsmap))
+        return self.process_lmds_results(counts, locs, labels, scores, dscores, det_conf_thres, clf_conf_thres)
 
     def process_lmds_results(self, counts, locs, labels, scores, dscores, det_conf_thres=0.2, clf_conf_thres=0.2):
         """
-        Process the results from the Local Maxima Detection Strategy.
+        Process the results from the Local Maxima Detection Strategy, as returned by HerdNetLMDS.detect.
 
         Args:
-            counts (list): 
-                Number of detections for each species.
-            locs (list): 
-                Locations of the detections.
-            labels (list): 
-                Labels of the detections.
-            scores (list): 
-                Scores of the detections.
-            dscores (list): 
-                Detection scores.
+            counts (torch.Tensor): 
+                Number of detections for each image and species, of shape [B, C-1].
+            locs (torch.Tensor): 
+                Locations of the detections as (row, column), of shape [N, 2], sorted by image.
+            labels (torch.Tensor): 
+                Labels of the detections, of shape [N].
+            scores (torch.Tensor): 
+                Scores of the detections, of shape [N].
+            dscores (torch.Tensor): 
+                Detection scores, of shape [N].
             det_conf_thres (float, optional):
                 Confidence threshold for detections. Defaults to 0.2.
             clf_conf_thres (float, optional):
                 Confidence threshold for classification. Defaults to 0.2.
 
         Returns:
-            numpy.ndarray: Processed detection results.
+            list: Processed detection results, one numpy.ndarray in xyxy, confidence, class_id format per image.
         """
-        # Flatten the lists since we know its a single image 
-        counts = counts[0]  
-        locs = locs[0]  
-        labels = labels[0]  
-        scores = scores[0]
-        dscores = dscores[0]  
-    
-        # Calculate the total number of detections  
-        total_detections = sum(counts)  
-        
-        # Pre-allocate based on total possible detections  
-        preds_array = np.empty((total_detections, 6)) #xyxy, confidence, class_id format
-        detection_idx = 0
-        valid_detections_idx = 0 # Index for valid detections after applying the confidence threshold
-        # Loop through each species  
-        for specie_idx in range(len(counts)):  
-            count = counts[specie_idx]  
-            if count == 0:  
-                continue  
-            
-            # Get the detections for this species  
-            species_locs = np.array(locs[detection_idx : detection_idx + count])
-            species_locs[:, [0, 1]] = species_locs[:, [1, 0]] # Swap x and y in species_locs
-            species_scores = np.array(scores[detection_idx : detection_idx + count])
-            species_dscores = np.array(dscores[detection_idx : detection_idx + count])
-            species_labels = np.array(labels[detection_idx : detection_idx + count])
-
-            # Apply the confidence threshold
-            valid_detections_by_clf_score = species_scores > clf_conf_thres
-            valid_detections_by_det_score = species_dscores > det_conf_thres
-            valid_detections = np.logical_and(valid_detections_by_clf_score, valid_detections_by_det_score)
-            valid_detections_count = np.sum(valid_detections)
-            valid_detections_idx += valid_detections_count
-            # Fill the preds_array with the valid detections
-            if valid_detections_count > 0:
-                preds_array[valid_detections_idx - valid_detections_count : valid_detections_idx, :2] = species_locs[valid_detections] - 1
-                preds_array[valid_detections_idx - valid_detections_count : valid_detections_idx, 2:4] = species_locs[valid_detections] + 1
-                preds_array[valid_detections_idx - valid_detections_count : valid_detections_idx, 4] = species_scores[valid_detections]
-                preds_array[valid_detections_idx - valid_detections_count : valid_detections_idx, 5] = species_labels[valid_detections]
-            
-            detection_idx += count # Move to the next species 
+        sizes = counts.sum(dim=1).cpu().numpy()
+        locs = locs.cpu().numpy().astype(np.float64)
+        scores = scores.cpu().numpy().astype(np.float64)
+        dscores = dscores.cpu().numpy().astype(np.float64)
+        labels = labels.cpu().numpy().astype(np.float64)
+
+        # Boxes of 2 pixels around the points, swapping (row, column) to (x, y)
+        xy = locs[:, ::-1]
+        preds_array = np.concatenate([xy - 1, xy + 1, scores[:, None], labels[:, None]], axis=1)
+
+        # Apply the confidence thresholds and split per image
+        valid_detections = np.logical_and(scores > clf_conf_thres, dscores > det_conf_thres)
+        bounds = np.cumsum(sizes)[:-1]
+        return [preds[valid] for preds, valid in zip(np.split(preds_array, bounds), np.split(valid_detections, bounds))]
+
+    def warmup(self, img_size=None):
+        """
+        Run a dummy forward pass through the model.
         
-        preds_array = preds_array[:valid_detections_idx] # Remove the empty rows
+        Args:
+            img_size (int, optional):
+                Size of the dummy square image. Defaults to the stitcher patch size.
+        """
+        super(HerdNet, self).warmup(img_size=img_size or self.stitcher.size[0])
+
+    def _export_module(self):
+        """
+        Module traced by export: the full HerdNet model, returning the heatmap and the class map.
+        """
+        return self.model
+
+    def _export_output_names(self):
+        """
+        Names of the outputs of the exported module.
+        """
+        return ["heatmap", "clsmap"]
+
+    def _export_metadata(self):
+        """
+        Metadata stored in exported artifacts: class names and image normalization.
+        """
+        return {
+            "class_names": self.CLASS_NAMES,
+            "mean": list(self.img_mean),
+            "std": list(self.img_std)
+        }
+
+    def export(self, path, format="onnx", img_size=None, batch_size=1, dynamic_batch=True, opset=17):
+        """
+        Export the HerdNet model to an ONNX or TorchScript artifact. Patching, stitching and LMDS stay
+        in Python, so results are the same as with the torch backend.
         
-        return preds_array
+        Args:
+            path (str): 
+                Path of the artifact to write.
+            format (str, optional): 
+                Export format, either "onnx" or "torchscript". Defaults to "onnx".
+            img_size (int, optional):
+                Size of the square input patches. Defaults to the stitcher patch size.
+            batch_size (int, optional):
+                Batch size of the example input. Defaults to 1.
+            dynamic_batch (bool, optional):
+                Export the batch dimension as dynamic for ONNX. Defaults to True.
+            opset (int, optional):
+                ONNX opset version. Defaults to 17.
+
+        Returns:
+            str: Path of the written artifact.
+        """
+        return super(HerdNet, self).export(path, format=format, img_size=img_size or self.stitcher.size[0],
+                                           batch_size=batch_size, dynamic_batch=dynamic_batch, opset=opset)
 
     def forward(self, input: torch.Tensor):
         """
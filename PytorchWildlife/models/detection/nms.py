@@ -0,0 +1,308 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Batched, device-side post-processing of YOLO detector outputs. """
+
+# Importing basic libraries
+import numpy as np
+import torch
+import torchvision
+
+__all__ = [
+    "scale_letterbox_boxes",
+    "yolov5_batched_nms",
+    "yolov5_postprocess",
+    "yolov8_batched_nms",
+    "yolov8_postprocess",
+    "merge_tile_detections"
+]
+
+
+def _rank_in_groups(groups, num_groups):
+    """
+    Rank of each element within its group, for group IDs sorted in ascending order.
+    """
+    counts = torch.bincount(groups, minlength=num_groups)
+    starts = torch.cumsum(counts, 0) - counts
+    return torch.arange(len(groups), device=groups.device) - starts[groups]
+
+
+def _sort_by_group(groups, scores):
+    """
+    Order grouping the elements by group, with decreasing scores within each group.
+    """
+    order = torch.argsort(scores, descending=True)
+    return order[torch.argsort(groups[order], stable=True)]
+
+
+def scale_letterbox_boxes(boxes, letterbox_shape, img_sizes):
+    """
+    Map boxes from letterboxed image coordinates back to original image coordinates, for all images
+    of a batch at once. Inverse of the centered resize-and-pad of PytorchWildlife.data.transforms.letterbox.
+
+    Args:
+        boxes (torch.Tensor):
+            Boxes in xyxy format in letterboxed image coordinates, shape [K, 4].
+        letterbox_shape (tuple):
+            (height, width) of the letterboxed images.
+        img_sizes (torch.Tensor):
+            Original (height, width) of the image of each box, shape [K, 2].
+
+    Returns:
+        torch.Tensor: Boxes in original image coordinates, clipped to the image, shape [K, 4].
+    """
+    img_sizes = img_sizes.to(boxes.device, boxes.dtype)
+    height, width = img_sizes[:, 0], img_sizes[:, 1]
+    gain = torch.minimum(letterbox_shape[0] / height, letterbox_shape[1] / width)
+    pad_x = (letterbox_shape[1] - width * gain) / 2
+    pad_y = (letterbox_shape[0] - height * gain) / 2
+    boxes = (boxes - torch.stack([pad_x, pad_y, pad_x, pad_y], dim=1)) / gain[:, None]
+    limits = torch.stack([width, height, width, height], dim=1)
+    return torch.minimum(boxes.clamp_(min=0), limits)
+
+
+def yolov5_batched_nms(prediction, conf_thres=0.2, iou_thres=0.45, max_det=300, pre_nms_topk=30000, agnostic=False):
+    """
+    Class-aware non-maximum suppression over a whole batch of YOLOv5 outputs, on their device.
+    Candidates of all images are filtered and suppressed together, grouped by image and class, so there
+    is no per-image Python loop.
+
+    Args:
+        prediction (torch.Tensor):
+            Raw YOLOv5 output of shape [B, N, 5 + num_classes] (xywh, objectness, class scores).
+        conf_thres (float, optional):
+            Confidence threshold, applied to the objectness first and then to objectness times class score.
+            Defaults to 0.2.
+        iou_thres (float, optional):
+            IoU threshold of the suppression. Defaults to 0.45.
+        max_det (int, optional):
+            Maximum number of detections kept per image. Defaults to 300.
+        pre_nms_topk (int, optional):
+            Maximum number of candidates per image entering the suppression. Defaults to 30000.
+        agnostic (bool, optional):
+            Suppress boxes across classes. Defaults to False.
+
+    Returns:
+        tuple: Detections in xyxy, confidence, class_id format of shape [K, 6] and the batch index of each
+        detection of shape [K], grouped by image with decreasing confidence.
+    """
+    batch_size = prediction.shape[0]
+
+    # Confidence pre-filtering on the objectness, before the class scores are computed
+    img_idx, anchor_idx = torch.nonzero(prediction[..., 4] > conf_thres, as_tuple=True)
+    x = prediction[img_idx, anchor_idx]
+    conf, cls = (x[:, 5:] * x[:, 4:5]).max(1)
+    keep = conf > conf_thres
+    x, conf, cls, img_idx = x[keep], conf[keep], cls[keep], img_idx[keep]
+
+    # Pre-NMS top-k per image
+    order = _sort_by_group(img_idx, conf)
+    order = order[_rank_in_groups(img_idx[order], batch_size) < pre_nms_topk]
+    x, conf, cls, img_idx = x[order], conf[order], cls[order], img_idx[order]
+
+    # xywh to xyxy
+    boxes = torch.cat([x[:, :2] - x[:, 2:4] / 2, x[:, :2] + x[:, 2:4] / 2], dim=1)
+
+    # Class-aware NMS of all images at once, grouping boxes by image and class
+    groups = img_idx if agnostic else img_idx * (prediction.shape[2] - 5) + cls
+    keep = torchvision.ops.batched_nms(boxes, conf, groups, iou_thres)
+
+    # Limiting the detections per image
+    keep = keep[_sort_by_group(img_idx[keep], conf[keep])]
+    keep = keep[_rank_in_groups(img_idx[keep], batch_size) < max_det]
+
+    dets = torch.cat([boxes[keep], conf[keep, None], cls[keep, None].to(boxes.dtype)], dim=1)
+    return dets, img_idx[keep]
+
+
+def yolov5_postprocess(prediction, letterbox_shape, img_sizes, conf_thres=0.2, iou_thres=0.45, max_det=300,
+                       pre_nms_topk=30000, round_boxes=True):
+    """
+    Batched NMS and letterbox inverse scaling of YOLOv5 outputs on their device. Only the surviving
+    detections are copied to host memory.
+
+    Args:
+        prediction (torch.Tensor):
+            Raw YOLOv5 output of shape [B, N, 5 + num_classes].
+        letterbox_shape (tuple):
+            (height, width) of the letterboxed input batch.
+        img_sizes (torch.Tensor or list):
+            Original (height, width) of each image of the batch.
+        conf_thres (float, optional):
+            Confidence threshold. Defaults to 0.2.
+        iou_thres (float, optional):
+            IoU threshold of the suppression. Defaults to 0.45.
+        max_det (int, optional):
+            Maximum number of detections kept per image. Defaults to 300.
+        pre_nms_topk (int, optional):
+            Maximum number of candidates per image entering the suppression. Defaults to 30000.
+        round_boxes (bool, optional):
+            Round the boxes to whole pixels. Defaults to True.
+
+    Returns:
+        list: numpy.ndarray predictions in xyxy, confidence, class_id format, one per image.
+    """
+    batch_size = prediction.shape[0]
+    dets, img_idx = yolov5_batched_nms(prediction, conf_thres=conf_thres, iou_thres=iou_thres,
+                                       max_det=max_det, pre_nms_topk=pre_nms_topk)
+    img_sizes = torch.tensor([[int(size[0]), int(size[1])] for size in img_sizes], device=dets.device)
+    dets[:, :4] = scale_letterbox_boxes(dets[:, :4], tuple(letterbox_shape), img_sizes[img_idx])
+    if round_boxes:
+        dets[:, :4] = dets[:, :4].round()
+
+    counts = torch.bincount(img_idx, minlength=batch_size).tolist()
+    return [d.numpy() for d in torch.split(dets.cpu(), counts)]
+
+
+def yolov8_batched_nms(prediction, conf_thres=0.2, iou_thres=0.7, max_det=300, pre_nms_topk=30000, agnostic=False):
+    """
+    Class-aware non-maximum suppression over a whole batch of YOLOv8-format outputs (also YOLOv9 and other
+    anchor-free ultralytics heads), on their device, keeping the best class of each box.
+
+    Args:
+        prediction (torch.Tensor):
+            Raw output of shape [B, 4 + num_classes, N] (xywh, class scores), without objectness.
+        conf_thres (float, optional):
+            Confidence threshold on the best class score. Defaults to 0.2.
+        iou_thres (float, optional):
+            IoU threshold of the suppression. Defaults to 0.7.
+        max_det (int, optional):
+            Maximum number of detections kept per image. Defaults to 300.
+        pre_nms_topk (int, optional):
+            Maximum number of candidates per image entering the suppression. Defaults to 30000.
+        agnostic (bool, optional):
+            Suppress boxes across classes. Defaults to False.
+
+    Returns:
+        tuple: Detections in xyxy, confidence, class_id format of shape [K, 6] and the batch index of each
+        detection of shape [K], grouped by image with decreasing confidence.
+    """
+    batch_size, num_classes = prediction.shape[0], prediction.shape[1] - 4
+    prediction = prediction.transpose(1, 2)
+
+    # Best class of each box and confidence filtering
+    conf, cls = prediction[..., 4:].max(2)
+    img_idx, anchor_idx = torch.nonzero(conf > conf_thres, as_tuple=True)
+    x, conf, cls = prediction[img_idx, anchor_idx, :4], conf[img_idx, anchor_idx], cls[img_idx, anchor_idx]
+
+    # Pre-NMS top-k per image
+    order = _sort_by_group(img_idx, conf)
+    order = order[_rank_in_groups(img_idx[order], batch_size) < pre_nms_topk]
+    x, conf, cls, img_idx = x[order], conf[order], cls[order], img_idx[order]
+
+    # xywh to xyxy
+    boxes = torch.cat([x[:, :2] - x[:, 2:4] / 2, x[:, :2] + x[:, 2:4] / 2], dim=1)
+
+    # Class-aware NMS of all images at once, grouping boxes by image and class
+    groups = img_idx if agnostic else img_idx * num_classes + cls
+    keep = torchvision.ops.batched_nms(boxes, conf, groups, iou_thres)
+
+    # Limiting the detections per image
+    keep = keep[_sort_by_group(img_idx[keep], conf[keep])]
+    keep = keep[_rank_in_groups(img_idx[keep], batch_size) < max_det]
+
+    dets = torch.cat([boxes[keep], conf[keep, None], cls[keep, None].to(boxes.dtype)], dim=1)
+    return dets, img_idx[keep]
+
+
+def yolov8_postprocess(prediction, letterbox_shape, img_sizes, conf_thres=0.2, iou_thres=0.7, max_det=300,
+                       pre_nms_topk=30000):
+    """
+    Batched NMS and letterbox inverse scaling of YOLOv8-format outputs on their device. Boxes are scaled
+    back as ultralytics does, with the padding and the scale of each side rounded to whole pixels.
+
+    Args:
+        prediction (torch.Tensor):
+            Raw output of shape [B, 4 + num_classes, N].
+        letterbox_shape (tuple):
+            (height, width) of the letterboxed input batch.
+        img_sizes (torch.Tensor or list):
+            Original (height, width) of each image of the batch.
+        conf_thres (float, optional):
+            Confidence threshold. Defaults to 0.2.
+        iou_thres (float, optional):
+            IoU threshold of the suppression. Defaults to 0.7.
+        max_det (int, optional):
+            Maximum number of detections kept per image. Defaults to 300.
+        pre_nms_topk (int, optional):
+            Maximum number of candidates per image entering the suppression. Defaults to 30000.
+
+    Returns:
+        list: numpy.ndarray predictions in xyxy, confidence, class_id format, one per image.
+    """
+    batch_size = prediction.shape[0]
+    dets, img_idx = yolov8_batched_nms(prediction, conf_thres=conf_thres, iou_thres=iou_thres,
+                                       max_det=max_det, pre_nms_topk=pre_nms_topk)
+
+    # Padding, scale and limits of each image, in xyxy order
+    pads, gains, limits = [], [], []
+    for size in img_sizes:
+        height, width = int(size[0]), int(size[1])
+        gain = min(letterbox_shape[0] / height, letterbox_shape[1] / width)
+        new_h, new_w = round(height * gain), round(width * gain)
+        pad_x = round((letterbox_shape[1] - new_w) / 2 - 0.1)
+        pad_y = round((letterbox_shape[0] - new_h) / 2 - 0.1)
+        pads.append([pad_x, pad_y, pad_x, pad_y])
+        gains.append([new_w / width, new_h / height, new_w / width, new_h / height])
+        limits.append([width, height, width, height])
+    pads, gains, limits = (torch.tensor(v, dtype=dets.dtype, device=dets.device)[img_idx] for v in (pads, gains, limits))
+    dets[:, :4] = torch.minimum(((dets[:, :4] - pads) / gains).clamp_(min=0), limits)
+
+    counts = torch.bincount(img_idx, minlength=batch_size).tolist()
+    return [d.numpy() for d in torch.split(dets.cpu(), counts)]
+
+
+def merge_tile_detections(dets, iou_thres=0.5, metric="ios", tile_ids=None):
+    """
+    Class-aware suppression of the duplicate detections of one image gathered from overlapping tiles.
+    Boxes are visited by decreasing confidence and each kept box suppresses the lower-scored boxes of
+    its class, from other tiles, overlapping it by more than iou_thres. Boxes of the same tile were
+    already suppressed by the NMS of the detector, so a small box inside a larger one of the same
+    tile (e.g. a fawn beside a doe) is kept.
+
+    Args:
+        dets (numpy.ndarray):
+            Detections in image coordinates, in xyxy, confidence, class_id format.
+        iou_thres (float, optional):
+            Overlap threshold of the suppression. Defaults to 0.5.
+        metric (str, optional):
+            "ios" (intersection over the smaller box) also suppresses the partial boxes of objects cut by a
+            tile border, which lie inside the full box from a neighboring tile; "iou" is the usual
+            intersection over union. Defaults to "ios".
+        tile_ids (numpy.ndarray, optional):
+            Tile of each detection. Only detections of different tiles suppress each other. Defaults to
+            None (all detections suppress each other).
+
+    Returns:
+        numpy.ndarray: Kept detections, by decreasing confidence.
+    """
+    assert metric in ("ios", "iou"), "metric should be 'ios' or 'iou'"
+    if len(dets) < 2:
+        return dets
+    order = np.argsort(-dets[:, 4], kind="stable")
+    dets = dets[order]
+    if tile_ids is not None:
+        tile_ids = np.asarray(tile_ids)[order]
+    # Offsetting the boxes by class so that boxes of different classes never overlap
+    boxes = dets[:, :4] + dets[:, 5:6] * (dets[:, :4].max() + 1)
+    areas = (boxes[:, 2] - boxes[:, 0]).clip(min=0) * (boxes[:, 3] - boxes[:, 1]).clip(min=0)
+
+    order = np.arange(len(dets))
+    keep = []
+    while len(order):
+        i, order = order[0], order[1:]
+        keep.append(i)
+        if not len(order):
+            break
+        w = (np.minimum(boxes[i, 2], boxes[order, 2]) - np.maximum(boxes[i, 0], boxes[order, 0])).clip(min=0)
+        h = (np.minimum(boxes[i, 3], boxes[order, 3]) - np.maximum(boxes[i, 1], boxes[order, 1])).clip(min=0)
+        inter = w * h
+        if metric == "ios":
+            denom = np.minimum(areas[i], areas[order])
+        else:
+            denom = areas[i] + areas[order] - inter
+        suppressed = inter > iou_thres * np.maximum(denom, 1e-6)
+        if tile_ids is not None:
+            suppressed &= tile_ids[order] != tile_ids[i]
+        order = order[~suppressed]
+    return dets[keep]
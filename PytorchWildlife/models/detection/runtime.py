@@ -0,0 +1,253 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Export of detection models to ONNX / TorchScript, runtime wrapper for the exported artifacts and
+memory-mapped, inference-ready torch checkpoints. """
+
+# Importing basic libraries
+import os
+import json
+import inspect
+
+import torch
+from torch import nn
+
+__all__ = [
+    "EXPORT_FORMATS",
+    "export_model",
+    "ExportedModel",
+    "PREPARED_SUFFIX",
+    "save_prepared",
+    "load_prepared",
+    "load_checkpoint"
+]
+
+# Supported export formats and the file extension of their artifacts
+EXPORT_FORMATS = {
+    "onnx": ".onnx",
+    "torchscript": ".torchscript"
+}
+
+# Key of the PytorchWildlife metadata stored in the exported artifacts
+METADATA_KEY = "pytorchwildlife"
+
+# File suffix of prepared, inference-ready torch checkpoints
+PREPARED_SUFFIX = ".prepared.pt"
+PREPARED_VERSION = 1
+
+
+def export_model(model, path, example_input, format="onnx", metadata=None, output_names=None,
+                 dynamic_batch=True, opset=17):
+    """
+    Export a model to an ONNX or TorchScript artifact, together with the metadata needed to rebuild
+    the detector around it (class names, image size, normalization...).
+
+    Args:
+        model (torch.nn.Module):
+            Model to export. Its forward should return a tensor or a tuple of tensors.
+        path (str):
+            Path of the artifact to write.
+        example_input (torch.Tensor):
+            Example input batch used to trace the model.
+        format (str, optional):
+            Export format, either "onnx" or "torchscript". Defaults to "onnx".
+        metadata (dict, optional):
+            JSON-serializable metadata stored in the artifact. Defaults to None.
+        output_names (list, optional):
+            Names of the model outputs in the ONNX graph. Defaults to None.
+        dynamic_batch (bool, optional):
+            Export the batch dimension as dynamic (ONNX only, TorchScript traces are always batch
+            independent for convolutional models). Defaults to True.
+        opset (int, optional):
+            ONNX opset version. Defaults to 17.
+
+    Returns:
+        str: Path of the written artifact.
+    """
+    assert format in EXPORT_FORMATS, \
+        f"format should be one of {list(EXPORT_FORMATS)}, got '{format}'"
+    metadata = json.dumps(metadata or {})
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+
+    model = model.eval()
+    with torch.no_grad():
+        if format == "torchscript":
+            traced = torch.jit.trace(model, example_input, strict=False, check_trace=False)
+            traced = torch.jit.freeze(traced)
+            torch.jit.save(traced, path, _extra_files={"metadata.json": metadata})
+            return path
+
+        try:
+            import onnx
+        except ImportError:
+            raise ImportError("ONNX export requires the onnx package: pip install onnx")
+
+        output_names = output_names or ["output"]
+        dynamic_axes = None
+        if dynamic_batch:
+            dynamic_axes = {"images": {0: "batch"}}
+            dynamic_axes.update({name: {0: "batch"} for name in output_names})
+        kwargs = {}
+        # Newer torch releases default to the torch.export based exporter, which needs extra packages
+        if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+            kwargs["dynamo"] = False
+        torch.onnx.export(model, (example_input,), path, input_names=["images"], output_names=output_names,
+                          dynamic_axes=dynamic_axes, opset_version=opset, do_constant_folding=True, **kwargs)
+
+    # Storing the metadata in the ONNX model properties
+    onnx_model = onnx.load(path)
+    prop = onnx_model.metadata_props.add()
+    prop.key, prop.value = METADATA_KEY, metadata
+    onnx.save(onnx_model, path)
+    return path
+
+
+class ExportedModel(nn.Module):
+    """
+    Runs an exported ONNX or TorchScript artifact with the call convention of a torch model: a batch
+    tensor in, a tuple of output tensors out, on the device of the input. This lets detectors and the
+    HerdNet stitcher use the artifact in place of the original model without loading the training
+    framework it was built with.
+    """
+
+    def __init__(self, path, backend=None, device="cpu"):
+        """
+        Load an exported artifact.
+
+        Args:
+            path (str):
+                Path of the ONNX or TorchScript artifact.
+            backend (str, optional):
+                Runtime, either "onnx" (ONNX Runtime) or "torchscript". Defaults to None, which infers it
+                from the file extension.
+            device (str, optional):
+                Device for model inference. Defaults to "cpu".
+        """
+        super(ExportedModel, self).__init__()
+        if backend is None:
+            backend = "onnx" if path.endswith(EXPORT_FORMATS["onnx"]) else "torchscript"
+        assert backend in EXPORT_FORMATS, \
+            f"backend should be one of {list(EXPORT_FORMATS)}, got '{backend}'"
+        assert os.path.exists(path), f"Exported model not found: {path}"
+        self.path = path
+        self.backend = backend
+        self.device = torch.device(device)
+        self.session = None
+        self.module = None
+
+        if backend == "onnx":
+            try:
+                import onnxruntime as ort
+            except ImportError:
+                raise ImportError("The onnx backend requires ONNX Runtime: pip install onnxruntime")
+            providers = ["CPUExecutionProvider"]
+            if self.device.type == "cuda" and "CUDAExecutionProvider" in ort.get_available_providers():
+                providers.insert(0, ("CUDAExecutionProvider", {"device_id": self.device.index or 0}))
+            self.session = ort.InferenceSession(path, providers=providers)
+            self.input_name = self.session.get_inputs()[0].name
+            metadata = self.session.get_modelmeta().custom_metadata_map.get(METADATA_KEY, "{}")
+        else:
+            extra_files = {"metadata.json": ""}
+            self.module = torch.jit.load(path, map_location=self.device, _extra_files=extra_files)
+            self.module.eval()
+            metadata = extra_files["metadata.json"] or "{}"
+            if isinstance(metadata, bytes):
+                metadata = metadata.decode("utf-8")
+
+        self.metadata = json.loads(metadata)
+
+    def forward(self, x):
+        """
+        Run the exported model.
+
+        Args:
+            x (torch.Tensor):
+                Input batch.
+
+        Returns:
+            tuple: Output tensors, on the device of the input.
+        """
+        if self.session is not None:
+            outputs = self.session.run(None, {self.input_name: x.detach().float().cpu().numpy()})
+            return tuple(torch.from_numpy(out).to(x.device) for out in outputs)
+
+        outputs = self.module(x.to(self.device).float())
+        if not isinstance(outputs, (list, tuple)):
+            outputs = (outputs,)
+        return tuple(out.to(x.device) for out in outputs)
+
+
+def save_prepared(model, path, metadata=None):
+    """
+    Save an inference-ready model (converted to float, fused and in eval mode) together with its metadata,
+    so it can be loaded back with load_prepared without repeating these steps. Tensors are stored in the
+    zip format of torch.save, which torch.load can memory-map.
+
+    Args:
+        model (torch.nn.Module):
+            Inference-ready model.
+        path (str):
+            Path of the artifact to write, ending with PREPARED_SUFFIX.
+        metadata (dict, optional):
+            Metadata needed to rebuild the detector around the model. Defaults to None.
+
+    Returns:
+        str: Path of the written artifact.
+    """
+    assert path.endswith(PREPARED_SUFFIX), f"Prepared model paths should end with '{PREPARED_SUFFIX}'"
+    dirname = os.path.dirname(path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    checkpoint = {
+        "version": PREPARED_VERSION,
+        "torch_version": torch.__version__,
+        "metadata": metadata or {},
+        "model": model.eval(),
+    }
+    # Writing to a temporary file first so that workers never see a partial artifact
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torch.save(checkpoint, tmp_path)
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_checkpoint(path):
+    """
+    Load a torch checkpoint on the CPU, memory-mapping its tensors when the file is in the zip format.
+    Tensors are then only read from disk when used, and the pages are shared between the processes
+    loading the same file.
+
+    Args:
+        path (str):
+            Path of the checkpoint.
+
+    Returns:
+        object: The loaded checkpoint.
+    """
+    try:
+        return torch.load(path, map_location="cpu", mmap=True, weights_only=False)
+    except RuntimeError:
+        # Checkpoints in the legacy, non-zip format cannot be memory-mapped
+        return torch.load(path, map_location="cpu", weights_only=False)
+
+
+def load_prepared(path, device="cpu"):
+    """
+    Load a model saved by save_prepared.
+
+    Args:
+        path (str):
+            Path of the prepared artifact.
+        device (str, optional):
+            Device for model inference. Defaults to "cpu".
+
+    Returns:
+        tuple: The model, in eval mode on device, and its metadata.
+    """
+    assert os.path.exists(path), f"Prepared model not found: {path}"
+    checkpoint = torch.load(path, map_location="cpu", mmap=True, weights_only=False)
+    assert checkpoint.get("version") == PREPARED_VERSION, \
+        f"{path} was prepared by an incompatible version of PytorchWildlife, prepare it again."
+    return checkpoint["model"].to(device).eval(), checkpoint["metadata"]
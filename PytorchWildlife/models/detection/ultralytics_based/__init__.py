@@ -1,4 +1,9 @@
-from .yolov5_base import *
-from .yolov8_base import *
-from .megadetectorv5 import *
-from .megadetectorv6 import *
\ No newline at end of file
+from ...._lazy import attach
+
+# Submodules are imported on first access to one of their names
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "yolov5_base": ["YOLOV5Base"],
+    "yolov8_base": ["YOLOV8Base"],
+    "megadetectorv5": ["MegaDetectorV5"],
+    "megadetectorv6": ["MegaDetectorV6"],
+})
\ No newline at end of file
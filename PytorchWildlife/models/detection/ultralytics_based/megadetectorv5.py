@@ -26,7 +26,7 @@ class MegaDetectorV5(YOLOV5Base):
         2: "vehicle"
     }
 
-    def __init__(self, weights=None, device="cpu", pretrained=True, version="a"):
+    def __init__(self, weights=None, device="cpu", pretrained=True, version="a", backend="torch"):
         """
         Initializes the MegaDetectorV5 model with the option to load pretrained weights.
         
@@ -35,6 +35,8 @@ class MegaDetectorV5(YOLOV5Base):
             device (str, optional): Device to load the model on (e.g., "cpu" or "cuda"). Default is "cpu".
             pretrained (bool, optional): Whether to load the pretrained model. Default is True.
             version (str, optional): Version of the MegaDetectorV5 model to load. Default is "a".
+            backend (str, optional): Inference backend, one of "torch", "onnx" or "torchscript". With an exported
+                backend, weights is the path of the exported model. Default is "torch".
         """
         
         if pretrained:
@@ -45,7 +47,7 @@ class MegaDetectorV5(YOLOV5Base):
         else:
             url = None
 
-        super(MegaDetectorV5, self).__init__(weights=weights, device=device, url=url)
+        super(MegaDetectorV5, self).__init__(weights=weights, device=device, url=url, backend=backend)
         
         
         
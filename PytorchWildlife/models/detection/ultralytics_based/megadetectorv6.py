@@ -11,16 +11,18 @@ class MegaDetectorV6(YOLOV8Base):
     that is specifically designed for detecting animals, persons, and vehicles.
     
     Attributes:
+        STRIDE (int): Stride value used in the detector.
         CLASS_NAMES (dict): Mapping of class IDs to their respective names.
     """
     
+    STRIDE = 32
     CLASS_NAMES = {
         0: "animal",
         1: "person",
         2: "vehicle"
     }
 
-    def __init__(self, weights=None, device="cpu", pretrained=True, version='yolov9c'):
+    def __init__(self, weights=None, device="cpu", pretrained=True, version='yolov9c', backend="torch"):
         """
         Initializes the MegaDetectorV5 model with the option to load pretrained weights.
         
@@ -29,6 +31,8 @@ class MegaDetectorV6(YOLOV8Base):
             device (str, optional): Device to load the model on (e.g., "cpu" or "cuda"). Default is "cpu".
             pretrained (bool, optional): Whether to load the pretrained model. Default is True.
             version (str, optional): Version of the model to load. Default is 'yolov9c'.
+            backend (str, optional): Inference backend, one of "torch", "onnx" or "torchscript". With an exported
+                backend, weights is the path of the exported model. Default is "torch".
         """
         
         if version == 'yolov9c':
@@ -40,4 +44,4 @@ class MegaDetectorV6(YOLOV8Base):
         else:
             print('Select a valid model version: yolov9c or rtdetrl')
 
-        super(MegaDetectorV6, self).__init__(weights=weights, device=device, url=url)
\ No newline at end of file
+        super(MegaDetectorV6, self).__init__(weights=weights, device=device, url=url, backend=backend)
\ No newline at end of file
@@ -11,22 +11,29 @@ from PIL import Image
 import supervision as sv
 
 import torch
-from torch.utils.data import DataLoader
-from torch.hub import load_state_dict_from_url
-
-from yolov5.utils.general import non_max_suppression, scale_coords
 
 from ..base_detector import BaseDetector
+from .. import nms as pw_nms
+from .. import runtime as pw_runtime
+from ... import weight_cache as pw_weights
 from ....data import transforms as pw_trans
 from ....data import datasets as pw_data
 
+__all__ = [
+    'YOLOV5Base'
+]
+
 
 class YOLOV5Base(BaseDetector):
     """
     Base detector class for YOLO V5. This class provides utility methods for
     loading the model, generating results, and performing single and batch image detections.
     """
-    def __init__(self, weights=None, device="cpu", url=None, transform=None):
+
+    # Images without detections are left out of the batch results, as in earlier releases
+    SKIP_EMPTY = True
+
+    def __init__(self, weights=None, device="cpu", url=None, transform=None, backend="torch"):
         """
         Initialize the YOLO V5 detector.
         
@@ -39,9 +46,11 @@ class YOLOV5Base(BaseDetector):
                 URL to fetch the model weights. Defaults to None.
             transform (callable, optional):
                 Optional transform to be applied on the image. Defaults to None.
+            backend (str, optional):
+                Inference backend, one of "torch", "onnx" or "torchscript". Defaults to "torch".
         """
         self.transform = transform
-        super(YOLOV5Base, self).__init__(weights=weights, device=device, url=url)
+        super(YOLOV5Base, self).__init__(weights=weights, device=device, url=url, backend=backend)
         self._load_model(weights, device, url)
 
     def _load_model(self, weights=None, device="cpu", url=None):
@@ -58,13 +67,18 @@ class YOLOV5Base(BaseDetector):
         Raises:
             Exception: If weights are not provided.
         """
-        if weights:
-            checkpoint = torch.load(weights, map_location=torch.device(device))
-        elif url:
-            checkpoint = load_state_dict_from_url(url, map_location=torch.device(self.device))
+        if self.backend != "torch":
+            self._load_exported(weights, device)
+        elif weights and weights.endswith(pw_runtime.PREPARED_SUFFIX):
+            self._load_prepared(weights, device)
         else:
-            raise Exception("Need weights for inference.")
-        self.model = checkpoint["model"].float().fuse().eval().to(self.device)
+            if weights:
+                checkpoint = pw_runtime.load_checkpoint(weights)
+            elif url:
+                checkpoint = pw_runtime.load_checkpoint(pw_weights.get_weights(url))
+            else:
+                raise Exception("Need weights for inference.")
+            self.model = checkpoint["model"].float().fuse().eval().to(self.device)
         
         if not self.transform:
             self.transform = pw_trans.MegaDetector_v5_Transform(target_size=self.IMAGE_SIZE,
@@ -97,6 +111,7 @@ class YOLOV5Base(BaseDetector):
         ]
         return results
 
+    @torch.no_grad()
     def single_image_detection(self, img, img_path=None, det_conf_thres=0.2, id_strip=None):
         """
         Perform detection on a single image.
@@ -123,12 +138,63 @@ class YOLOV5Base(BaseDetector):
 
         if img_size is None:
             img_size = img.permute((1, 2, 0)).shape # We need hwc instead of chw for coord scaling
-        preds = self.model(img.unsqueeze(0).to(self.device))[0]
-        preds = torch.cat(non_max_suppression(prediction=preds, det_conf_thres=det_conf_thres), axis=0)
-        preds[:, :4] = scale_coords([self.IMAGE_SIZE] * 2, preds[:, :4], img_size).round()
-        return self.results_generation(preds.cpu().numpy(), img_path, id_strip)
+        imgs = self._to_model_input(img.unsqueeze(0))
+        with self._autocast():
+            preds = self.model(imgs)[0]
+        preds = pw_nms.yolov5_postprocess(preds.float(), imgs.shape[2:], [img_size], conf_thres=det_conf_thres)[0]
+        return self.results_generation(preds, img_path, id_strip)
 
-    def batch_image_detection(self, data_path, batch_size=16, det_conf_thres=0.2, id_strip=None):
+    @torch.no_grad()
+    def multi_image_detection(self, imgs, img_paths=None, det_conf_thres=0.2, id_strip=None):
+        """
+        Perform detection on a list of in-memory images or image paths in one batched forward pass.
+        
+        Args:
+            imgs (list): 
+                Image paths or ndarrays.
+            img_paths (list, optional): 
+                Image paths or identifiers, one per image. Defaults to the paths in imgs.
+            det_conf_thres (float, optional): 
+                Confidence threshold for predictions. Defaults to 0.2.
+            id_strip (str, optional): 
+                Characters to strip from img_id. Defaults to None.
+
+        Returns:
+            list: Detection results, one dict per image.
+        """
+        tensors, img_sizes, img_paths = self._transform_images(imgs, img_paths)
+        predictions = [None] * len(tensors)
+        for indices, batch in self._stack_by_shape(tensors):
+            preds = self._batch_predictions(batch, [img_sizes[i] for i in indices], det_conf_thres=det_conf_thres)
+            for i, pred in zip(indices, preds):
+                predictions[i] = pred
+        return [self.results_generation(pred, img_path, id_strip) for pred, img_path in zip(predictions, img_paths)]
+
+    @torch.no_grad()
+    def _batch_predictions(self, imgs, sizes, det_conf_thres=0.2):
+        """
+        Run the model on a batch of letterboxed images and rescale the boxes to the original image sizes.
+        
+        Args:
+            imgs (torch.Tensor): 
+                Batch of letterboxed images in [B, C, H, W] format.
+            sizes (torch.Tensor or list): 
+                Original (height, width) of each image.
+            det_conf_thres (float, optional): 
+                Confidence threshold for predictions. Defaults to 0.2.
+
+        Returns:
+            list: List of numpy.ndarray predictions in xyxy, confidence, class_id format, one per image.
+        """
+        imgs = self._to_model_input(imgs)
+        with self._autocast():
+            preds = self.model(imgs)[0]
+        return pw_nms.yolov5_postprocess(preds.float(), imgs.shape[2:], sizes, conf_thres=det_conf_thres)
+
+    def batch_image_detection(self, data_path, batch_size=16, det_conf_thres=0.2, id_strip=None,
+                              num_workers=0, prefetch_factor=None, persistent_workers=False, device_prefetch=False,
+                              journal=None, uint8_input=False, rect=False, draft=False, as_batch=False,
+                              cache=None):
         """
         Perform detection on a batch of images.
         
@@ -141,43 +207,161 @@ class YOLOV5Base(BaseDetector):
                 Confidence threshold for predictions. Defaults to 0.2.
             id_strip (str, optional): 
                 Characters to strip from img_id. Defaults to None.
+            num_workers (int, optional):
+                Number of worker processes for image decoding and transformation. Defaults to 0.
+            prefetch_factor (int, optional):
+                Number of batches loaded in advance by each worker. Only used when num_workers > 0. Defaults to None.
+            persistent_workers (bool, optional):
+                Keep the worker processes alive between loader iterations. Only used when num_workers > 0. Defaults to False.
+            device_prefetch (bool, optional):
+                Copy the next batch to the model device on a background thread while the current batch
+                is being processed. Defaults to False.
+            journal (PytorchWildlife.utils.DetectionJournal, optional):
+                Checkpoint journal. Images already recorded in it are skipped and every finished image
+                is appended to it, so an interrupted run can be resumed. Defaults to None.
+            uint8_input (bool, optional):
+                Keep images as uint8 through resizing, padding and collation, and normalize them to float
+                on the device. Uses the default MegaDetector transform. Defaults to False.
+            rect (bool, optional):
+                Letterbox each image to the smallest stride-aligned rectangle instead of a full square and
+                batch images of the same letterboxed shape together. Results are then yielded grouped by
+                shape rather than in folder order. Defaults to False.
+            draft (bool, optional):
+                Decode JPEG images at a reduced scale (1/2, 1/4 or 1/8) that still covers IMAGE_SIZE, using
+                libjpeg DCT scaling. Box coordinates are still reported in original image pixels. Defaults to False.
+            as_batch (bool, optional):
+                Return a columnar DetectionBatch instead of a list of dicts. Labels and per-image views are
+                then only built when accessed. Defaults to False.
+            cache (PytorchWildlife.utils.ResultCache, optional):
+                Result cache. Images whose content and settings were already run are answered from it without
+                decoding, and the results of the others are stored in it. Defaults to None.
             extension (str, optional):
                 Image extension to search for. Defaults to "JPG"
 
         Returns:
-            list: List of detection results for all images.
+            list or DetectionBatch: Detection results for all images.
         """
+        predictions = self._iter_predictions(data_path, batch_size=batch_size, det_conf_thres=det_conf_thres,
+                                             num_workers=num_workers, prefetch_factor=prefetch_factor,
+                                             persistent_workers=persistent_workers, device_prefetch=device_prefetch,
+                                             journal=journal, uint8_input=uint8_input, rect=rect, draft=draft,
+                                             cache=cache)
+        if as_batch:
+            return self._generate_batch(predictions, id_strip=id_strip, journal=journal, skip_empty=self.SKIP_EMPTY)
+        return list(self._generate_results(predictions, id_strip=id_strip, journal=journal, skip_empty=self.SKIP_EMPTY))
+
+    def iter_image_detection(self, data_path, batch_size=16, det_conf_thres=0.2, id_strip=None,
+                             num_workers=0, prefetch_factor=None, persistent_workers=False, device_prefetch=False,
+                             journal=None, uint8_input=False, rect=False, draft=False, cache=None):
+        """
+        Perform detection on a batch of images, yielding the results as each batch finishes.
+        Memory use depends on the batch size rather than on the number of images.
+        
+        Args:
+            data_path (str): 
+                Path containing all images for inference.
+            batch_size (int, optional):
+                Batch size for inference. Defaults to 16.
+            det_conf_thres (float, optional): 
+                Confidence threshold for predictions. Defaults to 0.2.
+            id_strip (str, optional): 
+                Characters to strip from img_id. Defaults to None.
+            num_workers (int, optional):
+                Number of worker processes for image decoding and transformation. Defaults to 0.
+            prefetch_factor (int, optional):
+                Number of batches loaded in advance by each worker. Only used when num_workers > 0. Defaults to None.
+            persistent_workers (bool, optional):
+                Keep the worker processes alive between loader iterations. Only used when num_workers > 0. Defaults to False.
+            device_prefetch (bool, optional):
+                Copy the next batch to the model device on a background thread while the current batch
+                is being processed. Defaults to False.
+            journal (PytorchWildlife.utils.DetectionJournal, optional):
+                Checkpoint journal. Images already recorded in it are skipped and every finished image
+                is appended to it, so an interrupted run can be resumed. Defaults to None.
+            uint8_input (bool, optional):
+                Keep images as uint8 through resizing, padding and collation, and normalize them to float
+                on the device. Uses the default MegaDetector transform. Defaults to False.
+            rect (bool, optional):
+                Letterbox each image to the smallest stride-aligned rectangle instead of a full square and
+                batch images of the same letterboxed shape together. Results are then yielded grouped by
+                shape rather than in folder order. Defaults to False.
+            draft (bool, optional):
+                Decode JPEG images at a reduced scale (1/2, 1/4 or 1/8) that still covers IMAGE_SIZE, using
+                libjpeg DCT scaling. Box coordinates are still reported in original image pixels. Defaults to False.
+            cache (PytorchWildlife.utils.ResultCache, optional):
+                Result cache. Images whose content and settings were already run are answered from it without
+                decoding, and the results of the others are stored in it. Defaults to None.
+            extension (str, optional):
+                Image extension to search for. Defaults to "JPG"
+
+        Returns:
+            generator: Detection results, one dict per image.
+        """
+        return self._generate_results(
+            self._iter_predictions(data_path, batch_size=batch_size, det_conf_thres=det_conf_thres,
+                                   num_workers=num_workers, prefetch_factor=prefetch_factor,
+                                   persistent_workers=persistent_workers, device_prefetch=device_prefetch,
+                                   journal=journal, uint8_input=uint8_input, rect=rect, draft=draft,
+                                   cache=cache),
+            id_strip=id_strip, journal=journal, skip_empty=self.SKIP_EMPTY
+        )
+
+    @torch.no_grad()
+    def _iter_predictions(self, data_path, batch_size=16, det_conf_thres=0.2, num_workers=0, prefetch_factor=None,
+                          persistent_workers=False, device_prefetch=False, journal=None, uint8_input=False,
+                          rect=False, draft=False, cache=None):
+        """
+        Run the model over a folder of images, yielding the raw predictions of each image.
+        See iter_image_detection for the arguments.
+
+        Returns:
+            generator: (image path, predictions in xyxy, confidence, class_id format, original (height, width)) tuples.
+        """
+        assert not rect or self.backend == "torch", "Exported models only support fixed-size inputs, use rect=False."
+        transform = self.transform
+        if uint8_input or rect:
+            transform = pw_trans.MegaDetector_v5_Transform(target_size=self.IMAGE_SIZE, stride=self.STRIDE,
+                                                           keep_uint8=uint8_input, rect=rect)
 
         dataset = pw_data.DetectionImageFolder(
             data_path,
-            transform=self.transform,
+            transform=transform,
+            exclude=journal.completed() if journal else None,
+            draft_size=self.IMAGE_SIZE if draft else None,
         )
 
+        # Answering the images already in the result cache, only the misses are decoded and run
+        plan = None
+        if cache is not None:
+            plan = self._cache_plan(dataset, cache, det_conf_thres=det_conf_thres, transform=transform,
+                                    draft=draft)
+
+        # Bucketing images by letterboxed shape for rectangular inference
+        batch_sampler = None
+        if rect:
+            batch_sampler = pw_data.AspectRatioBatchSampler(
+                dataset.image_sizes(), batch_size,
+                key=lambda size: pw_trans.letterbox_shape(size, self.IMAGE_SIZE, auto=True, stride=self.STRIDE)
+            )
+
         # Creating a DataLoader for batching and parallel processing of the images
-        loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, 
-                            pin_memory=True, num_workers=0, drop_last=False)
+        loader = self._build_loader(dataset, batch_size=batch_size, num_workers=num_workers,
+                                    prefetch_factor=prefetch_factor, persistent_workers=persistent_workers,
+                                    device_prefetch=device_prefetch, batch_sampler=batch_sampler)
 
-        results = []
         with tqdm(total=len(loader)) as pbar:
             for batch_index, (imgs, paths, sizes) in enumerate(loader):
-                imgs = imgs.to(self.device)
-                predictions = self.model(imgs)[0].detach().cpu()
-                predictions = non_max_suppression(predictions, det_conf_thres=det_conf_thres)
+                imgs = self._to_model_input(imgs)
+                with self._autocast():
+                    predictions = self.model(imgs)[0]
+                # NMS and rescaling of the whole batch on the device, only the kept boxes are copied back
+                predictions = pw_nms.yolov5_postprocess(predictions.float(), imgs.shape[2:], sizes,
+                                                        conf_thres=det_conf_thres)
 
-                batch_results = []
                 for i, pred in enumerate(predictions):
-                    if pred.size(0) == 0:  
-                        continue
-                    pred = pred.numpy()
-                    size = sizes[i].numpy()
-                    path = paths[i]
-                    original_coords = pred[:, :4].copy()
-                    pred[:, :4] = scale_coords([self.IMAGE_SIZE] * 2, pred[:, :4], size).round()
-                    # Normalize the coordinates for timelapse compatibility
-                    normalized_coords = [[x1 / size[1], y1 / size[0], x2 / size[1], y2 / size[0]] for x1, y1, x2, y2 in pred[:, :4]]
-                    res = self.results_generation(pred, path, id_strip)
-                    res["normalized_coords"] = normalized_coords
-                    batch_results.append(res)
+                    if plan is not None:
+                        yield from self._cached_before(plan, paths[i], pred, sizes[i].numpy())
+                    yield paths[i], pred, sizes[i].numpy()
                 pbar.update(1)
-                results.extend(batch_results)
-            return results
+        if plan is not None:
+            yield from self._cached_remaining(plan)
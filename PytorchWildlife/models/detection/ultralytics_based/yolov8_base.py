@@ -5,22 +5,24 @@
 
 # Importing basic libraries
 
-import os
-from glob import glob
 import supervision as sv
 import numpy as np
 from PIL import Image
-import wget
 import torch
 
-from ultralytics.models import yolo
-from torch.utils.data import DataLoader
 from tqdm import tqdm
 
 from ..base_detector import BaseDetector
+from .. import runtime as pw_runtime
+from .. import nms as pw_nms
+from ... import weight_cache as pw_weights
 from ....data import transforms as pw_trans
 from ....data import datasets as pw_data
 
+__all__ = [
+    'YOLOV8Base'
+]
+
 
 class YOLOV8Base(BaseDetector):
     """
@@ -29,7 +31,7 @@ class YOLOV8Base(BaseDetector):
     This base detector class is also compatible with all the new ultralytics models including YOLOV9, 
     RTDetr, and more.
     """
-    def __init__(self, weights=None, device="cpu", url=None, transform=None):
+    def __init__(self, weights=None, device="cpu", url=None, transform=None, backend="torch"):
         """
         Initialize the YOLOV8 detector.
         
@@ -40,9 +42,11 @@ class YOLOV8Base(BaseDetector):
                 Device for model inference. Defaults to "cpu".
             url (str, optional): 
                 URL to fetch the model weights. Defaults to None.
+            backend (str, optional):
+                Inference backend, one of "torch", "onnx" or "torchscript". Defaults to "torch".
         """
         self.transform = transform
-        super(YOLOV8Base, self).__init__(weights=weights, device=device, url=url)
+        super(YOLOV8Base, self).__init__(weights=weights, device=device, url=url, backend=backend)
         self._load_model(weights, self.device, url)
 
     def _load_model(self, weights=None, device="cpu", url=None):
@@ -60,22 +64,31 @@ class YOLOV8Base(BaseDetector):
             Exception: If weights are not provided.
         """
 
-        self.predictor = yolo.detect.DetectionPredictor()
-        # self.predictor.args.device = device # Will uncomment later
-        self.predictor.args.imgsz = self.IMAGE_SIZE
-        self.predictor.args.save = False # Will see if we want to use ultralytics native inference saving functions.
+        # NMS settings of the ultralytics detection predictor
+        self.iou = 0.7
+        self.max_det = 300
 
-        if weights:
-            self.predictor.setup_model(weights)
-        elif url:
-            if not os.path.exists(os.path.join(torch.hub.get_dir(), "checkpoints", "MDV6b-yolov9c.pt")):
-                os.makedirs(os.path.join(torch.hub.get_dir(), "checkpoints"), exist_ok=True)
-                weights = wget.download(url, out=os.path.join(torch.hub.get_dir(), "checkpoints"))
-            else:
-                weights = os.path.join(torch.hub.get_dir(), "checkpoints", "MDV6b-yolov9c.pt")
-            self.predictor.setup_model(weights)
+        if self.backend != "torch":
+            self._load_exported(weights, device)
+        elif weights and weights.endswith(pw_runtime.PREPARED_SUFFIX):
+            self._load_prepared(weights, device)
         else:
-            raise Exception("Need weights for inference.")
+            # ultralytics is only needed to load the torch checkpoints, exported and prepared models run without it
+            from ultralytics.models import yolo
+
+            if weights:
+                checkpoint = weights
+            elif url:
+                checkpoint = pw_weights.get_weights(url)
+            else:
+                raise Exception("Need weights for inference.")
+            self.predictor = yolo.detect.DetectionPredictor()
+            self.predictor.args.device = device
+            self.predictor.args.imgsz = self.IMAGE_SIZE
+            self.predictor.args.save = False
+            self.predictor.setup_model(checkpoint)
+            # The underlying torch model is run directly on the letterboxed batches of our own data pipeline
+            self.model = self.predictor.model.model
         
         if not self.transform:
             self.transform = pw_trans.MegaDetector_v5_Transform(target_size=self.IMAGE_SIZE,
@@ -86,8 +99,8 @@ class YOLOV8Base(BaseDetector):
         Generate results for detection based on model predictions.
         
         Args:
-            preds (ultralytics.engine.results.Results): 
-                Model predictions.
+            preds (numpy.ndarray): 
+                Model predictions in xyxy, confidence, class_id format.
             img_id (str): 
                 Image identifier.
             id_strip (str, optional): 
@@ -96,24 +109,42 @@ class YOLOV8Base(BaseDetector):
         Returns:
             dict: Dictionary containing image ID, detections, and labels.
         """
-        xyxy = preds.boxes.xyxy.cpu().numpy()
-        confidence = preds.boxes.conf.cpu().numpy()
-        class_id = preds.boxes.cls.cpu().numpy().astype(int)
-
         results = {"img_id": str(img_id).strip(id_strip)}
         results["detections"] = sv.Detections(
-            xyxy=xyxy,
-            confidence=confidence,
-            class_id=class_id
+            xyxy=preds[:, :4],
+            confidence=preds[:, 4],
+            class_id=preds[:, 5].astype(int)
         )
 
         results["labels"] = [
             f"{self.CLASS_NAMES[class_id]} {confidence:0.2f}"  
-            for _, _, confidence, class_id, _, _ in results["detections"] 
+            for confidence, class_id in zip(results["detections"].confidence, results["detections"].class_id)
         ]
         
         return results
+
+    @torch.no_grad()
+    def _batch_predictions(self, imgs, sizes, det_conf_thres=0.2):
+        """
+        Run the model on a batch of letterboxed images and rescale the boxes to the original image sizes.
         
+        Args:
+            imgs (torch.Tensor): 
+                Batch of letterboxed images in [B, C, H, W] format.
+            sizes (torch.Tensor or list): 
+                Original (height, width) of each image.
+            det_conf_thres (float, optional): 
+                Confidence threshold for predictions. Defaults to 0.2.
+
+        Returns:
+            list: List of numpy.ndarray predictions in xyxy, confidence, class_id format, one per image.
+        """
+        imgs = self._to_model_input(imgs)
+        with self._autocast():
+            preds = self.model(imgs)
+        preds = (preds[0] if isinstance(preds, (list, tuple)) else preds).float()
+        return pw_nms.yolov8_postprocess(preds, imgs.shape[2:], sizes, conf_thres=det_conf_thres,
+                                         iou_thres=self.iou, max_det=self.max_det)
 
     def single_image_detection(self, img, img_path=None, det_conf_thres=0.2, id_strip=None):
         """
@@ -138,14 +169,40 @@ class YOLOV8Base(BaseDetector):
                 img_path = img
             img = np.array(Image.open(img_path).convert("RGB"))
         img_size = img.shape
+        img = self.transform(img)
 
-        self.predictor.args.batch = 1
-        self.predictor.args.conf = det_conf_thres
-        det_results = list(self.predictor.stream_inference([img]))
+        preds = self._batch_predictions(img.unsqueeze(0), [img_size], det_conf_thres=det_conf_thres)[0]
+        return self.results_generation(preds, img_path, id_strip)
+
+    def multi_image_detection(self, imgs, img_paths=None, det_conf_thres=0.2, id_strip=None):
+        """
+        Perform detection on a list of in-memory images or image paths in one batched forward pass.
         
-        return self.results_generation(det_results[0], img_path, id_strip)
+        Args:
+            imgs (list): 
+                Image paths or ndarrays.
+            img_paths (list, optional): 
+                Image paths or identifiers, one per image. Defaults to the paths in imgs.
+            det_conf_thres (float, optional): 
+                Confidence threshold for predictions. Defaults to 0.2.
+            id_strip (str, optional): 
+                Characters to strip from img_id. Defaults to None.
+
+        Returns:
+            list: Detection results, one dict per image.
+        """
+        tensors, img_sizes, img_paths = self._transform_images(imgs, img_paths)
+        predictions = [None] * len(tensors)
+        for indices, batch in self._stack_by_shape(tensors):
+            preds = self._batch_predictions(batch, [img_sizes[i] for i in indices], det_conf_thres=det_conf_thres)
+            for i, pred in zip(indices, preds):
+                predictions[i] = pred
+        return [self.results_generation(pred, img_path, id_strip) for pred, img_path in zip(predictions, img_paths)]
 
-    def batch_image_detection(self, data_path, batch_size=16, det_conf_thres=0.2, id_strip=None):
+    def batch_image_detection(self, data_path, batch_size=16, det_conf_thres=0.2, id_strip=None,
+                              num_workers=0, prefetch_factor=None, persistent_workers=False, device_prefetch=False,
+                              journal=None, uint8_input=False, rect=False, draft=False, as_batch=False,
+                              cache=None):
         """
         Perform detection on a batch of images.
         
@@ -158,37 +215,156 @@ class YOLOV8Base(BaseDetector):
                 Confidence threshold for predictions. Defaults to 0.2.
             id_strip (str, optional): 
                 Characters to strip from img_id. Defaults to None.
+            num_workers (int, optional):
+                Number of worker processes for image decoding and transformation. Defaults to 0.
+            prefetch_factor (int, optional):
+                Number of batches loaded in advance by each worker. Only used when num_workers > 0. Defaults to None.
+            persistent_workers (bool, optional):
+                Keep the worker processes alive between loader iterations. Only used when num_workers > 0. Defaults to False.
+            device_prefetch (bool, optional):
+                Copy the next batch to the model device on a background thread while the current batch
+                is being processed. Defaults to False.
+            journal (PytorchWildlife.utils.DetectionJournal, optional):
+                Checkpoint journal. Images already recorded in it are skipped and every finished image
+                is appended to it, so an interrupted run can be resumed. Defaults to None.
+            uint8_input (bool, optional):
+                Keep images as uint8 through resizing, padding and collation, and normalize them to float
+                on the device. Uses the default MegaDetector transform. Defaults to False.
+            rect (bool, optional):
+                Letterbox each image to the smallest stride-aligned rectangle instead of a full square and
+                batch images of the same letterboxed shape together. Results are then yielded grouped by
+                shape rather than in folder order. Defaults to False.
+            draft (bool, optional):
+                Decode JPEG images at a reduced scale (1/2, 1/4 or 1/8) that still covers IMAGE_SIZE, using
+                libjpeg DCT scaling. Box coordinates are still reported in original image pixels. Defaults to False.
+            as_batch (bool, optional):
+                Return a columnar DetectionBatch instead of a list of dicts. Labels and per-image views are
+                then only built when accessed. Defaults to False.
+            cache (PytorchWildlife.utils.ResultCache, optional):
+                Result cache. Images whose content and settings were already run are answered from it without
+                decoding, and the results of the others are stored in it. Defaults to None.
             extension (str, optional):
                 Image extension to search for. Defaults to "JPG"
 
         Returns:
-            list: List of detection results for all images.
+            list or DetectionBatch: Detection results for all images.
         """
-        self.predictor.args.batch = batch_size
-        self.predictor.args.conf = det_conf_thres
+        predictions = self._iter_predictions(data_path, batch_size=batch_size, det_conf_thres=det_conf_thres,
+                                             num_workers=num_workers, prefetch_factor=prefetch_factor,
+                                             persistent_workers=persistent_workers, device_prefetch=device_prefetch,
+                                             journal=journal, uint8_input=uint8_input, rect=rect, draft=draft,
+                                             cache=cache)
+        if as_batch:
+            return self._generate_batch(predictions, id_strip=id_strip, journal=journal, skip_empty=self.SKIP_EMPTY)
+        return list(self._generate_results(predictions, id_strip=id_strip, journal=journal, skip_empty=self.SKIP_EMPTY))
+
+    def iter_image_detection(self, data_path, batch_size=16, det_conf_thres=0.2, id_strip=None,
+                             num_workers=0, prefetch_factor=None, persistent_workers=False, device_prefetch=False,
+                             journal=None, uint8_input=False, rect=False, draft=False, cache=None):
+        """
+        Perform detection on a batch of images, yielding the results as each batch finishes.
+        Memory use depends on the batch size rather than on the number of images.
+        
+        Args:
+            data_path (str): 
+                Path containing all images for inference.
+            batch_size (int, optional):
+                Batch size for inference. Defaults to 16.
+            det_conf_thres (float, optional): 
+                Confidence threshold for predictions. Defaults to 0.2.
+            id_strip (str, optional): 
+                Characters to strip from img_id. Defaults to None.
+            num_workers (int, optional):
+                Number of worker processes for image decoding and transformation. Defaults to 0.
+            prefetch_factor (int, optional):
+                Number of batches loaded in advance by each worker. Only used when num_workers > 0. Defaults to None.
+            persistent_workers (bool, optional):
+                Keep the worker processes alive between loader iterations. Only used when num_workers > 0. Defaults to False.
+            device_prefetch (bool, optional):
+                Copy the next batch to the model device on a background thread while the current batch
+                is being processed. Defaults to False.
+            journal (PytorchWildlife.utils.DetectionJournal, optional):
+                Checkpoint journal. Images already recorded in it are skipped and every finished image
+                is appended to it, so an interrupted run can be resumed. Defaults to None.
+            uint8_input (bool, optional):
+                Keep images as uint8 through resizing, padding and collation, and normalize them to float
+                on the device. Uses the default MegaDetector transform. Defaults to False.
+            rect (bool, optional):
+                Letterbox each image to the smallest stride-aligned rectangle instead of a full square and
+                batch images of the same letterboxed shape together. Results are then yielded grouped by
+                shape rather than in folder order. Defaults to False.
+            draft (bool, optional):
+                Decode JPEG images at a reduced scale (1/2, 1/4 or 1/8) that still covers IMAGE_SIZE, using
+                libjpeg DCT scaling. Box coordinates are still reported in original image pixels. Defaults to False.
+            cache (PytorchWildlife.utils.ResultCache, optional):
+                Result cache. Images whose content and settings were already run are answered from it without
+                decoding, and the results of the others are stored in it. Defaults to None.
+            extension (str, optional):
+                Image extension to search for. Defaults to "JPG"
+
+        Returns:
+            generator: Detection results, one dict per image.
+        """
+        return self._generate_results(
+            self._iter_predictions(data_path, batch_size=batch_size, det_conf_thres=det_conf_thres,
+                                   num_workers=num_workers, prefetch_factor=prefetch_factor,
+                                   persistent_workers=persistent_workers, device_prefetch=device_prefetch,
+                                   journal=journal, uint8_input=uint8_input, rect=rect, draft=draft,
+                                   cache=cache),
+            id_strip=id_strip, journal=journal, skip_empty=self.SKIP_EMPTY
+        )
+
+    def _iter_predictions(self, data_path, batch_size=16, det_conf_thres=0.2, num_workers=0, prefetch_factor=None,
+                          persistent_workers=False, device_prefetch=False, journal=None, uint8_input=False,
+                          rect=False, draft=False, cache=None):
+        """
+        Run the model over a folder of images, yielding the raw predictions of each image.
+        See iter_image_detection for the arguments.
+
+        Returns:
+            generator: (image path, predictions in xyxy, confidence, class_id format, original (height, width)) tuples.
+        """
+        assert not rect or self.backend == "torch", "Exported models only support fixed-size inputs, use rect=False."
+        transform = self.transform
+        if uint8_input or rect:
+            transform = pw_trans.MegaDetector_v5_Transform(target_size=self.IMAGE_SIZE, stride=self.STRIDE,
+                                                           keep_uint8=uint8_input, rect=rect)
 
         dataset = pw_data.DetectionImageFolder(
             data_path,
-            transform=self.transform,
+            transform=transform,
+            exclude=journal.completed() if journal else None,
+            draft_size=self.IMAGE_SIZE if draft else None,
         )
 
+        # Answering the images already in the result cache, only the misses are decoded and run
+        plan = None
+        if cache is not None:
+            plan = self._cache_plan(dataset, cache, det_conf_thres=det_conf_thres, transform=transform,
+                                    draft=draft, iou_thres=self.iou,
+                                    max_det=self.max_det)
+
+        # Bucketing images by letterboxed shape for rectangular inference
+        batch_sampler = None
+        if rect:
+            batch_sampler = pw_data.AspectRatioBatchSampler(
+                dataset.image_sizes(), batch_size,
+                key=lambda size: pw_trans.letterbox_shape(size, self.IMAGE_SIZE, auto=True, stride=self.STRIDE)
+            )
+
         # Creating a DataLoader for batching and parallel processing of the images
-        loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, 
-                            pin_memory=True, num_workers=0, drop_last=False
-                            )
+        loader = self._build_loader(dataset, batch_size=batch_size, num_workers=num_workers,
+                                    prefetch_factor=prefetch_factor, persistent_workers=persistent_workers,
+                                    device_prefetch=device_prefetch, batch_sampler=batch_sampler)
         
-        results = []
         with tqdm(total=len(loader)) as pbar:
             for batch_index, (imgs, paths, sizes) in enumerate(loader):
-                det_results = self.predictor.stream_inference(paths)
-                batch_results = []
+                # One decode per image: the letterboxed batch goes straight through the model
+                det_results = self._batch_predictions(imgs, sizes, det_conf_thres=det_conf_thres)
                 for idx, preds in enumerate(det_results):
-                    res = self.results_generation(preds, paths[idx], id_strip)
-                    size = preds.orig_shape
-                    # Normalize the coordinates for timelapse compatibility
-                    normalized_coords = [[x1 / size[1], y1 / size[0], x2 / size[1], y2 / size[0]] for x1, y1, x2, y2 in res["detections"].xyxy]
-                    res["normalized_coords"] = normalized_coords
-                    results.append(res)
+                    if plan is not None:
+                        yield from self._cached_before(plan, paths[idx], preds, sizes[idx].numpy())
+                    yield paths[idx], preds, sizes[idx].numpy()
                 pbar.update(1)
-                results.extend(batch_results)
-        return results
+        if plan is not None:
+            yield from self._cached_remaining(plan)
@@ -0,0 +1,251 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Registry keeping constructed detectors and classifiers resident, with least-recently-used eviction. """
+
+# Importing basic libraries
+import os
+import gc
+import threading
+from collections import OrderedDict
+
+import torch
+
+__all__ = [
+    "ModelRegistry",
+    "model_memory_footprint"
+]
+
+
+def model_memory_footprint(model):
+    """
+    Estimate the memory held by a model: the bytes of its parameters and buffers, counting shared tensors
+    once. Models running an exported ONNX artifact hold no torch tensors, so the artifact size is used.
+
+    Args:
+        model (torch.nn.Module):
+            Detector or classifier.
+
+    Returns:
+        int: Estimated size in bytes.
+    """
+    seen = set()
+    size = 0
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        key = (tensor.device, tensor.data_ptr())
+        if key not in seen:
+            seen.add(key)
+            size += tensor.numel() * tensor.element_size()
+    for module in model.modules():
+        if getattr(module, "session", None) is not None and os.path.exists(getattr(module, "path", "")):
+            size += os.path.getsize(module.path)
+    return size
+
+
+def _freeze(value):
+    """
+    Hashable form of a constructor argument, for registry keys.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    try:
+        hash(value)
+    except TypeError:
+        return repr(value)
+    return value
+
+
+class ModelRegistry:
+    """
+    Cache of constructed detectors and classifiers keyed by (class, version, device, precision) and any
+    other constructor argument. Models stay resident until they are evicted, least recently used first,
+    when the models on a device exceed the memory budget or the registry exceeds max_models.
+
+    Example:
+        registry = ModelRegistry(memory_budget=4 * 1024 ** 3)
+        detector = registry.get(pw_detection.MegaDetectorV6, version="yolov9c", device="cuda")
+        herdnet = registry.get(pw_detection.HerdNet, device="cuda", dataset="ennedi")
+    """
+
+    def __init__(self, memory_budget=None, max_models=None):
+        """
+        Initialize the registry.
+
+        Args:
+            memory_budget (int, optional):
+                Maximum bytes of model weights kept resident on each device, as estimated by
+                model_memory_footprint. A model larger than the budget is still returned, and then is the only
+                one kept on its device. Defaults to None (no limit).
+            max_models (int, optional):
+                Maximum number of models kept resident over all devices. Defaults to None (no limit).
+        """
+        assert memory_budget is None or memory_budget > 0, "memory_budget should be positive"
+        assert max_models is None or max_models > 0, "max_models should be positive"
+        self.memory_budget = memory_budget
+        self.max_models = max_models
+        self._models = OrderedDict() # key -> (model, device, size), in least to most recently used order
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(model_class, version=None, device="cpu", precision="fp32", **kwargs):
+        """
+        Registry key of a model.
+
+        Args:
+            model_class (type):
+                Detector or classifier class.
+            version (str, optional):
+                Model version, passed to the constructor when given. Defaults to None.
+            device (str, optional):
+                Device for model inference. Defaults to "cpu".
+            precision (str, optional):
+                Inference precision. Defaults to "fp32".
+            **kwargs:
+                Other constructor arguments.
+
+        Returns:
+            tuple: Hashable key.
+        """
+        model_name = f"{model_class.__module__}.{model_class.__qualname__}"
+        return (model_name, version, str(torch.device(device)), precision, _freeze(kwargs))
+
+    def get(self, model_class, version=None, device="cpu", precision="fp32", **kwargs):
+        """
+        Get a resident model, constructing it on a miss and evicting least recently used models if the
+        memory budget is exceeded.
+
+        Args:
+            model_class (type):
+                Detector or classifier class, e.g. pw_detection.MegaDetectorV5.
+            version (str, optional):
+                Model version, passed to the constructor when given. Defaults to None.
+            device (str, optional):
+                Device for model inference. Defaults to "cpu".
+            precision (str, optional):
+                Inference precision: "fp32", "bf16" or "fp16" set with configure_inference, or "int8" for
+                classifiers quantized with quantize(mode="dynamic"). Dynamic mode only quantizes the final linear
+                layer, so it saves little time on ResNets; for faster convolutions, quantize a classifier with
+                mode="static" and a calibration folder instead. Defaults to "fp32".
+            **kwargs:
+                Other constructor arguments, e.g. pretrained, weights or dataset.
+
+        Returns:
+            torch.nn.Module: The model.
+        """
+        key = self.make_key(model_class, version=version, device=device, precision=precision, **kwargs)
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                self.hits += 1
+                return self._models[key][0]
+
+            self.misses += 1
+            if version is not None:
+                kwargs["version"] = version
+            model = model_class(device=device, **kwargs)
+            if precision == "int8":
+                model.quantize(mode="dynamic")
+            elif precision != "fp32":
+                model.configure_inference(precision=precision)
+
+            device_key = key[2]
+            self._models[key] = (model, device_key, model_memory_footprint(model))
+            self._evict(device_key)
+            return model
+
+    def _evict(self, device):
+        """
+        Evict least recently used models until the registry fits max_models and the models on device fit
+        the memory budget. The most recently used model is never evicted.
+        """
+        evicted = []
+        while self.max_models is not None and len(self._models) > self.max_models:
+            evicted.append(next(iter(self._models)))
+            self._models.pop(evicted[-1])
+        if self.memory_budget is not None:
+            keys = [key for key, (_, dev, _) in self._models.items() if dev == device]
+            used = sum(self._models[key][2] for key in keys)
+            for key in keys[:-1]:
+                if used <= self.memory_budget:
+                    break
+                used -= self._models.pop(key)[2]
+                evicted.append(key)
+        if evicted:
+            self.evictions += len(evicted)
+            self._release(device)
+
+    @staticmethod
+    def _release(device):
+        """
+        Free the memory of evicted models that are no longer referenced.
+        """
+        gc.collect()
+        if device.startswith("cuda") and torch.cuda.is_available():
+            torch.cuda.empty_cache()
+
+    def evict(self, model_class, version=None, device="cpu", precision="fp32", **kwargs):
+        """
+        Remove a model from the registry.
+
+        Args:
+            model_class (type):
+                Detector or classifier class.
+            version (str, optional):
+                Model version. Defaults to None.
+            device (str, optional):
+                Device of the model. Defaults to "cpu".
+            precision (str, optional):
+                Inference precision. Defaults to "fp32".
+            **kwargs:
+                Other constructor arguments.
+
+        Returns:
+            bool: Whether the model was resident.
+        """
+        key = self.make_key(model_class, version=version, device=device, precision=precision, **kwargs)
+        with self._lock:
+            if key not in self._models:
+                return False
+            self._models.pop(key)
+        self._release(key[2])
+        return True
+
+    def clear(self):
+        """
+        Remove all models from the registry.
+        """
+        with self._lock:
+            self._models.clear()
+        self._release("cuda")
+
+    def memory_usage(self, device=None):
+        """
+        Estimated bytes held by the resident models, on one device or on all of them.
+
+        Args:
+            device (str, optional): Device. Defaults to None (all devices).
+
+        Returns:
+            int: Size in bytes.
+        """
+        device = None if device is None else str(torch.device(device))
+        with self._lock:
+            return sum(size for _, dev, size in self._models.values() if device is None or dev == device)
+
+    def keys(self):
+        """
+        Keys of the resident models, from least to most recently used.
+        """
+        with self._lock:
+            return list(self._models)
+
+    def __len__(self):
+        return len(self._models)
+
+    def __contains__(self, key):
+        return key in self._models
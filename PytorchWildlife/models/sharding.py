@@ -0,0 +1,226 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Multi-process, multi-device sharded inference on one host. """
+
+# Importing basic libraries
+import os
+import queue
+import traceback
+import multiprocessing as mp
+
+from tqdm import tqdm
+import torch
+
+from ..data.datasets import is_image_file
+
+__all__ = [
+    "ShardedRunner"
+]
+
+# Name of the batched in-memory method of detectors and classifiers
+BATCH_METHODS = ("multi_image_detection", "multi_image_classification")
+
+
+def _worker_loop(worker_id, model_class, model_kwargs, device, num_threads, cpus, task_queue, result_queue):
+    """
+    Worker process: build the model once, then run chunks of images from the shared task queue until the
+    None sentinel is received.
+    """
+    try:
+        if cpus and hasattr(os, "sched_setaffinity"):
+            os.sched_setaffinity(0, cpus)
+        if num_threads:
+            torch.set_num_threads(num_threads)
+        model = model_class(device=device, **model_kwargs)
+        batch_fn = next(getattr(model, name) for name in BATCH_METHODS if hasattr(model, name))
+    except Exception:
+        result_queue.put(("error", worker_id, None, traceback.format_exc()))
+        return
+    result_queue.put(("ready", worker_id, None, None))
+
+    while True:
+        task = task_queue.get()
+        if task is None:
+            break
+        chunk_id, paths, kwargs = task
+        try:
+            with torch.no_grad():
+                results = batch_fn(paths, paths, **kwargs)
+        except Exception:
+            result_queue.put(("error", worker_id, chunk_id, traceback.format_exc()))
+            continue
+        result_queue.put(("done", worker_id, chunk_id, results))
+
+
+class ShardedRunner:
+    """
+    Runs one model per worker process, each on its own device or subset of CPU cores. Workers pull small
+    chunks of image paths from a shared queue, so faster workers take more chunks, and the results are
+    returned in input order. Workers are started once and reused by every run call.
+
+    Worker processes are spawned, so scripts using the runner should guard their entry point with
+    if __name__ == "__main__".
+
+    Example:
+        with ShardedRunner(pw_detection.MegaDetectorV6, {"pretrained": True}, devices=["cpu"] * 8) as runner:
+            results = runner.run("/path/to/images", det_conf_thres=0.2)
+    """
+
+    def __init__(self, model_class, model_kwargs=None, devices=None, num_workers=None, threads_per_worker=None,
+                 pin_cpus=True, chunk_size=8, start=True):
+        """
+        Initialize the runner.
+
+        Args:
+            model_class (type):
+                Detector or classifier class, constructed in each worker as model_class(device=..., **model_kwargs).
+            model_kwargs (dict, optional):
+                Constructor arguments of the model. Defaults to None.
+            devices (list, optional):
+                Device of each worker, e.g. ["cuda:0", "cuda:1"] or ["cpu"] * 8. Defaults to num_workers CPU workers.
+            num_workers (int, optional):
+                Number of CPU workers when devices is not given. Defaults to the number of CPU cores divided by
+                threads_per_worker.
+            threads_per_worker (int, optional):
+                Torch intra-op threads of each CPU worker. Defaults to the CPU cores divided among the CPU workers.
+            pin_cpus (bool, optional):
+                Pin each CPU worker to its own subset of cores (Linux only). Defaults to True.
+            chunk_size (int, optional):
+                Number of images per task, also the batch size of the workers. Smaller chunks balance the load
+                better, larger ones batch better. Defaults to 8.
+            start (bool, optional):
+                Start the workers now. Defaults to True.
+        """
+        cpu_count = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+        if devices is None:
+            num_workers = num_workers or max(1, cpu_count // (threads_per_worker or 4))
+            devices = ["cpu"] * num_workers
+        assert len(devices) > 0, "At least one worker is needed"
+        assert chunk_size > 0, "chunk_size should be positive"
+        self.model_class = model_class
+        self.model_kwargs = model_kwargs or {}
+        self.devices = [str(device) for device in devices]
+        self.chunk_size = chunk_size
+
+        # Splitting the CPU cores among the CPU workers
+        num_cpu_workers = sum(torch.device(device).type == "cpu" for device in self.devices)
+        self.threads_per_worker = threads_per_worker or max(1, cpu_count // max(1, num_cpu_workers))
+        cores = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+        self._cpus = []
+        cpu_index = 0
+        for device in self.devices:
+            cpus = None
+            if pin_cpus and cores and torch.device(device).type == "cpu":
+                cpus = [cores[(cpu_index * self.threads_per_worker + i) % len(cores)]
+                        for i in range(self.threads_per_worker)]
+                cpu_index += 1
+            self._cpus.append(cpus)
+
+        self._context = mp.get_context("spawn")
+        self._workers = []
+        self._task_queue = None
+        self._result_queue = None
+        if start:
+            self.start()
+
+    def start(self):
+        """
+        Start the worker processes and wait for all of them to load their model.
+        """
+        if self._workers:
+            return
+        self._task_queue = self._context.Queue()
+        self._result_queue = self._context.Queue()
+        for worker_id, (device, cpus) in enumerate(zip(self.devices, self._cpus)):
+            num_threads = self.threads_per_worker if torch.device(device).type == "cpu" else None
+            worker = self._context.Process(
+                target=_worker_loop,
+                args=(worker_id, self.model_class, self.model_kwargs, device, num_threads, cpus,
+                      self._task_queue, self._result_queue),
+                daemon=True,
+            )
+            worker.start()
+            self._workers.append(worker)
+
+        ready = 0
+        while ready < len(self._workers):
+            status, worker_id, _, payload = self._get_result()
+            if status == "error":
+                self.close(terminate=True)
+                raise RuntimeError(f"Worker {worker_id} on {self.devices[worker_id]} failed to start:\n{payload}")
+            ready += 1
+
+    def _get_result(self):
+        """
+        Get the next message of the workers, failing if a worker died.
+        """
+        while True:
+            try:
+                return self._result_queue.get(timeout=1.0)
+            except queue.Empty:
+                dead = [i for i, worker in enumerate(self._workers) if not worker.is_alive()]
+                if dead:
+                    self.close(terminate=True)
+                    raise RuntimeError(f"Worker {dead[0]} on {self.devices[dead[0]]} died unexpectedly.")
+
+    def run(self, data_path, **kwargs):
+        """
+        Run the model over a folder or list of images.
+
+        Args:
+            data_path (str or list):
+                Folder of images, searched recursively, or list of image paths.
+            **kwargs:
+                Arguments of the batched method of the model (multi_image_detection or
+                multi_image_classification), e.g. det_conf_thres or id_strip.
+
+        Returns:
+            list: Results, one dict per image, in input order (sorted paths for a folder).
+        """
+        if isinstance(data_path, str):
+            paths = sorted(os.path.join(dp, f) for dp, _, filenames in os.walk(data_path)
+                           for f in filenames if is_image_file(f))
+        else:
+            paths = list(data_path)
+        self.start()
+
+        chunks = [paths[i:i + self.chunk_size] for i in range(0, len(paths), self.chunk_size)]
+        for chunk_id, chunk in enumerate(chunks):
+            self._task_queue.put((chunk_id, chunk, kwargs))
+
+        results = [None] * len(chunks)
+        with tqdm(total=len(paths)) as pbar:
+            for _ in range(len(chunks)):
+                status, worker_id, chunk_id, payload = self._get_result()
+                if status == "error":
+                    self.close(terminate=True)
+                    raise RuntimeError(f"Worker {worker_id} failed on images {chunks[chunk_id][:3]}...:\n{payload}")
+                results[chunk_id] = payload
+                pbar.update(len(payload))
+        return [result for chunk in results for result in chunk]
+
+    def close(self, terminate=False):
+        """
+        Stop the worker processes.
+
+        Args:
+            terminate (bool, optional): Kill the workers instead of letting them finish their queued tasks.
+                Defaults to False.
+        """
+        if not self._workers:
+            return
+        for worker in self._workers:
+            if terminate:
+                worker.terminate()
+            elif worker.is_alive():
+                self._task_queue.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._workers = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
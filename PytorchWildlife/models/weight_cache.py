@@ -0,0 +1,220 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Local, checksummed cache of pretrained model weights, safe to share between processes. """
+
+# Importing basic libraries
+import os
+import sys
+import json
+import time
+import hashlib
+import zipfile
+import contextlib
+import urllib.request
+from urllib.parse import urlparse
+
+from tqdm import tqdm
+import torch
+
+__all__ = [
+    "get_weights",
+    "weights_cache_dir",
+    "verify_weights"
+]
+
+# Environment variables controlling the cache
+CACHE_DIR_ENV = "PYTORCHWILDLIFE_CACHE_DIR"
+OFFLINE_ENV = "PYTORCHWILDLIFE_OFFLINE"
+
+CHUNK_SIZE = 1 << 20
+
+
+def weights_cache_dir(cache_dir=None):
+    """
+    Get the weight cache directory: cache_dir if given, else the PYTORCHWILDLIFE_CACHE_DIR environment
+    variable, else the checkpoints folder of the torch hub directory (where weights were stored before).
+
+    Args:
+        cache_dir (str, optional): Cache directory. Defaults to None.
+
+    Returns:
+        str: Path of the cache directory.
+    """
+    return cache_dir or os.environ.get(CACHE_DIR_ENV) or os.path.join(torch.hub.get_dir(), "checkpoints")
+
+
+def _is_offline(offline=None):
+    if offline is not None:
+        return offline
+    return os.environ.get(OFFLINE_ENV, "").lower() in ("1", "true", "yes")
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _is_complete_archive(path):
+    """
+    Whether path is a complete checkpoint archive (the zip format of torch.save), with every member passing
+    its CRC check. Truncated files fail, as the archive directory is at the end of the file.
+    """
+    try:
+        with zipfile.ZipFile(path) as archive:
+            return archive.testzip() is None
+    except (zipfile.BadZipFile, OSError, EOFError):
+        return False
+
+
+def _meta_path(path):
+    return path + ".sha256.json"
+
+
+@contextlib.contextmanager
+def _file_lock(path, timeout=None):
+    """
+    Exclusive inter-process lock on path + ".lock", held while the block runs.
+    """
+    lock_path = path + ".lock"
+    start = time.time()
+    with open(lock_path, "a+") as f:
+        while True:
+            try:
+                if sys.platform == "win32":
+                    import msvcrt
+                    f.seek(0)
+                    msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                else:
+                    import fcntl
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                if timeout is not None and time.time() - start > timeout:
+                    raise TimeoutError(f"Timed out waiting for the lock on {lock_path}")
+                time.sleep(0.1)
+        try:
+            yield
+        finally:
+            if sys.platform == "win32":
+                import msvcrt
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+            else:
+                import fcntl
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def verify_weights(path, sha256=None, full=False):
+    """
+    Check a cached weight file against its recorded size and SHA-256.
+
+    Args:
+        path (str): Path of the cached weight file.
+        sha256 (str, optional): Expected SHA-256. Defaults to None (the hash recorded at download time).
+        full (bool, optional): Re-hash the whole file. Otherwise only the size is checked against the record,
+            which catches truncated files without reading them. Always done when sha256 is given. Defaults to False.
+
+    Returns:
+        bool: Whether the file is valid.
+    """
+    if not os.path.isfile(path) or not os.path.isfile(_meta_path(path)):
+        return False
+    with open(_meta_path(path), "r") as f:
+        meta = json.load(f)
+    if os.path.getsize(path) != meta.get("size"):
+        return False
+    if sha256 and meta.get("sha256") != sha256.lower():
+        return False
+    if full or sha256:
+        return _sha256(path) == meta.get("sha256")
+    return True
+
+
+def _download(url, path, sha256=None, progress=True):
+    """
+    Download url to a temporary file next to path, check it, then atomically rename it to path.
+    """
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    digest = hashlib.sha256()
+    try:
+        request = urllib.request.Request(url, headers={"User-Agent": "PytorchWildlife"})
+        with urllib.request.urlopen(request) as response, open(tmp_path, "wb") as f:
+            total = response.headers.get("Content-Length")
+            total = int(total) if total else None
+            with tqdm(total=total, unit="B", unit_scale=True, desc=os.path.basename(path), disable=not progress) as pbar:
+                for chunk in iter(lambda: response.read(CHUNK_SIZE), b""):
+                    f.write(chunk)
+                    digest.update(chunk)
+                    pbar.update(len(chunk))
+            f.flush()
+            os.fsync(f.fileno())
+        size = os.path.getsize(tmp_path)
+        if total is not None and size != total:
+            raise IOError(f"Incomplete download of {url}: got {size} of {total} bytes")
+        if sha256 and digest.hexdigest() != sha256.lower():
+            raise IOError(f"Checksum mismatch for {url}: expected {sha256}, got {digest.hexdigest()}")
+
+        # Writing the record first, so a valid file on disk always has a valid record next to it
+        with open(_meta_path(path), "w") as f:
+            json.dump({"url": url, "sha256": digest.hexdigest(), "size": size}, f)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def get_weights(url, filename=None, sha256=None, cache_dir=None, offline=None, verify=False, progress=True):
+    """
+    Get the local path of the weights at url, downloading them into the cache if needed.
+
+    Downloads go to a temporary file that is size- and hash-checked before being atomically renamed into the
+    cache, under an inter-process file lock. Processes starting together do a single download and never see a
+    partial file. Files downloaded by earlier versions without a checksum record are adopted only if they match
+    sha256 or, without it, are complete checkpoint archives; otherwise they are downloaded again.
+
+    Args:
+        url (str): URL of the weights.
+        filename (str, optional): File name in the cache. Defaults to the last part of the URL path.
+        sha256 (str, optional): Expected SHA-256 of the file. Defaults to None.
+        cache_dir (str, optional): Cache directory. Defaults to weights_cache_dir().
+        offline (bool, optional): Never download, only use cached files. Defaults to the
+            PYTORCHWILDLIFE_OFFLINE environment variable.
+        verify (bool, optional): Re-hash the cached file before returning it. Defaults to False.
+        progress (bool, optional): Show a download progress bar. Defaults to True.
+
+    Returns:
+        str: Path of the cached weight file.
+    """
+    cache_dir = weights_cache_dir(cache_dir)
+    filename = filename or os.path.basename(urlparse(url).path)
+    path = os.path.join(cache_dir, filename)
+
+    # Fast path without locking for files already in the cache
+    if verify_weights(path, sha256=sha256, full=verify):
+        return path
+
+    os.makedirs(cache_dir, exist_ok=True)
+    with _file_lock(path):
+        # Another process may have finished the download while we were waiting for the lock
+        if verify_weights(path, sha256=sha256, full=verify):
+            return path
+
+        if os.path.isfile(path) and not os.path.isfile(_meta_path(path)):
+            # Adopting a file cached before checksum records existed, only if it is known to be complete:
+            # earlier versions could leave truncated files behind. Other files are downloaded again.
+            file_sha256 = _sha256(path)
+            valid = file_sha256 == sha256.lower() if sha256 else _is_complete_archive(path)
+            if valid:
+                with open(_meta_path(path), "w") as f:
+                    json.dump({"url": url, "sha256": file_sha256, "size": os.path.getsize(path)}, f)
+                return path
+
+        if _is_offline(offline):
+            raise FileNotFoundError(f"Offline mode: no valid cached weights for {url} in {cache_dir}")
+        print(f"Downloading {url} to {path}")
+        _download(url, path, sha256=sha256, progress=progress)
+    return path
@@ -1,2 +1,14 @@
-from .misc import *
-from .post_process import *
\ No newline at end of file
+from .._lazy import attach
+
+# Submodules are imported on first access to one of their names
+__getattr__, __dir__, __all__ = attach(__name__, {
+    "misc": ["process_video"],
+    "post_process": [
+        "save_detection_images", "save_detection_images_dots", "save_crop_images", "save_detection_json",
+        "save_detection_json_as_dots", "save_detection_classification_json", "save_detection_timelapse_json",
+        "save_detection_classification_timelapse_json", "detection_folder_separation",
+    ],
+    "journal": ["DetectionJournal"],
+    "result_cache": ["ResultCache", "model_fingerprint"],
+    "parity": ["compare_detection_results", "compare_classification_results"],
+})
\ No newline at end of file
@@ -0,0 +1,170 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Append-only checkpoint journal for resumable batch detection."""
+
+import os
+import json
+import numpy as np
+import supervision as sv
+
+__all__ = [
+    "DetectionJournal"
+]
+
+
+class DetectionJournal:
+    """
+    Append-only JSONL journal of per-image detection results.
+
+    Each finished image is written as one line and the file is fsynced periodically, so a killed run
+    loses at most the last few images. Passing the same journal to a detector's batch_image_detection
+    or iter_image_detection skips images that are already recorded, and load_results rebuilds the
+    result dicts expected by save_detection_json and save_detection_timelapse_json.
+    """
+
+    def __init__(self, path, fsync_every=64):
+        """
+        Initialize the journal.
+
+        Args:
+            path (str):
+                Path to the JSONL journal file. It is created on the first write if it does not exist.
+            fsync_every (int, optional):
+                Number of records written between two fsync calls. Defaults to 64.
+        """
+        self.path = path
+        self.fsync_every = fsync_every
+        self._file = None
+        self._pending = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _records(self):
+        """
+        Read the valid records of the journal. A partially written last line is ignored.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "r") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+
+    def _open(self):
+        if self._file is not None:
+            return
+        dirname = os.path.dirname(self.path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        # Drop a partially written last line left by an interrupted run before appending
+        if os.path.exists(self.path):
+            with open(self.path, "rb+") as f:
+                data = f.read()
+                if data and not data.endswith(b"\n"):
+                    f.truncate(data.rfind(b"\n") + 1)
+        self._file = open(self.path, "a")
+
+    def _write(self, record):
+        self._open()
+        self._file.write(json.dumps(record) + "\n")
+        self._pending += 1
+        if self._pending >= self.fsync_every:
+            self.flush()
+
+    def completed(self):
+        """
+        Get the image paths already recorded in the journal.
+
+        Returns:
+            set: Paths of the images that do not need to be processed again.
+        """
+        return {record["img_path"] for record in self._records()}
+
+    def append(self, result, img_path=None):
+        """
+        Record the detection result of one image.
+
+        Args:
+            result (dict):
+                Detection result containing image ID, detections, labels and normalized coordinates.
+            img_path (str, optional):
+                Path of the image on disk. Defaults to the result's image ID.
+        """
+        detections = result["detections"]
+        record = {
+            "img_path": str(img_path if img_path is not None else result["img_id"]),
+            "img_id": str(result["img_id"]),
+            "xyxy": np.asarray(detections.xyxy, dtype=float).tolist(),
+            "confidence": np.asarray(detections.confidence, dtype=float).tolist(),
+            "class_id": np.asarray(detections.class_id, dtype=int).tolist(),
+            "labels": list(result.get("labels", [])),
+        }
+        if "normalized_coords" in result:
+            record["normalized_coords"] = np.asarray(result["normalized_coords"], dtype=float).reshape(-1, 4).tolist()
+        self._write(record)
+
+    def mark_done(self, img_path):
+        """
+        Record an image that was processed but produced no result entry.
+
+        Args:
+            img_path (str):
+                Path of the image on disk.
+        """
+        self._write({"img_path": str(img_path), "img_id": None})
+
+    def flush(self):
+        """
+        Flush pending records and fsync the journal file.
+        """
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def close(self):
+        """
+        Flush and close the journal file.
+        """
+        if self._file is None:
+            return
+        self.flush()
+        self._file.close()
+        self._file = None
+
+    def load_results(self):
+        """
+        Rebuild detection results from the journal without re-running inference.
+
+        Returns:
+            list: Detection results in the format returned by batch_image_detection.
+        """
+        records = {}
+        for record in self._records():
+            records[record["img_path"]] = record
+
+        results = []
+        for record in records.values():
+            if record["img_id"] is None:
+                continue
+            res = {"img_id": record["img_id"]}
+            res["detections"] = sv.Detections(
+                xyxy=np.array(record["xyxy"], dtype=float).reshape(-1, 4),
+                confidence=np.array(record["confidence"], dtype=float),
+                class_id=np.array(record["class_id"], dtype=int)
+            )
+            res["labels"] = record["labels"]
+            if "normalized_coords" in record:
+                res["normalized_coords"] = record["normalized_coords"]
+            results.append(res)
+        return results
@@ -0,0 +1,131 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Parity checks between reference (fp32) and optimized inference results."""
+
+import numpy as np
+
+__all__ = [
+    "compare_detection_results",
+    "compare_classification_results"
+]
+
+
+def _box_iou(boxes_a, boxes_b):
+    """
+    Pairwise IoU between two sets of xyxy boxes.
+    """
+    tl = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    br = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    inter = np.prod(np.clip(br - tl, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    return inter / np.maximum(area_a[:, None] + area_b[None, :] - inter, 1e-9)
+
+
+def compare_detection_results(reference, results, iou_thres=0.9, conf_atol=0.05):
+    """
+    Compare detection results of an optimized model (reduced precision, compiled, exported...) with
+    reference results of the same images, typically produced by the fp32 model.
+
+    A reference detection is matched when the other run has a detection of the same class with an IoU
+    of at least iou_thres and a confidence within conf_atol.
+
+    Args:
+        reference (list):
+            Reference detection results containing image ID and detections.
+        results (list):
+            Detection results to check, for the same images.
+        iou_thres (float, optional):
+            Minimum IoU for two detections to match. Defaults to 0.9.
+        conf_atol (float, optional):
+            Maximum absolute confidence difference for two detections to match. Defaults to 0.05.
+
+    Returns:
+        dict: Number of compared images and detections, recall and precision of the matches
+        against the reference, mean IoU and maximum confidence difference of the matched detections,
+        and the image IDs that are not in parity.
+    """
+    results_by_id = {r["img_id"]: r for r in results}
+
+    n_ref, n_res, n_matched = 0, 0, 0
+    ious, conf_diffs, mismatched = [], [], []
+    for ref in reference:
+        res = results_by_id.get(ref["img_id"])
+        ref_det = ref["detections"]
+        n_ref += len(ref_det)
+        if res is None:
+            mismatched.append(ref["img_id"])
+            continue
+        res_det = res["detections"]
+        n_res += len(res_det)
+
+        matched = 0
+        if len(ref_det) and len(res_det):
+            iou = _box_iou(np.asarray(ref_det.xyxy, dtype=float), np.asarray(res_det.xyxy, dtype=float))
+            iou[ref_det.class_id[:, None] != res_det.class_id[None, :]] = 0
+            taken = np.zeros(len(res_det), dtype=bool)
+            # Greedy matching, most confident reference detections first
+            for i in np.argsort(-ref_det.confidence):
+                candidates = np.where(~taken & (iou[i] >= iou_thres))[0]
+                if len(candidates) == 0:
+                    continue
+                j = candidates[np.argmax(iou[i, candidates])]
+                conf_diff = abs(float(ref_det.confidence[i]) - float(res_det.confidence[j]))
+                if conf_diff > conf_atol:
+                    continue
+                taken[j] = True
+                matched += 1
+                ious.append(iou[i, j])
+                conf_diffs.append(conf_diff)
+
+        n_matched += matched
+        if matched != len(ref_det) or matched != len(res_det):
+            mismatched.append(ref["img_id"])
+
+    return {
+        "images": len(reference),
+        "reference_detections": n_ref,
+        "detections": n_res,
+        "recall": n_matched / n_ref if n_ref else 1.0,
+        "precision": n_matched / n_res if n_res else 1.0,
+        "mean_iou": float(np.mean(ious)) if ious else 1.0,
+        "max_conf_diff": float(np.max(conf_diffs)) if conf_diffs else 0.0,
+        "mismatched_images": mismatched,
+    }
+
+
+def compare_classification_results(reference, results, conf_atol=0.05):
+    """
+    Compare classification results of an optimized model with reference results of the same inputs.
+
+    Args:
+        reference (list):
+            Reference classification results containing image ID, class ID and confidence.
+        results (list):
+            Classification results to check, in the same order as the reference.
+        conf_atol (float, optional):
+            Maximum absolute confidence difference for two predictions to agree. Defaults to 0.05.
+
+    Returns:
+        dict: Number of compared predictions, top-1 agreement rate, maximum confidence difference
+        and the indices of the predictions that are not in parity.
+    """
+    assert len(reference) == len(results), \
+        f"Got {len(reference)} reference results and {len(results)} results to compare"
+
+    agreed, conf_diffs, mismatched = 0, [], []
+    for idx, (ref, res) in enumerate(zip(reference, results)):
+        conf_diff = abs(float(ref["confidence"]) - float(res["confidence"]))
+        conf_diffs.append(conf_diff)
+        if ref["class_id"] == res["class_id"] and conf_diff <= conf_atol:
+            agreed += 1
+        else:
+            mismatched.append(idx)
+
+    return {
+        "predictions": len(reference),
+        "agreement": agreed / len(reference) if len(reference) else 1.0,
+        "max_conf_diff": float(np.max(conf_diffs)) if conf_diffs else 0.0,
+        "mismatched": mismatched,
+    }
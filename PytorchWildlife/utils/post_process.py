@@ -12,6 +12,8 @@ import supervision as sv
 import shutil
 from pathlib import Path
 
+from ..data.results import DetectionBatch
+
 __all__ = [
     "save_detection_images",
     "save_detection_images_dots",
@@ -25,12 +27,39 @@ __all__ = [
 ]
 
 
+def _iter_detection_arrays(det_results, normalized=False):
+    """
+    Iterate over the detection arrays of each image of a list of result dicts or of a DetectionBatch.
+    For a DetectionBatch, the arrays are slices of the batch arrays and no per-image object is built.
+
+    Args:
+        det_results (list or DetectionBatch):
+            Detection results containing image ID, detections and normalized coordinates.
+        normalized (bool):
+            Whether to also return the normalized coordinates. Default to False.
+
+    Yields:
+        tuple: Image ID, xyxy boxes, confidences, class IDs and normalized boxes (None if not requested).
+    """
+    if isinstance(det_results, DetectionBatch):
+        normalized_coords = det_results.normalized_coords() if normalized else None
+        for i, img_id in enumerate(det_results.img_ids):
+            det = slice(det_results.offsets[i], det_results.offsets[i + 1])
+            yield (img_id, det_results.xyxy[det], det_results.confidence[det], det_results.class_id[det],
+                   normalized_coords[det] if normalized else None)
+    else:
+        for det_r in det_results:
+            det = det_r["detections"]
+            yield (det_r["img_id"], det.xyxy, det.confidence, det.class_id,
+                   np.array(det_r["normalized_coords"]).reshape(-1, 4) if normalized else None)
+
+
 def save_detection_images(results, output_dir, input_dir = None, overwrite=False):
     """
     Save detected images with bounding boxes and labels annotated.
 
     Args:
-        results (list or dict):
+        results (list, dict or DetectionBatch):
             Detection results containing image ID, detections, and labels.
         output_dir (str):
             Directory to save the annotated images.
@@ -44,7 +73,7 @@ def save_detection_images(results, output_dir, input_dir = None, overwrite=False
     os.makedirs(output_dir, exist_ok=True)
 
     with sv.ImageSink(target_dir_path=output_dir, overwrite=overwrite) as sink: 
-        if isinstance(results, list):
+        if isinstance(results, (list, DetectionBatch)):
             for entry in results:
                 annotated_img = lab_annotator.annotate(
                     scene=box_annotator.annotate(
@@ -83,7 +112,7 @@ def save_detection_images_dots(results, output_dir, input_dir = None, overwrite=
     Save detected images with bounding boxes and labels annotated.
 
     Args:
-        results (list or dict):
+        results (list, dict or DetectionBatch):
             Detection results containing image ID, detections, and labels.
         output_dir (str):
             Directory to save the annotated images.
@@ -97,7 +126,7 @@ def save_detection_images_dots(results, output_dir, input_dir = None, overwrite=
     os.makedirs(output_dir, exist_ok=True)
     
     with sv.ImageSink(target_dir_path=output_dir, overwrite=overwrite) as sink:
-        if isinstance(results, list):
+        if isinstance(results, (list, DetectionBatch)):
             for entry in results:
                 annotated_img = lab_annotator.annotate(
                     scene=dot_annotator.annotate(
@@ -137,7 +166,7 @@ def save_crop_images(results, output_dir, input_dir = None, overwrite=False):
     Save cropped images based on the detection bounding boxes.
 
     Args:
-        results (list):
+        results (list or DetectionBatch):
             Detection results containing image ID and detections.
         output_dir (str):
             Directory to save the cropped images.
@@ -150,7 +179,7 @@ def save_crop_images(results, output_dir, input_dir = None, overwrite=False):
     os.makedirs(output_dir, exist_ok=True)
 
     with sv.ImageSink(target_dir_path=output_dir, overwrite=overwrite) as sink:
-        if isinstance(results, list):
+        if isinstance(results, (list, DetectionBatch)):
             for entry in results:
                 for i, (xyxy, cat) in enumerate(zip(entry["detections"].xyxy, entry["detections"].class_id)):
                     cropped_img = sv.crop_image(
@@ -182,7 +211,7 @@ def save_detection_json(det_results, output_dir, categories=None, exclude_catego
     Save detection results to a JSON file.
 
     Args:
-        results (list):
+        results (list or DetectionBatch):
             Detection results containing image ID, bounding boxes, category, and confidence.
         output_dir (str):
             Path to save the output JSON file.
@@ -195,15 +224,13 @@ def save_detection_json(det_results, output_dir, categories=None, exclude_catego
     """
     json_results = {"annotations": [], "categories": categories}
 
-    for det_r in det_results:
+    for img_id, xyxy, confidence, category, _ in _iter_detection_arrays(det_results):
 
         # Category filtering
-        img_id = det_r["img_id"]
-        category = det_r["detections"].class_id
-
-        bbox = det_r["detections"].xyxy.astype(int)[~np.isin(category, exclude_category_ids)]
-        confidence =  det_r["detections"].confidence[~np.isin(category, exclude_category_ids)]
-        category = category[~np.isin(category, exclude_category_ids)]
+        keep = ~np.isin(category, exclude_category_ids)
+        bbox = xyxy.astype(int)[keep]
+        confidence = confidence[keep]
+        category = category[keep]
 
         # if not all([x in exclude_category_ids for x in category]):
         json_results["annotations"].append(
@@ -223,7 +250,7 @@ def save_detection_json_as_dots(det_results, output_dir, categories=None, exclud
     Save detection results to a JSON file in dots format.
 
     Args:
-        results (list):
+        results (list or DetectionBatch):
             Detection results containing image ID, bounding boxes, category, and confidence.
         output_dir (str):
             Path to save the output JSON file.
@@ -236,16 +263,14 @@ def save_detection_json_as_dots(det_results, output_dir, categories=None, exclud
     """
     json_results = {"annotations": [], "categories": categories}
 
-    for det_r in det_results:
+    for img_id, xyxy, confidence, category, _ in _iter_detection_arrays(det_results):
 
         # Category filtering
-        img_id = det_r["img_id"]
-        category = det_r["detections"].class_id
-
-        bbox = det_r["detections"].xyxy.astype(int)[~np.isin(category, exclude_category_ids)]
+        keep = ~np.isin(category, exclude_category_ids)
+        bbox = xyxy.astype(int)[keep]
         dot = np.array([[np.mean(row[::2]), np.mean(row[1::2])] for row in bbox])
-        confidence =  det_r["detections"].confidence[~np.isin(category, exclude_category_ids)]
-        category = category[~np.isin(category, exclude_category_ids)]
+        confidence = confidence[keep]
+        category = category[keep]
 
         # if not all([x in exclude_category_ids for x in category]):
         json_results["annotations"].append(
@@ -269,7 +294,7 @@ def save_detection_timelapse_json(
     Save detection results to a JSON file.
 
     Args:
-        results (list):
+        results (list or DetectionBatch):
             Detection results containing image ID, bounding boxes, category, and confidence.
         output_dir (str):
             Path to save the output JSON file.
@@ -289,15 +314,13 @@ def save_detection_timelapse_json(
         "images": []
     }
 
-    for det_r in det_results:
-
-        img_id = det_r["img_id"]
-        category_id_list = det_r["detections"].class_id
+    for img_id, xyxy, confidence, category_id_list, normalized in _iter_detection_arrays(det_results, normalized=True):
 
-        bbox_list = det_r["detections"].xyxy.astype(int)[~np.isin(category_id_list, exclude_category_ids)]
-        confidence_list =  det_r["detections"].confidence[~np.isin(category_id_list, exclude_category_ids)]
-        normalized_bbox_list = np.array(det_r["normalized_coords"])[~np.isin(category_id_list, exclude_category_ids)]
-        category_id_list = category_id_list[~np.isin(category_id_list, exclude_category_ids)]
+        keep = ~np.isin(category_id_list, exclude_category_ids)
+        bbox_list = xyxy.astype(int)[keep]
+        confidence_list = confidence[keep]
+        normalized_bbox_list = normalized[keep]
+        category_id_list = category_id_list[keep]
 
         # if not all([x in exclude_category_ids for x in category_id_list]):
         image_annotations = {
@@ -329,7 +352,7 @@ def save_detection_classification_json(
     Save classification results to a JSON file.
 
     Args:
-        det_results (list):
+        det_results (list or DetectionBatch):
             Detection results containing image ID, bounding boxes, detection category, and confidence.
         clf_results (list):
             classification results containing image ID, classification category, and confidence.
@@ -391,7 +414,7 @@ def save_detection_classification_timelapse_json(
     Save detection and classification results to a JSON file in the specified format.
 
     Args:
-        det_results (list):
+        det_results (list or DetectionBatch):
             Detection results containing image ID, bounding boxes, detection category, and confidence.
         clf_results (list):
             Classification results containing image ID, classification category, and confidence.
@@ -0,0 +1,415 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Content-addressed cache of per-image inference results, stored in a local SQLite file. """
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import weakref
+from collections import deque
+
+import numpy as np
+import torch
+
+__all__ = [
+    "ResultCache",
+    "model_fingerprint"
+]
+
+CHUNK_SIZE = 1 << 20
+
+# Maximum number of keys per SQL query, below the SQLite host parameter limit
+QUERY_CHUNK = 500
+
+
+def _hash_value(digest, value):
+    """
+    Feed a state dict value (tensor, nested tuple of tensors or plain value) to a hash.
+    """
+    if isinstance(value, torch.Tensor):
+        tensor = value.detach().cpu()
+        if tensor.is_quantized:
+            tensor = tensor.dequantize()
+        digest.update(f"{tensor.dtype}{tuple(tensor.shape)}".encode())
+        digest.update(tensor.contiguous().reshape(-1).view(torch.uint8).numpy().tobytes())
+    elif isinstance(value, (list, tuple)):
+        for v in value:
+            _hash_value(digest, v)
+    else:
+        digest.update(repr(value).encode())
+
+
+def model_fingerprint(model):
+    """
+    Hash identifying the weights of a model: its class and the bytes of its state dict, or of its exported
+    artifact for models running an ONNX or TorchScript file.
+
+    Args:
+        model (torch.nn.Module):
+            Detector or classifier.
+
+    Returns:
+        str: Hexadecimal hash.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(f"{type(model).__module__}.{type(model).__qualname__}".encode())
+    for name, value in model.state_dict().items():
+        digest.update(name.encode())
+        _hash_value(digest, value)
+    for module in model.modules():
+        path = getattr(module, "path", None)
+        if getattr(module, "session", None) is not None and isinstance(path, str) and os.path.isfile(path):
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _describe(value, depth=0):
+    """
+    JSON-friendly description of a preprocessing setting, e.g. a transform object and its attributes.
+    """
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_describe(v, depth + 1) for v in value]
+    if type(value).__repr__ is not object.__repr__:
+        return repr(value)
+    description = {"type": f"{type(value).__module__}.{type(value).__qualname__}"}
+    if depth < 2 and hasattr(value, "__dict__"):
+        description.update({k: _describe(v, depth + 1) for k, v in sorted(vars(value).items())
+                            if not k.startswith("_")})
+    return description
+
+
+class ResultCache:
+    """
+    Local cache of per-image inference results, keyed by a hash of the image file content and by a
+    namespace identifying the model weights, precision and preprocessing settings. Re-submitted files
+    (duplicated card copies, re-synced folders, repeated runs) are then answered without decoding or
+    inference, whatever their path. Entries are evicted least recently used first when the cache
+    exceeds max_size.
+
+    Passing the same cache to batch_image_detection, iter_image_detection or batch_image_classification
+    looks up every image first and only runs the misses through the model.
+
+    Example:
+        with ResultCache("results.sqlite", max_size=2 * 1024 ** 3) as cache:
+            results = detector.batch_image_detection("/path/to/images", cache=cache)
+            print(cache.stats()["hit_rate"])
+    """
+
+    def __init__(self, path, max_size=None, commit_every=64):
+        """
+        Open or create the cache.
+
+        Args:
+            path (str):
+                Path to the SQLite file.
+            max_size (int, optional):
+                Maximum bytes of stored results. Least recently used entries are evicted when it is exceeded.
+                Defaults to None (no limit).
+            commit_every (int, optional):
+                Number of stored results between two commits. Defaults to 64.
+        """
+        assert max_size is None or max_size > 0, "max_size should be positive"
+        self.path = path
+        self.max_size = max_size
+        self.commit_every = commit_every
+        dirname = os.path.dirname(path)
+        if dirname:
+            os.makedirs(dirname, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results (namespace TEXT, key TEXT, data BLOB, dtype TEXT, shape TEXT, "
+            "meta TEXT, nbytes INTEGER, last_used REAL, PRIMARY KEY (namespace, key)) WITHOUT ROWID"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS results_last_used ON results (last_used)")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS file_hashes (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, "
+            "hash TEXT) WITHOUT ROWID"
+        )
+        self._conn.commit()
+        self._pending = 0
+        self._fingerprints = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def file_hash(self, path):
+        """
+        Hash of the content of a file. Hashes are remembered by path, size and modification time, so
+        unchanged files are only read once.
+
+        Args:
+            path (str): Path of the file.
+
+        Returns:
+            str: Hexadecimal hash.
+        """
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        with self._lock:
+            row = self._conn.execute("SELECT size, mtime_ns, hash FROM file_hashes WHERE path = ?", (path,)).fetchone()
+        if row and row[0] == stat.st_size and row[1] == stat.st_mtime_ns:
+            return row[2]
+
+        digest = hashlib.blake2b(digest_size=16)
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                digest.update(chunk)
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO file_hashes VALUES (?, ?, ?, ?)",
+                               (path, stat.st_size, stat.st_mtime_ns, digest.hexdigest()))
+            self._mark_pending()
+        return digest.hexdigest()
+
+    def namespace(self, model, **settings):
+        """
+        Namespace of the results of a model: a hash of its weights, precision and quantization, and of the
+        preprocessing and post-processing settings that change its results.
+
+        Args:
+            model (torch.nn.Module):
+                Detector or classifier.
+            **settings:
+                Settings of the run, e.g. image size, transform and confidence threshold.
+
+        Returns:
+            str: Hexadecimal hash.
+        """
+        with self._lock:
+            if model not in self._fingerprints:
+                self._fingerprints[model] = model_fingerprint(model)
+            fingerprint = self._fingerprints[model]
+        description = {
+            "model": f"{type(model).__module__}.{type(model).__qualname__}",
+            "weights": fingerprint,
+            "precision": getattr(model, "precision", None),
+            "quantization": getattr(model, "quantization", None),
+            "settings": {k: _describe(v) for k, v in settings.items()},
+        }
+        return hashlib.blake2b(json.dumps(description, sort_keys=True).encode(), digest_size=16).hexdigest()
+
+    def get(self, namespace, keys):
+        """
+        Look up stored results and mark them as recently used. Hit and miss counters are not updated.
+
+        Args:
+            namespace (str): Namespace of the results.
+            keys (iterable): Content keys.
+
+        Returns:
+            dict: (array, meta) result of each key found.
+        """
+        keys = list(dict.fromkeys(keys))
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), QUERY_CHUNK):
+                chunk = keys[i:i + QUERY_CHUNK]
+                rows = self._conn.execute(
+                    f"SELECT key, data, dtype, shape, meta FROM results WHERE namespace = ? "
+                    f"AND key IN ({','.join('?' * len(chunk))})", [namespace, *chunk]
+                ).fetchall()
+                for key, data, dtype, shape, meta in rows:
+                    array = np.frombuffer(data, dtype=np.dtype(dtype)).reshape(json.loads(shape)).copy()
+                    found[key] = (array, json.loads(meta) if meta else None)
+            if found:
+                now = time.time()
+                self._conn.executemany("UPDATE results SET last_used = ? WHERE namespace = ? AND key = ?",
+                                       [(now, namespace, key) for key in found])
+                self._mark_pending()
+        return found
+
+    def put(self, namespace, key, array, meta=None):
+        """
+        Store the result of one image.
+
+        Args:
+            namespace (str): Namespace of the result.
+            key (str): Content key.
+            array (numpy.ndarray): Result array, e.g. predictions or logits.
+            meta (dict, optional): JSON-serializable metadata, e.g. the original image size. Defaults to None.
+        """
+        array = np.ascontiguousarray(array)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (namespace, key, array.tobytes(), array.dtype.str, json.dumps(list(array.shape)),
+                 json.dumps(meta) if meta is not None else None, array.nbytes, time.time())
+            )
+            self._mark_pending()
+
+    def plan(self, namespace, items, keys):
+        """
+        Look up the results of an ordered list of items for one run. See CachePlan.
+
+        Args:
+            namespace (str): Namespace of the results.
+            items (list): Unique item identifiers, e.g. image paths, in output order.
+            keys (list): Content key of each item.
+
+        Returns:
+            CachePlan: The plan of the run.
+        """
+        return CachePlan(self, namespace, items, keys)
+
+    def _mark_pending(self):
+        self._pending += 1
+        if self._pending >= self.commit_every:
+            self.flush()
+
+    def flush(self):
+        """
+        Commit pending writes and evict entries if the cache exceeds max_size.
+        """
+        with self._lock:
+            self._conn.commit()
+            self._pending = 0
+            if self.max_size is not None and self.size() > self.max_size:
+                self.evict()
+
+    def evict(self, max_size=None):
+        """
+        Evict least recently used entries until the stored results fit max_size.
+
+        Args:
+            max_size (int, optional): Target size in bytes. Defaults to the max_size of the cache.
+
+        Returns:
+            int: Number of evicted entries.
+        """
+        max_size = max_size if max_size is not None else self.max_size
+        if max_size is None:
+            return 0
+        with self._lock:
+            # Keeping the most recently used entries whose cumulated size fits the budget
+            cursor = self._conn.execute(
+                "DELETE FROM results WHERE (namespace, key) IN (SELECT namespace, key FROM ("
+                "SELECT namespace, key, SUM(nbytes) OVER (ORDER BY last_used DESC, key) AS total FROM results"
+                ") WHERE total > ?)", (max_size,)
+            )
+            self._conn.commit()
+            self.evictions += cursor.rowcount
+        return cursor.rowcount
+
+    def size(self):
+        """
+        Bytes of stored results.
+        """
+        with self._lock:
+            return self._conn.execute("SELECT COALESCE(SUM(nbytes), 0) FROM results").fetchone()[0]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def stats(self):
+        """
+        Cache statistics since it was opened.
+
+        Returns:
+            dict: Number of hits and misses, hit rate, evictions, stored entries and their size in bytes.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self),
+            "size": self.size(),
+        }
+
+    def clear(self):
+        """
+        Remove all stored results and file hashes.
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM results")
+            self._conn.execute("DELETE FROM file_hashes")
+            self._conn.commit()
+            self._conn.execute("VACUUM")
+
+    def close(self):
+        """
+        Commit pending writes and close the cache file.
+        """
+        with self._lock:
+            if self._conn is None:
+                return
+            self.flush()
+            self._conn.close()
+            self._conn = None
+
+
+class CachePlan:
+    """
+    Cache lookups of one run over an ordered list of items. misses lists the items to run through the
+    model, one per distinct content key; the other items are answered by the cache or by the result of
+    an identical item of the same run. While the misses are run, before yields the answered items
+    preceding each miss, so the results of the run keep the item order, and store saves each new result.
+    """
+
+    def __init__(self, cache, namespace, items, keys):
+        self.cache = cache
+        self.namespace = namespace
+        self._index = {item: i for i, item in enumerate(items)}
+        self._keys = dict(zip(items, keys))
+        self._values = cache.get(namespace, keys)
+
+        self.misses = []
+        scheduled = set()
+        self._answered = deque()
+        for item, key in zip(items, keys):
+            if key not in self._values and key not in scheduled:
+                scheduled.add(key)
+                self.misses.append(item)
+            else:
+                self._answered.append(item)
+        cache.hits += len(self._answered)
+        cache.misses += len(self.misses)
+
+    def before(self, item):
+        """
+        Yield the answered items preceding item, as (item, array, meta) tuples.
+        """
+        index = self._index[item]
+        while self._answered and self._index[self._answered[0]] < index:
+            key = self._keys[self._answered[0]]
+            if key not in self._values:
+                # Duplicate of a miss that has not been run yet
+                break
+            array, meta = self._values[key]
+            yield self._answered.popleft(), array.copy(), meta
+
+    def store(self, item, array, meta=None):
+        """
+        Save the result of a miss.
+        """
+        key = self._keys[item]
+        self._values[key] = (array, meta)
+        self.cache.put(self.namespace, key, array, meta)
+
+    def remaining(self):
+        """
+        Yield the answered items left once all misses are stored, then commit the new results.
+        """
+        while self._answered:
+            item = self._answered.popleft()
+            array, meta = self._values[self._keys[item]]
+            yield item, array.copy(), meta
+        self.cache.flush()
@@ -10,6 +10,7 @@ import os
 import torch
 
 # Importing the model, dataset, transformations and utility functions from PytorchWildlife
+from PytorchWildlife import models as pw_models
 from PytorchWildlife.models import detection as pw_detection
 from PytorchWildlife import utils as pw_utils
  
@@ -41,6 +42,8 @@ os.makedirs(os.path.join("..","temp"), exist_ok=True) # ASK: Why do we need this
 # Initializing the detection and classification models
 detection_model = None
 classification_model = None
+# Keeping loaded models resident, so that switching back to a model does not reload it
+model_registry = pw_models.ModelRegistry(memory_budget=4 * 1024 ** 3)
     
 # Defining functions for different detection scenarios
 def load_models(det, clf, wpath=None, wclass=None):
@@ -48,22 +51,21 @@ def load_models(det, clf, wpath=None, wclass=None):
     global detection_model, classification_model
     if det != "None":
         if det == "HerdNet General":
-            detection_model = pw_detection.HerdNet(device=DEVICE)
+            detection_model = model_registry.get(pw_detection.HerdNet, device=DEVICE)
         elif det == "HerdNet Ennedi":
-            detection_model = pw_detection.HerdNet(device=DEVICE, dataset="ennedi")
-        elif det == "MegaDetectorV6":
-            detection_model = pw_detection.__dict__[det](device=DEVICE, pretrained=True)
+            detection_model = model_registry.get(pw_detection.HerdNet, device=DEVICE, dataset="ennedi")
         else:
-            detection_model = pw_detection.__dict__[det](device=DEVICE, pretrained=True)
+            detection_model = model_registry.get(getattr(pw_detection, det), device=DEVICE, pretrained=True)
 
     if clf != "None":
         # Create an exception for custom weights
         if clf == "CustomWeights":
             if (wpath is not None) and (wclass is not None): 
                 wclass = ast.literal_eval(wclass)
-                classification_model = pw_classification.__dict__[clf](weights=wpath, class_names=wclass, device=DEVICE)
+                classification_model = model_registry.get(getattr(pw_classification, clf), weights=wpath,
+                                                          class_names=wclass, device=DEVICE)
         else:
-            classification_model = pw_classification.__dict__[clf](device=DEVICE, pretrained=True)
+            classification_model = model_registry.get(getattr(pw_classification, clf), device=DEVICE, pretrained=True)
 
     return "Loaded Detector: {}. Loaded Classifier: {}".format(det, clf)
 
@@ -146,9 +148,9 @@ def batch_detection(zip_file, timelapse, det_conf_thres):
         tgt_folder_path = os.path.join(extract_path, extracted_files[0])
     else:
         tgt_folder_path = extract_path
-    # If the detection model is HerdNet set batch_size to 1
+    # HerdNet pools the patches of its batch of full-resolution images, so fewer images are loaded at once
     if detection_model.__class__.__name__.__contains__("HerdNet"):
-        det_results = detection_model.batch_image_detection(tgt_folder_path, batch_size=1, det_conf_thres=det_conf_thres, id_strip=tgt_folder_path) 
+        det_results = detection_model.batch_image_detection(tgt_folder_path, batch_size=4, det_conf_thres=det_conf_thres, id_strip=tgt_folder_path) 
     else:
         det_results = detection_model.batch_image_detection(tgt_folder_path, batch_size=16, det_conf_thres=det_conf_thres, id_strip=tgt_folder_path)
 
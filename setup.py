@@ -24,7 +24,6 @@ setup(
         'ultralytics-yolov5',
         'ultralytics',
         'chardet',
-        'wget',
         'ultralytics',
         'setuptools==59.5.0',
         'scikit-learn',
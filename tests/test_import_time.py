@@ -0,0 +1,65 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Import-time regression tests: importing the package must stay fast and must not load heavy dependencies. """
+
+import os
+import sys
+import json
+import importlib
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported when a model or utility using them is first accessed
+HEAVY_MODULES = ("ultralytics", "yolov5", "cv2", "supervision")
+HERDNET_PREFIX = "PytorchWildlife.models.detection.herdnet."
+
+# Upper bound of the import time, in seconds, generous enough for slow CI machines
+MAX_IMPORT_SECONDS = 2.0
+
+IMPORT_SCRIPT = """
+import sys, json, time
+start = time.perf_counter()
+import PytorchWildlife
+from PytorchWildlife import data, models, utils
+from PytorchWildlife.models import detection, classification
+elapsed = time.perf_counter() - start
+print(json.dumps({"elapsed": elapsed, "modules": sorted(sys.modules)}))
+"""
+
+
+def _import_in_subprocess():
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.environ.get("PYTHONPATH")])))
+    output = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT], cwd=ROOT, env=env, check=True,
+                            capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def test_import_does_not_load_heavy_dependencies():
+    modules = _import_in_subprocess()["modules"]
+    for name in HEAVY_MODULES:
+        loaded = [m for m in modules if m == name or m.startswith(name + ".")]
+        assert not loaded, f"Importing PytorchWildlife loaded {loaded}"
+    loaded = [m for m in modules if m.startswith(HERDNET_PREFIX)]
+    assert not loaded, f"Importing PytorchWildlife loaded the HerdNet modules {loaded}"
+
+
+def test_import_time():
+    # Best of three runs, so that a cold file cache does not fail the test
+    elapsed = min(_import_in_subprocess()["elapsed"] for _ in range(3))
+    assert elapsed < MAX_IMPORT_SECONDS, f"Importing PytorchWildlife took {elapsed:.2f}s"
+
+
+def test_lazy_tables_match_submodules():
+    from PytorchWildlife import _lazy
+    import PytorchWildlife.models.detection
+    import PytorchWildlife.models.classification
+
+    for package_name, submodules in list(_lazy.TABLES.items()):
+        for submodule, names in submodules.items():
+            if names is None:
+                continue
+            module = importlib.import_module(f"{package_name}.{submodule}")
+            assert list(names) == list(module.__all__), \
+                f"The lazy table of {package_name} for {submodule} differs from its __all__"
@@ -0,0 +1,60 @@
+# Copyright (c) Microsoft Corporation. All rights reserved.
+# Licensed under the MIT License.
+
+""" Tests of the sharded runner with CPU workers and a stub model, so that no weights or GPUs are needed. """
+
+import os
+import time
+
+import pytest
+
+from PytorchWildlife.models.sharding import ShardedRunner
+
+NUM_IMAGES = 20
+PATHS = [f"image_{i:02d}.jpg" for i in range(NUM_IMAGES)]
+
+
+class StubDetector:
+    """
+    Picklable stand-in for a detector: tags each path with the process that handled it.
+    """
+
+    def __init__(self, device="cpu", fail_on=None, delay=0.05):
+        self.device = device
+        self.fail_on = fail_on
+        self.delay = delay
+
+    def multi_image_detection(self, imgs, img_paths=None, **kwargs):
+        # Keeping each chunk busy for a moment, so that the other workers take chunks too
+        time.sleep(self.delay)
+        if self.fail_on in img_paths:
+            raise ValueError(f"Cannot process {self.fail_on}")
+        return [{"img_id": path, "pid": os.getpid(), "device": self.device, **kwargs} for path in img_paths]
+
+
+@pytest.fixture(scope="module")
+def runner():
+    # Spawning the workers is slow, so the passing tests share them
+    with ShardedRunner(StubDetector, devices=["cpu"] * 3, chunk_size=2) as runner:
+        yield runner
+
+
+def test_results_in_input_order(runner):
+    results = runner.run(PATHS, det_conf_thres=0.3)
+    assert [result["img_id"] for result in results] == PATHS
+    assert all(result["det_conf_thres"] == 0.3 and result["device"] == "cpu" for result in results)
+
+
+def test_chunks_spread_over_workers(runner):
+    results = runner.run(PATHS)
+    pids = {result["pid"] for result in results}
+    assert os.getpid() not in pids
+    assert len(pids) > 1, "All chunks were run by a single worker"
+
+
+def test_failing_image_raises():
+    runner = ShardedRunner(StubDetector, {"fail_on": PATHS[7]}, devices=["cpu"] * 3, chunk_size=2)
+    with pytest.raises(RuntimeError, match=PATHS[7]):
+        runner.run(PATHS)
+    # The runner terminated its workers on the failure
+    assert runner._workers == []